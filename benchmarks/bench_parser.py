@@ -0,0 +1,221 @@
+"""
+Microbenchmark of :data:`councilbot.parser.PARSE_TREE`.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_parser --output before.json
+
+The corpus consists of the commands documented in ``docs/manual.rst`` (with
+the nickname of the bot already stripped, as the bot does before parsing),
+plus messages which are not commands. Each is parsed with the compiled
+dispatch of the tree and with a reference implementation which tries the
+children of each node in order, as the parser used to. The results are
+written as JSON, with the time per parse in seconds.
+"""
+import argparse
+import json
+import pathlib
+import platform
+import statistics
+import sys
+import time
+
+from datetime import datetime
+
+from councilbot import parser
+
+
+CORPUS = [
+    "!create Deprecate XEP-0001",
+    "!create Accept \"Cryptographic Hash Function Recommendations for XMPP\" "
+    "as Experimental XEP [hash-recommendations]",
+    "!delete Deprecate XEP-0001",
+    "!list",
+    "!show hash-recommendations",
+    "!+1 hash-recommendations",
+    "!+1 Deprecate XEP-0001: about time",
+    "!+0 hash-recommendations",
+    "!-0 XEP-0001",
+    "!-1 hash-recommendations: needs more work on the security considerations",
+    "please create a poll on Deprecate XEP-0001",
+    "I want to create a new poll on Deprecate XEP-0001",
+    "please list all open polls",
+    "list open polls",
+    "I want to vote +1 on hash-recommendations",
+    "vote -1 on hash-recommendations: see list",
+    "please delete the poll on Deprecate XEP-0001",
+    "I want to delete poll XEP-0001",
+    "please show the votes on hash-recommendations",
+    "show votes hash-recommendations",
+    "conclude all pending votes",
+    "who are you",
+    "thanks!",
+    "help",
+    # not commands
+    "I think we should discuss this on the list first",
+    "make me a sandwich",
+]
+
+
+def parse_sequential(node, words, params={}):
+    """
+    Reference implementation of :meth:`~.parser.TextNode.parse`, which copies
+    the words and tries the pattern of each child in order.
+    """
+    remaining_words = list(words)
+    while remaining_words and remaining_words[0].casefold() in node.skip:
+        del remaining_words[0]
+
+    if not remaining_words:
+        return node, remaining_words, params
+
+    first_word = remaining_words[0]
+    for child in node.children:
+        match = child.match.match(first_word)
+        if match is None:
+            continue
+
+        groups = match.groupdict()
+
+        if child.save is not None:
+            params = params.copy()
+            params[child.save] = (
+                child.save_const or groups.get("save") or first_word
+            )
+
+        to_push = groups.get("push")
+
+        if to_push:
+            remaining_words.insert(1, to_push)
+
+        return parse_sequential(child, remaining_words[1:], params)
+
+    if node.action is not None:
+        return node, remaining_words, params
+
+    return None
+
+
+def parse_compiled(node, words):
+    return node.parse(words)
+
+
+IMPLEMENTATIONS = [
+    ("compiled", parse_compiled),
+    ("sequential", parse_sequential),
+]
+
+
+def measure(func, tree, commands, rounds, repeat):
+    """
+    Return the mean time per parse of each of `repeat` runs over `commands`.
+    """
+    results = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            for words in commands:
+                func(tree, words)
+        results.append((time.perf_counter() - t0) / (rounds * len(commands)))
+    return results
+
+
+def check_equivalence(commands):
+    for words in commands:
+        compiled = parser.PARSE_TREE.parse(words)
+        sequential = parse_sequential(parser.PARSE_TREE, words)
+        if compiled is not None:
+            compiled = (compiled[0], list(compiled[1]), compiled[2])
+        if compiled != sequential:
+            raise AssertionError(
+                "implementations differ for {!r}: {!r} != {!r}".format(
+                    words, compiled, sequential,
+                )
+            )
+
+
+def summarise(durations):
+    return {
+        "n": len(durations),
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.mean(durations),
+        "max": max(durations),
+    }
+
+
+def run(args):
+    commands = [
+        list(filter(None, command.split(" ")))
+        for command in CORPUS
+    ]
+    check_equivalence(commands)
+
+    t0 = time.perf_counter()
+    parser.PARSE_TREE.compile()
+    compile_time = time.perf_counter() - t0
+
+    results = [{
+        "benchmark": "compile",
+        "seconds": summarise([compile_time]),
+    }]
+    for name, func in IMPLEMENTATIONS:
+        durations = measure(func, parser.PARSE_TREE, commands,
+                            args.rounds, args.repeat)
+        results.append({
+            "benchmark": "parse_{}".format(name),
+            "commands": len(commands),
+            "seconds": summarise(durations),
+        })
+        print("{:<20} median={:.3e}s".format(
+            name, statistics.median(durations),
+        ), file=sys.stderr)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "rounds": args.rounds,
+            "timestamp": datetime.utcnow().isoformat(),
+        },
+        "results": results,
+    }
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description="Benchmark the command parser.",
+    )
+    argparser.add_argument(
+        "--rounds",
+        type=int,
+        default=1000,
+        help="Passes over the corpus per measurement (default: %(default)s)",
+    )
+    argparser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of measurements (default: %(default)s)",
+    )
+    argparser.add_argument(
+        "-o", "--output",
+        type=pathlib.Path,
+        default=None,
+        help="Write the JSON results to this file instead of stdout",
+    )
+    args = argparser.parse_args()
+
+    result = run(args)
+
+    if args.output is None:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        with args.output.open("w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
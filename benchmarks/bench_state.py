@@ -0,0 +1,464 @@
+"""
+Benchmarks of :class:`councilbot.state.State` at growing numbers of polls.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_state --output before.json
+
+Each state operation is measured on a state holding ``--sizes`` active polls,
+each with ``--depths`` votes per member. ``Poll.dump`` and ``Poll.load`` are
+measured on a single poll per history depth. The results are written as
+JSON, one entry per benchmark and parameter set, with the time per operation
+in seconds, so that the output of two runs can be diffed.
+
+The ``poll_memory`` benchmark builds ``--memory-polls`` polls per history
+depth and reports the memory allocated per poll (as traced by
+:mod:`tracemalloc`) in bytes.
+
+The ``memory`` backend is used by default, which measures the state machine
+alone. Passing ``--backend toml`` or ``--backend sqlite`` includes the storage
+(in a temporary directory); note that the default ``strict`` durability then
+syncs every operation.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import pathlib
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest.mock
+
+from datetime import datetime, timedelta
+
+import aioxmpp
+
+from councilbot import state, storage
+
+
+NMEMBERS = 5
+WORDS = [
+    "accept", "deprecate", "obsolete", "advance", "reject", "xep", "muc",
+    "pubsub", "omemo", "jingle", "stanza", "roster", "upload", "carbons",
+    "reactions", "moderation", "bookmarks", "avatar", "presence", "archive",
+]
+
+
+def make_members(n=NMEMBERS):
+    return [
+        aioxmpp.JID.fromstr("member{}@council.example".format(i))
+        for i in range(n)
+    ]
+
+
+def make_subject(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(4))
+
+
+@contextlib.contextmanager
+def make_state(backend, members, durability):
+    with contextlib.ExitStack() as stack:
+        config = {
+            "council": {
+                "members": [
+                    {"address": member, "nick": member.localpart}
+                    for member in members
+                ],
+            },
+            "state": {
+                "backend": backend,
+                "durability": durability,
+            },
+        }
+        if backend != "memory":
+            config["state"]["directory"] = stack.enter_context(
+                tempfile.TemporaryDirectory()
+            )
+        s = state.State(config)
+        stack.callback(s.close)
+        yield s
+
+
+class Fixture:
+    """
+    A state with `npolls` active polls, each with `depth` votes per member.
+    """
+
+    def __init__(self, s, members, npolls, depth, rng):
+        super().__init__()
+        self.state = s
+        self.members = members
+        self.rng = rng
+        self._message_ids = itertools.count()
+        self.poll_ids = []
+        self.subjects = []
+
+        for _ in range(npolls):
+            subject = make_subject(rng)
+            _, poll_id = s.create_poll(members[0], self.message_id(),
+                                       subject)
+            self.poll_ids.append(poll_id)
+            self.subjects.append(subject)
+
+        values = list(state.VoteValue)
+        for poll_id in self.poll_ids:
+            for _ in range(depth):
+                for member in members:
+                    s.cast_vote(member, self.message_id(), poll_id,
+                                rng.choice(values), None)
+        s.compact_journal()
+
+    def message_id(self):
+        return "m{}".format(next(self._message_ids))
+
+    def random_poll(self):
+        return self.rng.choice(self.poll_ids)
+
+    def random_member(self):
+        return self.rng.choice(self.members)
+
+
+def measure(func, argvs):
+    """
+    Call `func` with each of `argvs` and return the duration of each call.
+    """
+    durations = []
+    for argv in argvs:
+        t0 = time.perf_counter()
+        func(*argv)
+        durations.append(time.perf_counter() - t0)
+    return durations
+
+
+def bench_create_poll(fx, nops):
+    s = fx.state
+    return measure(
+        s.create_poll,
+        [
+            (fx.members[0], fx.message_id(), make_subject(fx.rng))
+            for _ in range(nops)
+        ],
+    )
+
+
+def bench_cast_vote(fx, nops):
+    s = fx.state
+    return measure(
+        s.cast_vote,
+        [
+            (fx.random_member(), fx.message_id(), fx.random_poll(),
+             state.VoteValue.ACK, "looks good")
+            for _ in range(nops)
+        ],
+    )
+
+
+def bench_revert_last_transaction(fx, nops):
+    s = fx.state
+    durations = []
+    for _ in range(nops):
+        member, message_id = fx.random_member(), fx.message_id()
+        s.cast_vote(member, message_id, fx.random_poll(),
+                    state.VoteValue.VETO, None)
+        durations.extend(
+            measure(s.revert_last_transaction, [(member, message_id)])
+        )
+    return durations
+
+
+def bench_find_poll(fx, nops):
+    s = fx.state
+    # half exact matches, half fuzzy matches of subject words
+    queries = [
+        (fx.random_poll() if i % 2 else fx.rng.choice(fx.subjects),)
+        for i in range(nops)
+    ]
+
+    def find(text):
+        try:
+            s.find_poll(text)
+        except KeyError:
+            pass
+
+    return measure(find, queries)
+
+
+def bench_expire_polls(fx, nops):
+    # nothing is due; this runs before every command
+    return measure(fx.state.expire_polls, [()] * nops)
+
+
+def bench_reload_polls(fx, nops):
+    return measure(fx.state.reload_polls, [()] * nops)
+
+
+def bench_expire_all_polls(fx, nops):
+    # concludes every poll, so it has to run last
+    s = fx.state
+    poll_ids = list(s.active_polls)
+    latest = max(s.get_poll(poll_id).end_time for poll_id in poll_ids)
+    with unittest.mock.patch.object(
+            s, "_get_rounded_time",
+            return_value=latest + timedelta(hours=1)):
+        total, = measure(s.expire_polls, [()])
+    return [total / len(poll_ids)]
+
+
+STATE_BENCHMARKS = [
+    ("expire_polls", bench_expire_polls),
+    ("find_poll", bench_find_poll),
+    ("reload_polls", bench_reload_polls),
+    ("cast_vote", bench_cast_vote),
+    ("revert_last_transaction", bench_revert_last_transaction),
+    ("create_poll", bench_create_poll),
+    ("expire_all_polls", bench_expire_all_polls),
+]
+
+
+def make_poll(members, depth, rng):
+    poll = state.Poll("2020-01-01-tbench-subject",
+                      datetime(2020, 1, 1),
+                      timedelta(days=14),
+                      make_subject(rng),
+                      members)
+    values = list(state.VoteValue)
+    timestamp = datetime(2020, 1, 1)
+    for i in range(depth):
+        for member in members:
+            poll.push_vote(member, rng.choice(values), "remark {}".format(i),
+                           timestamp + timedelta(seconds=i))
+    return poll
+
+
+def bench_poll_dump(poll, nops):
+    def dump():
+        poll.dump(io.StringIO())
+
+    return measure(dump, [()] * nops)
+
+
+def bench_poll_load(poll, nops):
+    buf = io.StringIO()
+    poll.dump(buf)
+    data = buf.getvalue()
+
+    def load():
+        state.Poll.load(io.StringIO(data))
+
+    return measure(load, [()] * nops)
+
+
+def measure_poll_memory(members, npolls, depth, rng):
+    """
+    Return the number of bytes allocated per poll for `npolls` polls with
+    `depth` votes per member.
+    """
+    # build the inputs first, so that only the polls are traced
+    args = [
+        ("2020-01-01-t{}-subject".format(i), make_subject(rng))
+        for i in range(npolls)
+    ]
+    values = list(state.VoteValue)
+    votes = [
+        (rng.choice(values),
+         "remark {}".format(i) if i % 4 == 0 else None,
+         timedelta(seconds=i))
+        for i in range(depth)
+    ]
+    start = datetime(2020, 1, 1)
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        polls = []
+        for id_, subject in args:
+            poll = state.Poll(id_, datetime(2020, 1, 1), timedelta(days=14),
+                              subject, members)
+            for value, remark, offset in votes:
+                for member in members:
+                    # a new timestamp per vote, as when loading a poll
+                    poll.push_vote(member, value, remark, start + offset)
+            polls.append(poll)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return (after - before) / npolls
+
+
+POLL_BENCHMARKS = [
+    ("poll_dump", bench_poll_dump),
+    ("poll_load", bench_poll_load),
+]
+
+
+def summarise(durations):
+    return {
+        "n": len(durations),
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.mean(durations),
+        "max": max(durations),
+    }
+
+
+def nops_for(npolls, depth, budget):
+    """
+    Number of repetitions for a state of the given size, so that large sizes
+    do not take forever.
+    """
+    return max(3, budget // max(1, npolls * depth // 100))
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    members = make_members()
+    results = []
+
+    def record(name, npolls, depth, durations):
+        result = {
+            "benchmark": name,
+            "polls": npolls,
+            "depth": depth,
+            "seconds": summarise(durations),
+        }
+        results.append(result)
+        print("{:<24} polls={:<6} depth={:<5} median={:.3e}s".format(
+            name, npolls, depth, result["seconds"]["median"],
+        ), file=sys.stderr)
+
+    for npolls, depth in itertools.product(args.sizes, args.depths):
+        nops = nops_for(npolls, depth, args.ops)
+        with make_state(args.backend, members, args.durability) as s:
+            t0 = time.perf_counter()
+            fx = Fixture(s, members, npolls, depth, rng)
+            print("setup polls={} depth={} took {:.1f}s".format(
+                npolls, depth, time.perf_counter() - t0,
+            ), file=sys.stderr)
+            for name, func in STATE_BENCHMARKS:
+                if args.only and name not in args.only:
+                    continue
+                record(name, npolls, depth, func(fx, nops))
+
+    for depth in args.poll_depths:
+        poll = make_poll(members, depth, rng)
+        for name, func in POLL_BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            record(name, 1, depth, func(poll, args.ops))
+
+    if not args.only or "poll_memory" in args.only:
+        for depth in args.poll_depths:
+            nbytes = measure_poll_memory(members, args.memory_polls, depth,
+                                         rng)
+            results.append({
+                "benchmark": "poll_memory",
+                "polls": args.memory_polls,
+                "depth": depth,
+                "bytes_per_poll": nbytes,
+            })
+            print("{:<24} polls={:<6} depth={:<5} {:.0f} bytes/poll".format(
+                "poll_memory", args.memory_polls, depth, nbytes,
+            ), file=sys.stderr)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "backend": args.backend,
+            "durability": args.durability,
+            "members": len(members),
+            "seed": args.seed,
+            "timestamp": datetime.utcnow().isoformat(),
+        },
+        "results": results,
+    }
+
+
+def int_list(s):
+    return [int(item) for item in s.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the poll state at growing sizes."
+    )
+    parser.add_argument(
+        "--backend",
+        choices=sorted(storage.BACKENDS),
+        default="memory",
+    )
+    parser.add_argument(
+        "--durability",
+        choices=[mode.value for mode in state.Durability],
+        default=state.Durability.STRICT.value,
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int_list,
+        default=[10, 100, 1000, 10000],
+        help="Comma-separated numbers of active polls (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--depths",
+        type=int_list,
+        default=[1, 10],
+        help="Comma-separated numbers of votes per member and poll "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--poll-depths",
+        type=int_list,
+        default=[1, 10, 100, 1000],
+        help="History depths for Poll.dump and Poll.load "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--memory-polls",
+        type=int,
+        default=100,
+        help="Number of polls for the memory benchmark (default: "
+        "%(default)s)",
+    )
+    parser.add_argument(
+        "--ops",
+        type=int,
+        default=200,
+        help="Operations per benchmark on small states (default: "
+        "%(default)s)",
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        default=[],
+        metavar="BENCHMARK",
+        help="Only run the given benchmark; may be repeated",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "-o", "--output",
+        type=pathlib.Path,
+        default=None,
+        help="Write the JSON results to this file instead of stdout",
+    )
+    args = parser.parse_args()
+
+    result = run(args)
+
+    if args.output is None:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        with args.output.open("w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import typing
+
+import aioxmpp.callbacks
+
+from .state import Durability, State
+
+
+logger = logging.getLogger(__name__)
+
+# how long to wait for more changes before syncing them together
+GROUP_COMMIT_DELAY = 0.005
+RELAXED_SYNC_DELAY = 1.0
+
+
+class AsyncState:
+    """
+    Run all operations on a :class:`~.state.State` on a dedicated thread.
+
+    :param state: The state to wrap.
+    :param loop: The event loop to deliver results and signals on.
+
+    The methods of :class:`~.state.State` do blocking disk I/O (syncs,
+    renames and parsing of poll files), which must not stall the event loop.
+    They are thus executed on a single worker thread, which also keeps the
+    in-memory state single-writer: operations run one at a time and in the
+    order in which they were submitted.
+
+    Functions passed to :meth:`submit` and :meth:`run` may use :attr:`state`
+    freely. Outside of those, only the immutable council member data of the
+    state may be accessed.
+
+    Unless the :attr:`~.state.State.durability` of the state is
+    :attr:`~.state.Durability.STRICT`, every call schedules a
+    :meth:`~.state.State.sync` after a short delay, so that the changes of all
+    calls made in the meantime are synced at once. With
+    :attr:`~.state.Durability.GROUP`, the results of :meth:`submit` and
+    :meth:`run` are only available after that sync.
+
+    .. signal:: on_poll_concluded(poll_id, reason)
+
+       Emitted on the event loop when :attr:`state` emits
+       :meth:`~.state.State.on_poll_concluded`.
+
+    .. signal:: on_next_expiry_changed()
+
+       Emitted on the event loop when :attr:`state` emits
+       :meth:`~.state.State.on_next_expiry_changed`.
+
+    .. autoattribute:: state
+
+    .. automethod:: submit
+
+    .. automethod:: run
+
+    .. automethod:: close
+    """
+
+    on_poll_concluded = aioxmpp.callbacks.Signal()
+    on_next_expiry_changed = aioxmpp.callbacks.Signal()
+
+    def __init__(self, state: State, loop=None):
+        super().__init__()
+        self._state = state
+        self._loop = loop or asyncio.get_event_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="state",
+        )
+        self._closed = False
+        # future of the sync which will cover calls submitted now
+        self._pending_sync = None
+        state.on_poll_concluded.connect(
+            self._forward(self.on_poll_concluded)
+        )
+        state.on_next_expiry_changed.connect(
+            self._forward(self.on_next_expiry_changed)
+        )
+
+    def _forward(self, signal):
+        def handler(*args):
+            self._loop.call_soon_threadsafe(functools.partial(signal, *args))
+            # returning a true value would disconnect the handler
+
+        return handler
+
+    @property
+    def state(self) -> State:
+        """
+        The wrapped state.
+        """
+        return self._state
+
+    def _schedule_sync(self) -> typing.Optional[asyncio.Future]:
+        durability = self._state.durability
+        if durability == Durability.STRICT:
+            return None
+
+        if self._pending_sync is None:
+            self._pending_sync = self._loop.create_future()
+            self._loop.call_later(
+                GROUP_COMMIT_DELAY if durability == Durability.GROUP
+                else RELAXED_SYNC_DELAY,
+                self._start_sync,
+            )
+        return self._pending_sync
+
+    def _start_sync(self):
+        result, self._pending_sync = self._pending_sync, None
+        if result is None:
+            # taken care of by close()
+            return
+
+        # the executor runs calls in order, so this covers all calls which
+        # were submitted before
+        fut = self._loop.run_in_executor(self._executor, self._state.sync)
+
+        def done(fut):
+            if fut.cancelled():
+                result.cancel()
+            elif fut.exception() is not None:
+                logger.error("failed to sync state", exc_info=fut.exception())
+                result.set_exception(fut.exception())
+                # it has been logged; mark it as retrieved, as there may be
+                # nobody waiting for the sync
+                result.exception()
+            else:
+                result.set_result(None)
+
+        fut.add_done_callback(done)
+
+    def _submit(self, func, args, kwargs):
+        fut = self._loop.run_in_executor(
+            self._executor,
+            functools.partial(func, *args, **kwargs),
+        )
+        return fut, self._schedule_sync()
+
+    async def _wait_for_sync(self, fut, sync):
+        result = await fut
+        # shielded, as other calls wait for the same sync
+        await asyncio.shield(sync)
+        return result
+
+    def submit(self, func: typing.Callable, *args, **kwargs) -> asyncio.Future:
+        """
+        Schedule a call of `func` on the state thread.
+
+        :return: Future for the result of the call.
+
+        With :attr:`~.state.Durability.GROUP`, the returned future is only
+        done once the changes made by the call have been synced, so that
+        nothing is acknowledged which a crash could still lose.
+        """
+        fut, sync = self._submit(func, args, kwargs)
+        if sync is None or self._state.durability != Durability.GROUP:
+            return fut
+        return self._loop.create_task(self._wait_for_sync(fut, sync))
+
+    async def run(self, func: typing.Callable, *args, **kwargs):
+        """
+        Call `func` on the state thread and return its result.
+
+        With :attr:`~.state.Durability.GROUP`, this waits until the changes
+        made by the call have been synced.
+        """
+        return (await self.submit(func, *args, **kwargs))
+
+    async def close(self):
+        """
+        Close the state after all previously submitted calls and stop the
+        thread.
+
+        Calling this more than once has no effect.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        # not via submit, which may wait for the sync resolved below
+        fut, _ = self._submit(self._state.close, (), {})
+        pending, self._pending_sync = self._pending_sync, None
+        try:
+            await fut
+        except BaseException:
+            if pending is not None:
+                pending.cancel()
+            raise
+        finally:
+            self._executor.shutdown(wait=True)
+
+        # closing the state has synced everything
+        if pending is not None:
+            pending.set_result(None)
@@ -1,4 +1,5 @@
 import asyncio
+import collections
 import enum
 import functools
 import re
@@ -13,12 +14,22 @@ import aioxmpp.muc
 import aioxmpp.service
 import aioxmpp.xso
 
+import councilbot.asyncstate
 import councilbot.state
 
-from . import parser, extractor
+from . import dispatch, parser, extractor
 
 
 TAG_RE = re.compile(r"\[([^\]]+)\]")
+MEMBER_STATE_FLUSH_INTERVAL = 60
+# upper bound for sleeping until the next poll expiry, to cope with changes
+# of the wall clock
+MAX_EXPIRY_DELAY = 3600
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUED = 64
+# seconds to wait for the metadata of a URL in a new poll
+ENRICH_TIMEOUT = 30
+BUSY_REPLY = "sorry, I am busy right now. Please try again later."
 
 
 ActionResultType = typing.Tuple[typing.Optional[str], typing.Optional[str]]
@@ -63,6 +74,41 @@ PERMISSION_MAP = {
     )
 }
 
+# (rate per second, burst) for the requests of a single occupant
+OCCUPANT_RATE_LIMITS = {
+    ActorPermissionLevel.FLOOR: (1 / 10, 3),
+    ActorPermissionLevel.COUNCIL: (1, 10),
+}
+
+# (rate per second, burst) for the requests of all occupants of a level
+LEVEL_RATE_LIMITS = {
+    ActorPermissionLevel.FLOOR: (1 / 2, 10),
+    ActorPermissionLevel.COUNCIL: (5, 50),
+}
+
+# actions which change the state; all other actions run without waiting for
+# other jobs
+WRITE_ACTIONS = frozenset((
+    parser.Action.CREATE_POLL,
+    parser.Action.CONCLUDE_POLL,
+    parser.Action.AUTO_CONCLUDE_OPEN_POLLS,
+    parser.Action.DELETE_POLL,
+    parser.Action.CAST_VOTE,
+))
+
+
+class Lane(enum.IntEnum):
+    """
+    Priority lanes of the worker pool; lower values are served first.
+    """
+    READ = 0
+    WRITE = 1
+
+
+# key of writing jobs, which create polls or may refer to a poll which does
+# not exist yet
+POLL_CREATION_KEY = ("create",)
+
 
 class Replace(aioxmpp.xso.XSO):
     TAG = ("urn:xmpp:message-correct:0", "replace")
@@ -150,9 +196,31 @@ class CouncilBot(aioxmpp.service.Service):
     def __init__(self, client, **kwargs):
         super().__init__(client, **kwargs)
         self._muc_client = self.dependencies[aioxmpp.MUCClient]
-        self._background_task = None
-        self._worker_task = None
-        self._worker_queue = asyncio.Queue()
+        self._expiry_handle = None
+        self._expiry_future = None
+        self._flush_task = None
+        # owns the HTTP connections used to look up URLs in new polls
+        self._extractor = extractor.Extractor()
+        # lookups of the metadata of new polls which are still running
+        self._enrich_tasks = set()
+        self._nworkers = DEFAULT_WORKERS
+        self._worker_tasks = []
+        self._worker_pool = dispatch.KeyedWorkerPool(
+            nlanes=len(Lane),
+            maxsize=DEFAULT_MAX_QUEUED,
+        )
+        self._occupant_limits = {
+            level: dispatch.RateLimiter(*limits)
+            for level, limits in OCCUPANT_RATE_LIMITS.items()
+        }
+        self._level_limits = {
+            level: dispatch.TokenBucket(*limits)
+            for level, limits in LEVEL_RATE_LIMITS.items()
+        }
+        # occupants which have been told that we are busy since their last
+        # accepted request
+        self._busy_notified = set()
+        self._drop_counts = collections.Counter()
         self._action_map = {
             parser.Action.NULL: self._action_nothing,
             parser.Action.HELP: self._action_help,
@@ -176,14 +244,62 @@ class CouncilBot(aioxmpp.service.Service):
             "not all actions are declared"
         )
 
-    def set_state_object(self, state: councilbot.state.State):
-        self._state = state
-        self._state.on_poll_concluded.connect(self._handle_poll_concluded)
+    async def _shutdown(self):
+        for task in self._enrich_tasks:
+            task.cancel()
+        if self._enrich_tasks:
+            await asyncio.wait(self._enrich_tasks)
+        await self._extractor.close()
+        await super()._shutdown()
+
+    def set_state_object(self, state: councilbot.asyncstate.AsyncState):
+        self._async_state = state
+        # only to be used on the state thread, i.e. from functions passed to
+        # self._async_state, except for the council member data
+        self._state = state.state
+        self._async_state.on_poll_concluded.connect(
+            self._handle_poll_concluded
+        )
+        self._async_state.on_next_expiry_changed.connect(
+            self._handle_next_expiry_changed
+        )
+
+    def set_extractor(self, extractor):
+        """
+        Set the :class:`~.extractor.Extractor` used for URLs in new polls.
+
+        The bot closes it on shutdown.
+        """
+        self._extractor = extractor
 
     def set_room(self, room, nickname):
         self._room_address = room
         self._nickname = nickname
 
+    def set_worker_count(self, nworkers):
+        """
+        Set the number of commands which may be executed concurrently.
+
+        Takes effect on the next connect.
+        """
+        if nworkers < 1:
+            raise ValueError("need at least one worker")
+        self._nworkers = nworkers
+
+    def set_queue_limit(self, max_queued):
+        """
+        Set the number of commands which may be pending at any time.
+
+        Further commands are rejected as busy. Must be called before the
+        first connect.
+        """
+        if max_queued < 1:
+            raise ValueError("need room for at least one command")
+        self._worker_pool = dispatch.KeyedWorkerPool(
+            nlanes=len(Lane),
+            maxsize=max_queued,
+        )
+
     def _background_task_done(self, task):
         try:
             result = task.result()
@@ -196,15 +312,107 @@ class CouncilBot(aioxmpp.service.Service):
             self.logger.error("background task crashed", exc_info=True)
             self.on_fatal_error(exc)
 
-    async def _periodic_expire(self):
-        while True:
-            await asyncio.sleep(3600)
-            self._state.expire_polls()
+    def _expire_and_get_next_expiry(self):
+        # runs on the state thread
+        self._state.expire_polls()
+        return self._state.next_expiry
+
+    def _schedule_expiry(self, next_expiry):
+        if self._expiry_handle is not None:
+            self._expiry_handle.cancel()
+
+        delay = MAX_EXPIRY_DELAY
+        if next_expiry is not None:
+            delay = min(
+                max((next_expiry - datetime.utcnow()).total_seconds(), 0),
+                delay,
+            )
 
-    async def _worker(self):
+        self.logger.debug("next expiry check in %.0f seconds (due: %s)",
+                          delay, next_expiry)
+        loop = asyncio.get_event_loop()
+        self._expiry_handle = loop.call_at(
+            loop.time() + delay,
+            self._expire_polls,
+        )
+
+    def _expire_polls(self):
+        self._expiry_handle = None
+        self._expiry_future = self._async_state.submit(
+            self._expire_and_get_next_expiry,
+        )
+        self._expiry_future.add_done_callback(self._expire_polls_done)
+
+    def _expire_polls_done(self, fut):
+        if fut is not self._expiry_future:
+            # cancelled or superseded
+            return
+        self._expiry_future = None
+
+        try:
+            next_expiry = fut.result()
+        except Exception as exc:
+            self.logger.error("poll expiry crashed", exc_info=True)
+            self.on_fatal_error(exc)
+            return
+
+        self._schedule_expiry(next_expiry)
+
+    def _handle_next_expiry_changed(self):
+        # only reschedule while connected; _stream_established takes care of
+        # the initial scheduling and an expiry run in progress reschedules
+        # when it is done
+        if self._expiry_handle is not None:
+            self._expiry_handle.cancel()
+            self._expire_polls()
+
+    async def _periodic_flush(self):
         while True:
-            job, argv = await self._worker_queue.get()
-            await job(*argv)
+            await asyncio.sleep(MEMBER_STATE_FLUSH_INTERVAL)
+            await self._async_state.run(self._state.flush_member_state)
+
+    @property
+    def queue_depths(self) -> typing.Mapping[Lane, int]:
+        """
+        Number of commands per lane which have been received and not
+        completed yet.
+        """
+        return {
+            lane: self._worker_pool.depth(lane)
+            for lane in Lane
+        }
+
+    @property
+    def drop_counts(self) -> typing.Mapping[str, int]:
+        """
+        Number of requests which were dropped, by reason (``"occupant"`` and
+        ``"level"`` for rate limits, ``"queue"`` for a full queue).
+        """
+        return dict(self._drop_counts)
+
+    def _check_rate_limits(self, occupant_key, permission_level):
+        if not self._occupant_limits[permission_level].allow(occupant_key):
+            return "occupant"
+        if not self._level_limits[permission_level].try_consume():
+            return "level"
+        return None
+
+    def _reject_busy(self, member, occupant_key, reason):
+        self._drop_counts[reason] += 1
+        if occupant_key in self._busy_notified:
+            self.logger.debug("dropping request from %s (%s)",
+                              occupant_key, reason)
+            return
+
+        self.logger.info("rejecting request from %s as busy (%s)",
+                         occupant_key, reason)
+        self._busy_notified.add(occupant_key)
+        self._send_reply(member, BUSY_REPLY)
+
+    def _stop_workers(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        self._worker_tasks.clear()
 
     @aioxmpp.service.depsignal(aioxmpp.Client, "on_stream_established",
                                defer=True)
@@ -227,29 +435,36 @@ class CouncilBot(aioxmpp.service.Service):
         except Exception as exc:
             self.on_fatal_error(exc)
 
-        self._state.expire_polls()
-        if self._background_task is not None:
-            self._background_task.cancel()
-
-        self._background_task = asyncio.ensure_future(
-            self._periodic_expire()
+        self._schedule_expiry(
+            await self._async_state.run(self._expire_and_get_next_expiry)
         )
-        self._background_task.add_done_callback(self._background_task_done)
 
-        if self._worker_task is not None:
-            self._worker_task.cancel()
-        self._worker_task = asyncio.ensure_future(self._worker())
-        self._worker_task .add_done_callback(self._background_task_done)
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        self._flush_task = asyncio.ensure_future(self._periodic_flush())
+        self._flush_task.add_done_callback(self._background_task_done)
+
+        self._stop_workers()
+        for _ in range(self._nworkers):
+            task = asyncio.ensure_future(self._worker_pool.run_worker())
+            task.add_done_callback(self._background_task_done)
+            self._worker_tasks.append(task)
 
     @aioxmpp.service.depsignal(aioxmpp.Client, "on_stream_destroyed")
     def _stream_kaputt(self):
-        if self._background_task is not None:
-            self._background_task.cancel()
-            self._background_task = None
+        if self._expiry_handle is not None:
+            self._expiry_handle.cancel()
+            self._expiry_handle = None
 
-        if self._worker_task is not None:
-            self._worker_task.cancel()
-            self._worker_task = None
+        if self._expiry_future is not None:
+            self._expiry_future.cancel()
+            self._expiry_future = None
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        self._stop_workers()
 
     def _send_reply(self, requester, text, *, message_id=None, replace_id=None):
         message = aioxmpp.Message(type_=aioxmpp.MessageType.GROUPCHAT)
@@ -269,20 +484,30 @@ class CouncilBot(aioxmpp.service.Service):
             message_id: typing.Optional[str],
             remaining_words: typing.List[str],
             params: typing.Mapping[str, typing.Any],
-            replace_id: typing.Optional[str],
+            replace_id_future: typing.Optional[asyncio.Future],
             permission_level: ActorPermissionLevel):
 
         try:
+            replace_id = None
+            if replace_id_future is not None:
+                replace_id = await replace_id_future
+
             if asyncio.iscoroutinefunction(impl):
+                # these run on the event loop and may thus hold on to the
+                # occupant, e.g. to address later replies
                 tid, reply = await impl(
                     member.direct_jid,
                     message_id,
                     remaining_words,
                     params,
                     permission_level,
+                    requester=member,
                 )
             else:
-                tid, reply = impl(
+                # synchronous actions use the state and thus run on the
+                # state thread
+                tid, reply = await self._async_state.run(
+                    impl,
                     member.direct_jid,
                     message_id,
                     remaining_words,
@@ -306,6 +531,65 @@ class CouncilBot(aioxmpp.service.Service):
                 exc_info=True,
             )
 
+    def _get_job_keys(self, action, actor):
+        """
+        Return the keys to serialise the execution of `action` on.
+
+        Writing actions are executed in order. Most of them may refer to a
+        poll which a pending job is about to create (by tag, by subject or as
+        the current poll); which poll they refer to can only be told on the
+        state thread, once the jobs before them have run.
+        """
+        if action not in WRITE_ACTIONS:
+            return ()
+
+        return [("actor", actor), POLL_CREATION_KEY]
+
+    def _note_member_message(self, actor, message):
+        # runs on the state thread
+        replace_id = None
+        if message.xep0308_replace is not None:
+            self.logger.debug(
+                "replacement message from member, checking if it matches "
+                "the last action"
+            )
+
+            replace_id = self._state.revert_last_transaction(
+                actor,
+                message.xep0308_replace.id_,
+            )
+
+        # always note the last message id, to be sure. we have to do this
+        # after possible reversals though, because this command discards
+        # transaction info of any previous message and confirms transactions
+        self._state.write_last_message_id(actor, message.id_)
+
+        return replace_id
+
+    def _with_replace_id(self, replace_id_future, func):
+        """
+        Call `func` with the result of `replace_id_future` once it is done.
+
+        `replace_id_future` may be :data:`None`, in which case `func` is
+        called with :data:`None` right away.
+        """
+        if replace_id_future is None:
+            func(None)
+            return
+
+        def done(fut):
+            if fut.cancelled():
+                return
+            try:
+                replace_id = fut.result()
+            except Exception:
+                self.logger.error("failed to process message correction",
+                                  exc_info=True)
+                return
+            func(replace_id)
+
+        replace_id_future.add_done_callback(done)
+
     def _handle_council_room_message(self, message, member, source, **kwargs):
         if self._room.me is member:
             self.logger.debug("ignoring message from myself: %s", message)
@@ -320,29 +604,22 @@ class CouncilBot(aioxmpp.service.Service):
         actor = member.direct_jid
 
         permission_level = ActorPermissionLevel.FLOOR
+        # the member data is immutable and thus safe to use here
         if self._state.is_council_member(actor):
             permission_level = ActorPermissionLevel.COUNCIL
 
         self.logger.debug("%s has %s", actor, permission_level)
 
-        replace_id = None
+        replace_id_future = None
         if permission_level != ActorPermissionLevel.FLOOR:
-            # due to memory concerns, LMC is only allowed for council members
-            if message.xep0308_replace is not None:
-                self.logger.debug(
-                    "replacement message from member, checking if it matches "
-                    "the last action"
-                )
-
-                replace_id = self._state.revert_last_transaction(
-                    actor,
-                    message.xep0308_replace.id_,
-                )
-
-            # always note the last message id, to be sure. we have to do this
-            # after possible reversals though, because this command discards
-            # transaction info of any previous message and confirms transactions
-            self._state.write_last_message_id(actor, message.id_)
+            # due to memory concerns, LMC is only allowed for council members;
+            # this is submitted right away so that it happens before anything
+            # else from this message touches the state
+            replace_id_future = self._async_state.submit(
+                self._note_member_message,
+                actor,
+                message,
+            )
 
         try:
             request = partition_request(self._room.me.nick, text)
@@ -353,17 +630,29 @@ class CouncilBot(aioxmpp.service.Service):
                 self._room.me.nick
             )
 
-            if replace_id is not None:
-                self._send_reply(None, "nevermind", replace_id=replace_id)
+            def reply(replace_id):
+                if replace_id is not None:
+                    self._send_reply(None, "nevermind", replace_id=replace_id)
+
+            self._with_replace_id(replace_id_future, reply)
+            return
 
+        # the direct JID of occupants is unknown in semi-anonymous rooms
+        occupant_key = actor if actor is not None else member.nick
+        reason = self._check_rate_limits(occupant_key, permission_level)
+        if reason is not None:
+            self._reject_busy(member, occupant_key, reason)
             return
 
         words = list(filter(None, request.split(" ")))
         info = parser.PARSE_TREE.parse(words)
         if info is None:
-            self._send_reply(
-                member, "sorry, I did not understand that.",
-                replace_id=replace_id
+            self._with_replace_id(
+                replace_id_future,
+                lambda replace_id: self._send_reply(
+                    member, "sorry, I did not understand that.",
+                    replace_id=replace_id
+                ),
             )
             return
 
@@ -391,19 +680,32 @@ class CouncilBot(aioxmpp.service.Service):
                           allowed_actions)
 
         action_func = self._action_map[node.action]
+        # read-only commands do not change the state and all uses of the
+        # state run one at a time on the state thread, so they cannot observe
+        # a write half-way through; there is thus no reason to let them wait
+        # behind writes
+        lane = Lane.WRITE if action in WRITE_ACTIONS else Lane.READ
+        self.logger.debug("queueing %s in lane %s (depth=%d)",
+                          action, lane.name, self._worker_pool.depth(lane))
 
-        self._worker_queue.put_nowait((
-            self._execute_action,
-            (
+        try:
+            self._worker_pool.submit(
+                self._get_job_keys(action, actor),
+                self._execute_action,
                 action_func,
                 member,
                 message.id_,
                 remaining_words,
                 params,
-                replace_id,
+                replace_id_future,
                 permission_level,
+                lane=lane,
             )
-        ))
+        except asyncio.QueueFull:
+            self._reject_busy(member, occupant_key, "queue")
+            return
+
+        self._busy_notified.discard(occupant_key)
 
     def _handle_council_room_join(self, member, **kwargs):
         pass
@@ -487,7 +789,9 @@ class CouncilBot(aioxmpp.service.Service):
             message_id: str,
             remaining_words: typing.List[str],
             params: typing.Mapping[str, typing.Any],
-            permission_level: ActorPermissionLevel) -> ActionResultType:
+            permission_level: ActorPermissionLevel,
+            *,
+            requester: aioxmpp.muc.Occupant) -> ActionResultType:
         text = " ".join(remaining_words).rstrip("? \t\n")
 
         match = TAG_RE.search(text)
@@ -497,38 +801,46 @@ class CouncilBot(aioxmpp.service.Service):
         else:
             tag = None
 
-        metadata = await extractor.extract_url_metadata(
+        tid, poll_id, reply = await self._async_state.run(
+            self._create_poll,
+            actor,
+            message_id,
             text,
+            tag,
         )
 
-        description = None
-
-        if metadata is not None:
-            if (metadata.title and
-                    metadata.matched_url == text.strip()):
-                text = metadata.title
-
-            if metadata.tag:
-                tag = metadata.tag
+        if poll_id is not None:
+            # the reply is sent before the task gets to run, so that it can
+            # always be corrected
+            task = asyncio.ensure_future(
+                self._enrich_poll(requester, tid, poll_id, text)
+            )
+            self._enrich_tasks.add(task)
+            task.add_done_callback(self._enrich_poll_done)
 
-            description = metadata.description or description
+        return tid, reply
 
+    def _create_poll(self, actor, message_id, text, tag):
+        # runs on the state thread
         try:
             tid, poll_id = self._state.create_poll(
                 actor,
                 message_id,
                 text,
                 tag=tag,
-                urls=metadata.urls if metadata is not None else [],
-                description=description,
             )
         except FileExistsError:
             return (
+                None,
                 None,
                 "sorry, this is too close to the topic of another open poll. "
                 "Please choose a new topic description."
             )
 
+        return tid, poll_id, self._format_created_poll(poll_id)
+
+    def _format_created_poll(self, poll_id):
+        # runs on the state thread
         poll = self._state.get_poll(poll_id)
 
         result = [
@@ -546,7 +858,76 @@ class CouncilBot(aioxmpp.service.Service):
             result.append("")
             result.append(poll.description)
 
-        return tid, "\n".join(result)
+        return "\n".join(result)
+
+    async def _enrich_poll(self, requester, tid, poll_id, text):
+        """
+        Look up the metadata of a URL in the topic of a new poll and apply it
+        to the poll.
+
+        The reply to `requester` about the creation is corrected (:xep:`308`)
+        with the new details; clients which do not support corrections show
+        them as a new message.
+        """
+        try:
+            metadata = await asyncio.wait_for(
+                self._extractor.extract_url_metadata(text),
+                ENRICH_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            self.logger.warning("timed out looking up metadata for %r", text)
+            return
+
+        if metadata is None:
+            return
+
+        reply = await self._async_state.run(
+            self._apply_poll_metadata,
+            poll_id,
+            text,
+            metadata,
+        )
+        if reply is not None:
+            self._send_reply(requester, reply, replace_id=tid)
+
+    def _enrich_poll_done(self, task):
+        self._enrich_tasks.discard(task)
+        if task.cancelled():
+            return
+        try:
+            task.result()
+        except Exception:
+            self.logger.error("failed to look up poll metadata",
+                              exc_info=True)
+
+    def _apply_poll_metadata(self, poll_id, text, metadata):
+        # runs on the state thread
+        try:
+            poll = self._state.get_poll(poll_id)
+        except KeyError:
+            # deleted or reverted in the meantime
+            self.logger.debug("poll %s is gone, discarding its metadata",
+                              poll_id)
+            return None
+
+        urls = poll.urls + [
+            url for url in metadata.urls
+            if url not in poll.urls
+        ]
+        subject = poll.subject
+        if (subject == text and metadata.title and
+                metadata.matched_url == text.strip()):
+            subject = metadata.title
+
+        self._state.update_poll_metadata(
+            poll_id,
+            subject,
+            metadata.tag or poll.tag,
+            urls,
+            metadata.description or poll.description,
+        )
+
+        return self._format_created_poll(poll_id)
 
     def _action_list_votes(
             self,
@@ -0,0 +1,232 @@
+import asyncio
+import collections
+import time
+import typing
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    :param rate: Tokens added per second.
+    :param burst: Capacity of the bucket; it starts out full.
+    :param clock: Function returning the current time in seconds.
+
+    .. automethod:: try_consume
+
+    .. autoattribute:: is_full
+    """
+
+    __slots__ = ("_rate", "_burst", "_clock", "_tokens", "_last")
+
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        super().__init__()
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._last = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(
+            self._burst,
+            self._tokens + (now - self._last) * self._rate,
+        )
+        self._last = now
+
+    @property
+    def is_full(self) -> bool:
+        """
+        Whether the bucket has refilled completely, i.e. it is equivalent to
+        a new bucket.
+        """
+        self._refill()
+        return self._tokens >= self._burst
+
+    def try_consume(self, tokens: float = 1) -> bool:
+        """
+        Take `tokens` from the bucket if it has that many.
+
+        :return: Whether the tokens were taken.
+        """
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+
+class RateLimiter:
+    """
+    Token buckets by key.
+
+    :param rate: See :class:`TokenBucket`.
+    :param burst: See :class:`TokenBucket`.
+    :param clock: See :class:`TokenBucket`.
+
+    Buckets are created on demand. Full buckets are dropped once more than
+    :attr:`PRUNE_THRESHOLD` buckets exist, so the memory use is bounded by
+    the number of keys which are actually limited.
+
+    .. automethod:: allow
+    """
+
+    PRUNE_THRESHOLD = 1024
+
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        super().__init__()
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._buckets = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _prune(self):
+        for key, bucket in list(self._buckets.items()):
+            if bucket.is_full:
+                del self._buckets[key]
+
+    def allow(self, key: typing.Hashable) -> bool:
+        """
+        Take a token from the bucket of `key`.
+
+        :return: Whether a token was available.
+        """
+        try:
+            bucket = self._buckets[key]
+        except KeyError:
+            if len(self._buckets) >= self.PRUNE_THRESHOLD:
+                self._prune()
+            bucket = TokenBucket(self._rate, self._burst, self._clock)
+            self._buckets[key] = bucket
+        return bucket.try_consume()
+
+
+class _Job:
+    __slots__ = ("func", "argv", "keys", "lane", "queued")
+
+    def __init__(self, func, argv, keys, lane):
+        super().__init__()
+        self.func = func
+        self.argv = argv
+        self.keys = keys
+        self.lane = lane
+        self.queued = False
+
+
+class KeyedWorkerPool:
+    """
+    Run coroutine jobs on a pool of workers, serialising jobs by key.
+
+    Each job is submitted with a collection of hashable keys. A job only
+    starts once all jobs submitted before it which share at least one key
+    with it have finished. Jobs without common keys run concurrently, on as
+    many workers as are running :meth:`run_worker`.
+
+    :param nlanes: Number of priority lanes.
+    :param maxsize: Maximum number of unfinished jobs, or zero for no limit.
+
+    Runnable jobs are started in order of their lane, lane 0 first, and in
+    submission order within a lane.
+
+    .. automethod:: submit
+
+    .. automethod:: run_worker
+
+    .. autoattribute:: pending
+
+    .. automethod:: depth
+    """
+
+    def __init__(self, nlanes=1, maxsize=0):
+        super().__init__()
+        self._maxsize = maxsize
+        self._lanes = [collections.deque() for _ in range(nlanes)]
+        # counts the jobs in all lanes
+        self._nready = asyncio.Semaphore(0)
+        # jobs which have not finished yet, per key, in submission order
+        self._chains = {}
+        self._npending = 0
+        self._lane_pending = [0] * nlanes
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of jobs which have been submitted and not finished yet.
+        """
+        return self._npending
+
+    def depth(self, lane: int) -> int:
+        """
+        Number of jobs in `lane` which have been submitted and not finished
+        yet.
+        """
+        return self._lane_pending[lane]
+
+    def _is_runnable(self, job):
+        return all(self._chains[key][0] is job for key in job.keys)
+
+    def _enqueue(self, job):
+        job.queued = True
+        self._lanes[job.lane].append(job)
+        self._nready.release()
+
+    def submit(self,
+               keys: typing.Iterable[typing.Hashable],
+               func: typing.Callable[..., typing.Awaitable],
+               *argv,
+               lane: int = 0):
+        """
+        Submit a job.
+
+        :param keys: Keys to serialise the job on.
+        :param func: Coroutine function to call.
+        :param argv: Arguments for `func`.
+        :param lane: Priority lane of the job.
+        :raises asyncio.QueueFull: if there are `maxsize` unfinished jobs.
+        """
+        if not 0 <= lane < len(self._lanes):
+            raise ValueError("no such lane: {!r}".format(lane))
+        if self._maxsize and self._npending >= self._maxsize:
+            raise asyncio.QueueFull()
+
+        job = _Job(func, argv, frozenset(keys), lane)
+        for key in job.keys:
+            self._chains.setdefault(key, collections.deque()).append(job)
+        self._npending += 1
+        self._lane_pending[lane] += 1
+
+        if self._is_runnable(job):
+            self._enqueue(job)
+
+    def _release(self, job):
+        self._npending -= 1
+        self._lane_pending[job.lane] -= 1
+        for key in job.keys:
+            chain = self._chains[key]
+            chain.popleft()
+            if not chain:
+                del self._chains[key]
+                continue
+
+            head = chain[0]
+            if not head.queued and self._is_runnable(head):
+                self._enqueue(head)
+
+    async def run_worker(self):
+        """
+        Execute jobs as they become runnable. Never returns.
+
+        If a job raises, the exception is propagated after the job has been
+        accounted as finished.
+        """
+        while True:
+            await self._nready.acquire()
+            job = next(filter(None, self._lanes)).popleft()
+            try:
+                await job.func(*job.argv)
+            finally:
+                self._release(job)
@@ -1,11 +1,22 @@
-import bs4
+import asyncio
+import codecs
 import collections
+import json
+import logging
 import re
+import time
+import typing
+import urllib.parse
 
-import lxml
+import lxml.etree
 
 import aiohttp
 
+from .storage import safe_writer
+
+
+logger = logging.getLogger(__name__)
+
 
 PROTOXEP_URL_RE = re.compile(
     r"https?://(www\.)?xmpp\.org/extensions/inbox/(?P<basename>.+)\.(html|xml)",
@@ -31,6 +42,13 @@ STANDARDS_URL_RE = re.compile(
     re.I,
 )
 
+DEFAULT_LIMIT_PER_HOST = 4
+DEFAULT_KEEPALIVE_TIMEOUT = 60
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10, sock_read=10)
+DEFAULT_CACHE_ENTRIES = 256
+DEFAULT_CACHE_TTL = 3600
+METADATA_CACHE_FILE = "url-metadata.json"
+
 BAD_SHORT_NAME_RE = re.compile(
     "^not[\W_]yet[\W_]assigned|None|N/A$",
     re.I,
@@ -50,134 +68,497 @@ URLMetadata = collections.namedtuple(
 
 
 async def _feed_read(source, sink, max_size):
+    """
+    Pass chunks from `source` to `sink` until either is done.
+
+    `sink` may return a true value to stop reading.
+    """
     nread = 0
     while nread < max_size:
         blob = await source(READ_CHUNK_SIZE)
         if not blob:
             break
-        sink(blob)
+        if sink(blob):
+            break
         nread += len(blob)
 
 
-async def _extract_protoxep_metadata(match):
-    basename = match.groupdict()["basename"]
-    url = PROTOXEP_URL_TEMPLATE.format(basename=basename)
+async def _read_xep_header(source, max_size=MAX_READ_SIZE):
+    """
+    Parse XML from `source` up to the end of the ``/xep/header`` element and
+    return that element.
 
-    parser = lxml.etree.XMLParser(resolve_entities=False)
+    The rest of the document is neither read nor parsed.
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            await _feed_read(response.content.read, parser.feed, MAX_READ_SIZE)
+    :raises ValueError: if the document has no header.
+    """
+    parser = lxml.etree.XMLPullParser(
+        events=("end",),
+        resolve_entities=False,
+    )
+    header = None
+
+    def sink(blob):
+        nonlocal header
+        parser.feed(blob)
+        for _, el in parser.read_events():
+            parent = el.getparent()
+            if (el.tag == "header" and parent is not None and
+                    parent.tag == "xep" and parent.getparent() is None):
+                header = el
+                return True
+        return False
+
+    await _feed_read(source, sink, max_size)
+    if header is None:
+        raise ValueError("no XEP header found")
+    return header
+
+
+async def _read_html_heading(source, encoding=None, max_size=MAX_READ_SIZE):
+    """
+    Parse HTML from `source` up to the end of the first ``h1`` element and
+    return its text.
+
+    The rest of the document is neither read nor parsed. Elements which
+    have been parsed completely (other than the content of the heading) are
+    cleared, so that memory use is bounded even if there is no heading.
+
+    :param encoding: Encoding of the document, if known from the response.
+        Otherwise, it is detected by the parser.
+    :return: The text of the heading, or :data:`None` if there is none.
+    """
+    parser = lxml.etree.HTMLPullParser(events=("end",))
+    # decode here, the encoding argument of the parser cannot be relied on
+    decode = None
+    if encoding is not None:
+        try:
+            decode = codecs.getincrementaldecoder(encoding)("replace").decode
+        except LookupError:
+            # bogus charset in the response; let the parser detect it
+            logger.debug("unknown encoding %r, ignoring it", encoding)
+    heading = None
+
+    def sink(blob):
+        nonlocal heading
+        parser.feed(decode(blob) if decode is not None else blob)
+        for _, el in parser.read_events():
+            if el.tag == "h1":
+                heading = "".join(el.itertext())
+                return True
+            if next(el.iterancestors("h1"), None) is None:
+                el.clear(keep_tail=True)
+        return False
+
+    await _feed_read(source, sink, max_size)
+    return heading
+
+
+def _normalise_url(url: str) -> str:
+    """
+    Lower-case the scheme and host of `url`, which are case-insensitive.
+    """
+    parts = urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit(
+        parts._replace(scheme=parts.scheme.lower(),
+                       netloc=parts.netloc.lower())
+    )
 
-    tree = parser.close()
 
-    title_el, = tree.xpath("/xep/header/title")
-    abstract_el, = tree.xpath("/xep/header/abstract")
-    short_name_el, = tree.xpath("/xep/header/shortname")
+class MetadataCache:
+    """
+    Cache of URL metadata with LRU eviction, expiry and persistence.
 
-    short_name = short_name_el.text
-    if BAD_SHORT_NAME_RE.search(short_name):
-        short_name = basename
+    :param path: JSON file to persist the cache in, or :data:`None`.
+    :param max_entries: Maximum number of entries held.
+    :param ttl: Seconds for which an entry is used without asking the origin
+        whether it is still valid.
+    :param clock: Function returning the current time in seconds since the
+        epoch.
 
-    return URLMetadata(
-        matched_url=match.group(0),
-        title="Accept {!r} as Experimental".format(title_el.text),
-        description=abstract_el.text,
-        tag=short_name,
-        urls=[
-            PROTOXEP_HTML_URL_TEMPLATE.format(basename=basename),
-        ]
-    )
+    Entries are keyed by the canonical URL of the resource (which normalises
+    the different URLs users may paste for it) and keep the validators of
+    the response they were made from, so that stale entries can be
+    revalidated with a conditional request.
 
+    The file is loaded on construction; a missing, corrupt or outdated file
+    is treated as empty.
 
-async def _extract_xeps_pr_metadata(match):
-    matched_url = match.group(0)
-    num = match.groupdict()["num"]
-    url = XEPS_PR_URL_TEMPLATE.format(num=num)
-    files_url = XEPS_PR_FILES_URL_TEMPLATE.format(num=num)
+    .. automethod:: get
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            pr_json = await response.json()
+    .. automethod:: is_fresh
 
-        files_json = []
-        # using the xep name in the tag makes it too long for fuzzy match (even
-        # without PR prefix)
-        # async with session.get(files_url) as response:
-        #     files_json = await response.json()
-
-    title = pr_json["title"]
-    # normalize all the spacing
-    description = " ".join(pr_json["body"].split())
-    if len(description) > 300:
-        description = description[:300] + "…"
-
-    tag = "PR#{}".format(num)
-
-    affected_xep = None
-    for file_info in files_json:
-        match = XEP_FILE_RE.match(file_info["filename"])
-        if match is None:
-            continue
-        if affected_xep:
-            affected_xep = None
-            break
-
-        affected_xep = match.group(1)
+    .. automethod:: put
 
-    # makes it too long for fuzzy match :(
-    # if affected_xep:
-    #     tag = "{} {}".format(tag, affected_xep.upper())
+    .. automethod:: refresh
 
-    return URLMetadata(
-        matched_url=matched_url,
-        title="[PR#{}] {}".format(num, title),
-        description=description,
-        tag=tag,
-        urls=[
-            XEPS_PR_HTML_URL_TEMPLATE.format(num=num)
-        ]
-    )
+    .. automethod:: dumps
 
+    .. automethod:: write
+    """
 
-async def _extract_standards_metadata(match):
-    STANDARDS_PREFIX = "[Standards] "
+    VERSION = 1
 
-    matched_url = match.group(0)
+    Entry = collections.namedtuple(
+        "Entry",
+        ["metadata", "fetched_at", "etag", "last_modified"],
+    )
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(matched_url) as response:
-            data = await response.content.read(MAX_READ_SIZE)
+    def __init__(self, path=None, *,
+                 max_entries=DEFAULT_CACHE_ENTRIES,
+                 ttl=DEFAULT_CACHE_TTL,
+                 clock=time.time):
+        super().__init__()
+        self.path = path
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        if path is not None:
+            self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        try:
+            with self.path.open("r") as f:
+                data = json.load(f)
+            if data.get("version") != self.VERSION:
+                logger.info("URL metadata cache has unsupported version %r, "
+                            "ignoring it",
+                            data.get("version"))
+                return
+            for url, entry in data["entries"]:
+                self._entries[url] = self.Entry(
+                    URLMetadata(**entry["metadata"]),
+                    entry["fetched_at"],
+                    entry["etag"],
+                    entry["last_modified"],
+                )
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError):
+            logger.warning("URL metadata cache is corrupt, ignoring it",
+                           exc_info=True)
+            self._entries.clear()
+
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, url: str) -> typing.Optional["MetadataCache.Entry"]:
+        """
+        Return the entry for `url`, or :data:`None`.
+        """
+        try:
+            entry = self._entries[url]
+        except KeyError:
+            return None
+        self._entries.move_to_end(url)
+        return entry
+
+    def is_fresh(self, entry: "MetadataCache.Entry") -> bool:
+        """
+        Whether `entry` may be used without revalidation.
+        """
+        return 0 <= self._clock() - entry.fetched_at < self._ttl
+
+    def put(self, url: str, metadata: URLMetadata, *,
+            etag=None, last_modified=None):
+        """
+        Store the `metadata` obtained from `url` now.
+        """
+        self._entries[url] = self.Entry(
+            metadata,
+            self._clock(),
+            etag,
+            last_modified,
+        )
+        self._entries.move_to_end(url)
+        self._evict()
+
+    def refresh(self, url: str):
+        """
+        Mark the entry for `url` as revalidated now.
+        """
+        self._entries[url] = self._entries[url]._replace(
+            fetched_at=self._clock(),
+        )
+
+    def dumps(self) -> str:
+        """
+        Serialise the cache for :meth:`write`.
+        """
+        return json.dumps({
+            "version": self.VERSION,
+            "entries": [
+                [url, {
+                    "metadata": entry.metadata._asdict(),
+                    "fetched_at": entry.fetched_at,
+                    "etag": entry.etag,
+                    "last_modified": entry.last_modified,
+                }]
+                for url, entry in self._entries.items()
+            ],
+        }, separators=(",", ":"))
+
+    def write(self, data: str):
+        """
+        Write `data` obtained from :meth:`dumps` to :attr:`path`.
+
+        This does blocking I/O, but does not access the cache and may thus
+        run on another thread.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with safe_writer(self.path, "w") as f:
+            f.write(data)
+
+
+class Extractor:
+    """
+    Extract poll metadata from URLs.
+
+    :param limit_per_host: Maximum number of concurrent connections per host.
+    :param keepalive_timeout: Seconds for which idle connections are kept
+        open.
+    :param timeout: Timeouts of requests.
+    :param cache: :class:`MetadataCache` to use, if any.
+
+    All requests go through a single :class:`aiohttp.ClientSession`, so that
+    connections (including DNS lookups and TLS handshakes) to the few hosts
+    involved are reused across polls. The session is created on first use
+    and has to be closed with :meth:`close`.
+
+    .. automethod:: extract_url_metadata
+
+    .. automethod:: close
+    """
+
+    def __init__(self, *,
+                 cache=None,
+                 limit_per_host=DEFAULT_LIMIT_PER_HOST,
+                 keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+                 timeout=DEFAULT_TIMEOUT):
+        super().__init__()
+        self._cache = cache
+        self._save_lock = asyncio.Lock()
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._timeout = timeout
+        self._session = None
+        self._implementations = [
+            (PROTOXEP_URL_RE, self._extract_protoxep_metadata),
+            (XEPS_PR_URL_RE, self._extract_xeps_pr_metadata),
+            (STANDARDS_URL_RE, self._extract_standards_metadata),
+        ]
 
-    soup = bs4.BeautifulSoup(data, "lxml")
-    del data
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=self._limit_per_host,
+                    keepalive_timeout=self._keepalive_timeout,
+                ),
+                timeout=self._timeout,
+            )
+        return self._session
+
+    async def close(self):
+        """
+        Close the session and all its connections.
+
+        The extractor may be used again afterwards, with a new session.
+        """
+        session, self._session = self._session, None
+        if session is not None:
+            await session.close()
+
+    async def _fetch(self, url, match, parse):
+        """
+        Return the metadata of `url`, from the cache if possible.
+
+        :param url: The canonical URL to fetch, which is also the cache key.
+        :param match: The match of the URL given by the user.
+        :param parse: Coroutine function which extracts the metadata from the
+            response.
+
+        Stale cache entries are revalidated with the ``ETag`` and
+        ``Last-Modified`` of the response they were made from. The cache is
+        only written if an entry was added or refreshed.
+        """
+        entry = None
+        changed = False
+        headers = {}
+        if self._cache is not None:
+            entry = self._cache.get(url)
+            if entry is not None:
+                if self._cache.is_fresh(entry):
+                    return entry.metadata._replace(matched_url=match.group(0))
+                if entry.etag is not None:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified is not None:
+                    headers["If-Modified-Since"] = entry.last_modified
+
+        async with self._get_session().get(url, headers=headers) as response:
+            if response.status == 304 and entry is not None:
+                self._cache.refresh(url)
+                changed = True
+                metadata = entry.metadata
+            else:
+                metadata = await parse(response)
+                if self._cache is not None and response.status == 200:
+                    self._cache.put(
+                        url,
+                        metadata,
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                    )
+                    changed = True
+
+        if changed:
+            await self._save_cache()
+        return metadata._replace(matched_url=match.group(0))
+
+    async def _save_cache(self):
+        if self._cache is None or self._cache.path is None:
+            return
+        data = self._cache.dumps()
+        # keep the writes in order
+        async with self._save_lock:
+            await asyncio.get_event_loop().run_in_executor(
+                None,
+                self._cache.write,
+                data,
+            )
+
+    async def _extract_protoxep_metadata(self, match):
+        basename = match.groupdict()["basename"]
+        url = PROTOXEP_URL_TEMPLATE.format(basename=basename)
+
+        async def parse(response):
+            # the header is at the top and all we need; leaving the rest
+            # unread closes the connection when the response is released
+            header = await _read_xep_header(response.content.read)
+
+            title_el, = header.xpath("title")
+            abstract_el, = header.xpath("abstract")
+            short_name_el, = header.xpath("shortname")
+
+            short_name = short_name_el.text
+            if BAD_SHORT_NAME_RE.search(short_name):
+                short_name = basename
+
+            return URLMetadata(
+                matched_url=match.group(0),
+                title="Accept {!r} as Experimental".format(title_el.text),
+                description=abstract_el.text,
+                tag=short_name,
+                urls=[
+                    PROTOXEP_HTML_URL_TEMPLATE.format(basename=basename),
+                ]
+            )
+
+        return (await self._fetch(url, match, parse))
+
+    async def _extract_xeps_pr_metadata(self, match):
+        matched_url = match.group(0)
+        num = match.groupdict()["num"]
+        url = XEPS_PR_URL_TEMPLATE.format(num=num)
+        files_url = XEPS_PR_FILES_URL_TEMPLATE.format(num=num)
+
+        async def parse(response):
+            pr_json = await response.json()
 
-    title = soup.find("h1").text
-    if title.startswith(STANDARDS_PREFIX):
-        title = title[len(STANDARDS_PREFIX):]
+            files_json = []
+            # using the xep name in the tag makes it too long for fuzzy match
+            # (even without PR prefix)
+            # async with self._get_session().get(files_url) as response:
+            #     files_json = await response.json()
 
-    return URLMetadata(
-        matched_url=matched_url,
-        title=title.strip() or None,
-        description=None,
-        tag=None,
-        urls=[matched_url]
-    )
+            title = pr_json["title"]
+            # normalize all the spacing
+            description = " ".join(pr_json["body"].split())
+            if len(description) > 300:
+                description = description[:300] + "…"
 
+            tag = "PR#{}".format(num)
 
-_IMPLEMENTATIONS = [
-    (PROTOXEP_URL_RE, _extract_protoxep_metadata),
-    (XEPS_PR_URL_RE, _extract_xeps_pr_metadata),
-    (STANDARDS_URL_RE, _extract_standards_metadata),
-]
+            affected_xep = None
+            for file_info in files_json:
+                file_match = XEP_FILE_RE.match(file_info["filename"])
+                if file_match is None:
+                    continue
+                if affected_xep:
+                    affected_xep = None
+                    break
+
+                affected_xep = file_match.group(1)
+
+            # makes it too long for fuzzy match :(
+            # if affected_xep:
+            #     tag = "{} {}".format(tag, affected_xep.upper())
+
+            return URLMetadata(
+                matched_url=matched_url,
+                title="[PR#{}] {}".format(num, title),
+                description=description,
+                tag=tag,
+                urls=[
+                    XEPS_PR_HTML_URL_TEMPLATE.format(num=num)
+                ]
+            )
+
+        return (await self._fetch(url, match, parse))
+
+    async def _extract_standards_metadata(self, match):
+        STANDARDS_PREFIX = "[Standards] "
+
+        matched_url = match.group(0)
+
+        async def parse(response):
+            title = await _read_html_heading(response.content.read,
+                                             encoding=response.charset)
+            if title is None:
+                raise ValueError("no heading found")
+            if title.startswith(STANDARDS_PREFIX):
+                title = title[len(STANDARDS_PREFIX):]
+
+            return URLMetadata(
+                matched_url=matched_url,
+                title=title.strip() or None,
+                description=None,
+                tag=None,
+                urls=[matched_url]
+            )
+
+        return (await self._fetch(_normalise_url(matched_url), match, parse))
+
+    async def extract_url_metadata(self, url):
+        """
+        Return the :class:`URLMetadata` for the first supported URL in `url`,
+        or :data:`None` if there is none.
+        """
+        for match_re, extractor in self._implementations:
+            match = match_re.search(url)
+            if match is None:
+                continue
+
+            return (await extractor(match))
+
+        return None
 
 
 async def extract_url_metadata(url):
-    for match_re, extractor in _IMPLEMENTATIONS:
-        match = match_re.search(url)
-        if match is None:
-            continue
-
-        return (await extractor(match))
-
-    return None
+    """
+    Extract metadata from `url` with a short-lived :class:`Extractor`.
+
+    Long-running code should use a single :class:`Extractor` instead.
+    """
+    extractor = Extractor()
+    try:
+        return (await extractor.extract_url_metadata(url))
+    finally:
+        await extractor.close()
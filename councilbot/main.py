@@ -17,14 +17,68 @@ import aioxmpp
 import aioxmpp.muc.xso
 import aioxmpp.xso
 
-from . import state, bot
+from . import asyncstate, state, storage, bot, extractor
 
 
 logger = logging.getLogger("main")
 
 
+def migrate_state(config, backend):
+    """
+    Copy the state to the storage `backend`.
+
+    The state is opened and closed with the configured backend first, so that
+    all journal records are folded into the polls and member states.
+    """
+    current = config["state"].get("backend", state.DEFAULT_BACKEND)
+    if current == backend:
+        raise ValueError("state already uses the {!r} backend".format(backend))
+
+    state.State(config).close()
+
+    statedir = pathlib.Path(config["state"]["directory"]).resolve()
+    source = storage.make_storage(current, statedir)
+    dest = storage.make_storage(backend, statedir)
+    try:
+        storage.migrate(source, dest)
+    finally:
+        dest.close()
+        source.close()
+
+    logger.info("state migrated; set backend = %r in the [state] section "
+                "to use it", backend)
+
+
+def make_extractor(config):
+    """
+    Create the URL metadata extractor, with a cache in the state directory.
+
+    The cache is kept in memory only if the state is.
+    """
+    extractor_config = config.get("extractor", {})
+    path = None
+    if (config["state"].get("backend") != storage.MEMORY_BACKEND and
+            config["state"].get("directory")):
+        path = (pathlib.Path(config["state"]["directory"]).resolve() /
+                "cache" / extractor.METADATA_CACHE_FILE)
+
+    return extractor.Extractor(
+        cache=extractor.MetadataCache(
+            path,
+            max_entries=extractor_config.get(
+                "cache_size", extractor.DEFAULT_CACHE_ENTRIES,
+            ),
+            ttl=extractor_config.get(
+                "cache_ttl", extractor.DEFAULT_CACHE_TTL,
+            ),
+        ),
+    )
+
+
 async def amain(loop, args, config):
-    context = state.State(config)
+    context = asyncstate.AsyncState(
+        state.State(config, rebuild_cache=args.rebuild_cache)
+    )
 
     client = aioxmpp.Client(
         config["xmpp"]["address"],
@@ -35,8 +89,16 @@ async def amain(loop, args, config):
     disco_srv = client.summon(aioxmpp.DiscoServer)
     council_bot = client.summon(bot.CouncilBot)
     council_bot.set_state_object(context)
+    council_bot.set_extractor(make_extractor(config))
     council_bot.set_room(config["council"]["room"],
                          config["council"]["nick"])
+    bot_config = config.get("bot", {})
+    council_bot.set_worker_count(
+        bot_config.get("workers", bot.DEFAULT_WORKERS)
+    )
+    council_bot.set_queue_limit(
+        bot_config.get("max_queued", bot.DEFAULT_MAX_QUEUED)
+    )
     fatal_error = council_bot.on_fatal_error.future()
 
     disco_srv.set_identity_names(
@@ -55,20 +117,26 @@ async def amain(loop, args, config):
         fatal_error,
     ]
 
-    async with client.connected() as stream:
-        done, pending = await asyncio.wait(
-            futures,
-            return_when=asyncio.FIRST_COMPLETED
-        )
-
-        if fatal_error in done:
-            try:
-                fatal_error.result()
-            except BaseException as exc:
-                logger.error("council bot crashed", exc_info=True)
-                return
-
-        logger.info("received SIGINT/SIGTERM, initiating clean shutdown")
+    try:
+        async with client.connected() as stream:
+            done, pending = await asyncio.wait(
+                futures,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if fatal_error in done:
+                try:
+                    fatal_error.result()
+                except BaseException as exc:
+                    logger.error("council bot crashed", exc_info=True)
+                    return
+
+            logger.info("received SIGINT/SIGTERM, initiating clean shutdown")
+    finally:
+        try:
+            await council_bot.shutdown()
+        finally:
+            await context.close()
 
 
 def main():
@@ -85,6 +153,19 @@ def main():
         default=0,
         help="Increase verbosity (up to -vvv)"
     )
+    parser.add_argument(
+        "--rebuild-cache",
+        action="store_true",
+        default=False,
+        help="Ignore the poll snapshot cache and parse all poll files"
+    )
+    parser.add_argument(
+        "--migrate-to",
+        choices=sorted(storage.BACKENDS.keys() - {storage.MEMORY_BACKEND}),
+        default=None,
+        metavar="BACKEND",
+        help="Copy the state to the given storage backend and exit"
+    )
 
     args = parser.parse_args()
 
@@ -108,6 +189,10 @@ def main():
     for member in cfg["council"]["members"]:
         member["address"] = aioxmpp.JID.fromstr(member["address"])
 
+    if args.migrate_to is not None:
+        migrate_state(cfg, args.migrate_to)
+        return
+
     loop = asyncio.get_event_loop()
     try:
         loop.run_until_complete(amain(loop, args, cfg))
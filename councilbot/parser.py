@@ -23,7 +23,217 @@ class PollSelector(enum.Enum):
     EXPIRED = "expired"
 
 
+# inline flags which may be used in a scoped group, see _combine_patterns
+_SCOPED_FLAGS = [
+    (re.ASCII, "a"),
+    (re.IGNORECASE, "i"),
+    (re.MULTILINE, "m"),
+    (re.DOTALL, "s"),
+    (re.VERBOSE, "x"),
+]
+
+_GROUP_NAME_RE = re.compile(r"\(\?P([<=])(\w+)")
+# numbered back-references and conditionals would break when groups are
+# renumbered by combining patterns
+_UNCOMBINABLE_RE = re.compile(r"\\[1-9]|\(\?\(")
+_ESCAPE_RE = re.compile(r"\\.")
+_ASCII_LETTER_RE = re.compile(r"[a-zA-Z]")
+# subset of the regular expression syntax used in PARSE_TREE, from which
+# keywords are enumerated
+_KEYWORD_TOKEN_RE = re.compile(
+    r"\((?P<group>[^()]*)\)(?P<group_opt>\?)?|(?P<char>[\w!])(?P<opt>\?)?"
+)
+
+
+def _combine_patterns(patterns):
+    """
+    Combine `patterns` into a single pattern which matches like trying them
+    in order.
+
+    The groups of the pattern at index ``i`` are renamed to ``_i_<name>`` and
+    the pattern itself is wrapped in a group named ``_i``, which is the
+    :attr:`re.Match.lastgroup` of a match.
+
+    :return: The combined pattern, or :data:`None` if there are no patterns
+        or one of them cannot be combined.
+    """
+    if not patterns:
+        return None
+
+    alternatives = []
+    for i, pattern in enumerate(patterns):
+        if not isinstance(pattern.pattern, str):
+            return None
+        if _UNCOMBINABLE_RE.search(pattern.pattern):
+            return None
+
+        flags = "".join(
+            letter
+            for flag, letter in _SCOPED_FLAGS
+            if pattern.flags & flag
+        )
+        source = _GROUP_NAME_RE.sub(
+            lambda m: "(?P{}_{}_{}".format(m.group(1), i, m.group(2)),
+            pattern.pattern,
+        )
+        if flags:
+            source = "(?{}:{})".format(flags, source)
+        alternatives.append("(?P<_{}>{})".format(i, source))
+
+    return re.compile("|".join(alternatives))
+
+
+def _is_case_independent(pattern):
+    """
+    Whether `pattern` matches all ASCII case variants of a word alike.
+
+    This holds if it ignores case or if it has no letters, apart from group
+    names and escape sequences such as ``\\w``.
+    """
+    if pattern.flags & re.IGNORECASE:
+        return True
+    source = _ESCAPE_RE.sub("", _GROUP_NAME_RE.sub("(", pattern.pattern))
+    return _ASCII_LETTER_RE.search(source) is None
+
+
+def _enumerate_keywords(source):
+    """
+    Return the words matched by the regular expression `source`, if it only
+    consists of alternatives of literal words with optional characters or
+    groups; otherwise, return an empty list.
+    """
+    words = []
+    for alternative in source.split("|") if "(" not in source else [source]:
+        variants = [""]
+        pos = 0
+        while pos < len(alternative):
+            m = _KEYWORD_TOKEN_RE.match(alternative, pos)
+            if m is None:
+                return []
+            pos = m.end()
+            if m.group("char") is not None:
+                options = [m.group("char")]
+                optional = m.group("opt")
+            else:
+                options = _enumerate_keywords(m.group("group"))
+                if not options:
+                    return []
+                optional = m.group("group_opt")
+            if optional:
+                options = options + [""]
+            variants = [
+                prefix + option
+                for prefix in variants
+                for option in options
+            ]
+        words.extend(variants)
+    return words
+
+
+class _Dispatch:
+    """
+    Compiled form of the children of a :class:`TextNode`.
+
+    .. attribute:: skip
+
+       Frozen set of the words to skip.
+
+    .. attribute:: keywords
+
+       Map from casefolded ASCII words to the child which matches them
+       without capturing any group.
+
+    .. attribute:: combined
+
+       Single pattern matching like the patterns of all children in order
+       (see :func:`_combine_patterns`), or :data:`None`.
+    """
+
+    __slots__ = ("children", "skip", "keywords", "combined", "_alternatives")
+
+    def __init__(self, node):
+        super().__init__()
+        self.children = tuple(node.children)
+        self.skip = frozenset(node.skip)
+        self.combined = _combine_patterns(
+            [child.match for child in self.children]
+        )
+        # child and its renamed groups by name of the alternative
+        self._alternatives = {
+            "_{}".format(i): (child, [
+                ("_{}_{}".format(i, name), name)
+                for name in child.match.groupindex
+            ])
+            for i, child in enumerate(self.children)
+        }
+        self.keywords = {}
+        for child in self.children:
+            for word in _enumerate_keywords(child.match.pattern):
+                if word and word.isascii():
+                    self._add_keyword(word.casefold())
+
+    def _add_keyword(self, word):
+        # the map is an exact shortcut for the ordered search only if every
+        # child which is tried up to and including the first match treats all
+        # ASCII spellings of the word alike and the match captures nothing
+        for child in self.children:
+            if not _is_case_independent(child.match):
+                return
+            m = child.match.match(word)
+            if m is None:
+                continue
+            if not m.groupdict():
+                self.keywords[word] = child
+            return
+
+    def match(self, word, folded):
+        """
+        Find the first child whose pattern matches `word`.
+
+        :return: ``(child, groups)`` or :data:`None`.
+        """
+        child = self.keywords.get(folded)
+        if child is not None and word.isascii():
+            return child, {}
+
+        if self.combined is not None:
+            m = self.combined.match(word)
+            if m is None:
+                return None
+            child, groups = self._alternatives[m.lastgroup]
+            return child, {
+                name: m.group(renamed)
+                for renamed, name in groups
+            }
+
+        for child in self.children:
+            m = child.match.match(word)
+            if m is not None:
+                return child, m.groupdict()
+        return None
+
+
 class TextNode:
+    """
+    Node of a command parse tree.
+
+    :param match: Pattern (or literal string) which the word leading to this
+        node has to start with.
+    :param action: Action of the command if the words end at this node.
+    :param save: Name of the parameter to store the word (or the ``save``
+        group of `match` or `save_const`) in.
+    :param save_const: Value to store in the `save` parameter.
+    :param children: Nodes for the next word, tried in order.
+    :param skip: Casefolded words to skip before matching the children.
+
+    A ``push`` group of `match` is parsed as a separate word after the
+    matching word.
+
+    .. automethod:: compile
+
+    .. automethod:: parse
+    """
+
     def __init__(self, match, *, action=None,
                  save=None, save_const=None,
                  children=[], skip=[]):
@@ -36,40 +246,79 @@ class TextNode:
         self.action = action
         self.save = save
         self.save_const = save_const
+        self._dispatch = None
+
+    def compile(self):
+        """
+        Build the dispatch structures of this node and all nodes below it.
+
+        This is done on the first :meth:`parse` otherwise. It has to be
+        called again after :attr:`children` or :attr:`skip` of any of these
+        nodes have been modified.
+        """
+        self._dispatch = _Dispatch(self)
+        for child in self.children:
+            child.compile()
 
     def parse(self, words, params={}):
-        remaining_words = list(words)
-        while remaining_words and remaining_words[0].casefold() in self.skip:
-            del remaining_words[0]
+        """
+        Parse `words` as command.
 
-        if not remaining_words:
-            return self, remaining_words, params
+        :return: The node at which the command ends, the words following the
+            command as list and the parameters, or :data:`None` if `words`
+            are not a command.
+        """
+        node = self
+        pos = 0
+        # words produced by ``push`` groups, which come before words[pos:];
+        # the next one is at the end
+        pushed = []
 
-        first_word = remaining_words[0]
-        for child in self.children:
-            match = child.match.match(first_word)
-            if match is None:
-                continue
+        while True:
+            dispatch = node._dispatch
+            if dispatch is None:
+                node.compile()
+                dispatch = node._dispatch
+
+            while True:
+                if pushed:
+                    word = pushed[-1]
+                elif pos < len(words):
+                    word = words[pos]
+                else:
+                    return node, [], params
 
-            groups = match.groupdict()
+                folded = word.casefold()
+                if folded not in dispatch.skip:
+                    break
+                if pushed:
+                    pushed.pop()
+                else:
+                    pos += 1
 
+            result = dispatch.match(word, folded)
+            if result is None:
+                if node.action is not None:
+                    return node, pushed[::-1] + list(words[pos:]), params
+                return None
+
+            child, groups = result
             if child.save is not None:
                 params = params.copy()
                 params[child.save] = (
-                    child.save_const or groups.get("save") or first_word
+                    child.save_const or groups.get("save") or word
                 )
 
-            to_push = groups.get("push")
+            if pushed:
+                pushed.pop()
+            else:
+                pos += 1
 
+            to_push = groups.get("push")
             if to_push:
-                remaining_words.insert(1, to_push)
-
-            return child.parse(remaining_words[1:], params)
+                pushed.append(to_push)
 
-        if self.action is not None:
-            return self, remaining_words, params
-
-        return None
+            node = child
 
     def __repr__(self):
         return "<TextNode match={!r} action={!r}>".format(
@@ -220,3 +469,5 @@ PARSE_TREE = TextNode(
         )
     ]
 )
+
+PARSE_TREE.compile()
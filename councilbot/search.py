@@ -0,0 +1,186 @@
+import collections
+import difflib
+import itertools
+import typing
+
+
+# number of items (by trigram overlap) which are scored first, to find a good
+# match early on
+MAX_CANDIDATES = 32
+
+
+def trigrams(key: str) -> typing.Set[str]:
+    """
+    Return the set of character trigrams of `key`.
+
+    The key is padded so that short keys and word boundaries produce trigrams
+    too.
+    """
+    padded = "  {} ".format(key)
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+    """
+    Index of texts for exact and fuzzy lookup.
+
+    Keys are casefolded once when an item is added. Fuzzy lookup returns the
+    same match as :func:`difflib.get_close_matches`. It first scores the
+    items sharing the most character trigrams with the query, and then skips
+    all other items whose upper bounds of the similarity ratio
+    (:meth:`~difflib.SequenceMatcher.real_quick_ratio` and
+    :meth:`~difflib.SequenceMatcher.quick_ratio`) show that they cannot beat
+    the best match found so far.
+
+    Ties are broken as by :func:`difflib.get_close_matches` and then by the
+    order in which the items were first added, so that the result does not
+    depend on hash randomisation.
+
+    .. automethod:: add
+
+    .. automethod:: remove
+
+    .. automethod:: clear
+
+    .. automethod:: lookup_exact
+
+    .. automethod:: find
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._keys = {}
+        # insertion sequence numbers, for deterministic tie breaking
+        self._seqs = {}
+        self._counter = itertools.count()
+        self._exact = collections.defaultdict(set)
+        self._trigrams = collections.defaultdict(set)
+
+    def __contains__(self, item) -> bool:
+        return item in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, item: typing.Hashable, text: str):
+        """
+        Add `item` to the index under `text`.
+
+        If `item` is already in the index, its text is replaced and it keeps
+        its place in the insertion order.
+        """
+        self._remove_key(item)
+
+        if item not in self._seqs:
+            self._seqs[item] = next(self._counter)
+        key = text.casefold()
+        self._keys[item] = key
+        self._exact[key].add(item)
+        for trigram in trigrams(key):
+            self._trigrams[trigram].add(item)
+
+    def remove(self, item: typing.Hashable):
+        """
+        Remove `item` from the index.
+
+        Removing an item which is not in the index is a no-op.
+        """
+        self._remove_key(item)
+        self._seqs.pop(item, None)
+
+    def _remove_key(self, item):
+        key = self._keys.pop(item, None)
+        if key is None:
+            return
+
+        self._discard(self._exact, key, item)
+        for trigram in trigrams(key):
+            self._discard(self._trigrams, trigram, item)
+
+    @staticmethod
+    def _discard(mapping, key, item):
+        items = mapping[key]
+        items.discard(item)
+        if not items:
+            del mapping[key]
+
+    def clear(self):
+        self._keys.clear()
+        self._seqs.clear()
+        self._exact.clear()
+        self._trigrams.clear()
+
+    def lookup_exact(self, text: str) -> typing.Hashable:
+        """
+        Return an item whose text is equal to `text`, ignoring case.
+
+        If there are several, the one added first is returned.
+
+        :raises KeyError: if there is no such item.
+        """
+        items = self._exact.get(text.casefold())
+        if not items:
+            raise KeyError(text)
+        return min(items, key=self._seqs.__getitem__)
+
+    def _best_match(self, matcher, items, cutoff):
+        best_rank, best_item = None, None
+        for item in items:
+            # an equal score may still win by the text
+            bound = cutoff if best_rank is None else max(cutoff, best_rank[0])
+            key = self._keys[item]
+            matcher.set_seq1(key)
+            if (matcher.real_quick_ratio() < bound or
+                    matcher.quick_ratio() < bound):
+                continue
+
+            score = matcher.ratio()
+            if score < cutoff:
+                continue
+
+            # like get_close_matches: highest score, then greatest text;
+            # then the item added first
+            rank = (score, key, -self._seqs[item])
+            if best_rank is None or rank > best_rank:
+                best_rank, best_item = rank, item
+
+        return best_rank, best_item
+
+    def find(self, text: str, cutoff: float) -> typing.Hashable:
+        """
+        Return the item whose text is most similar to `text`.
+
+        :param cutoff: Minimum similarity ratio in ``[0, 1]``.
+        :raises KeyError: if no item is similar enough.
+        """
+        text = text.casefold()
+        try:
+            return self.lookup_exact(text)
+        except KeyError:
+            pass
+
+        overlap = collections.Counter()
+        for trigram in trigrams(text):
+            overlap.update(self._trigrams.get(trigram, ()))
+
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(text)
+        candidates = [
+            item for item, _ in overlap.most_common(MAX_CANDIDATES)
+        ]
+        scored = set(candidates)
+        # the other items may still score higher, even without any shared
+        # trigram; most of them are ruled out by the bounds
+        best_rank, best_item = self._best_match(
+            matcher,
+            itertools.chain(
+                candidates,
+                (item for item in self._keys if item not in scored),
+            ),
+            cutoff,
+        )
+
+        if best_rank is None:
+            raise KeyError(text)
+
+        return best_item
@@ -1,9 +1,11 @@
 import base64
 import collections
+import collections.abc
 import contextlib
-import copy
-import difflib
 import enum
+import functools
+import heapq
+import json
 import logging
 import math
 import os
@@ -11,16 +13,26 @@ import pathlib
 import random
 import re
 import shutil
-import tempfile
+import struct
 import typing
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import toml
 
 import aioxmpp
 import aioxmpp.callbacks
 
+from .search import FuzzyIndex
+from .storage import (
+    MEMORY_BACKEND,
+    Durability,
+    PollLocation,
+    fsync_dir,
+    make_storage,
+    safe_writer,
+)
+
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +42,10 @@ _rng = random.SystemRandom()
 CONCLUDED_FLAG_FILE = "concluded.flag"
 DELETED_FLAG_FILE = "deleted.flag"
 METADATA_FILE = "metadata.toml"
+JOURNAL_FILE = "journal.jsonl"
+DEFAULT_JOURNAL_COMPACT_THRESHOLD = 64
+DEFAULT_BACKEND = "toml"
+DEFAULT_MAX_RESIDENT_HISTORIES = 32
 
 
 class VoteValue(enum.Enum):
@@ -108,61 +124,274 @@ def slugify(text):
     return re.sub(r"-+", "-", re.sub(r"[^a-z0-9A-Z]", "-", text.casefold()))
 
 
-def fsync_dir(path: pathlib.Path):
-    """
-    Call :func:`os.fsync` on a directory.
+def format_timestamp(timestamp: datetime) -> str:
+    return timestamp.isoformat()
 
-    :param path: The directory to fsync.
-    """
-    fd = os.open(str(path), os.O_DIRECTORY | os.O_RDONLY)
-    try:
-        os.fsync(fd)
-    finally:
-        os.close(fd)
+
+def parse_timestamp(s: str) -> datetime:
+    return datetime.fromisoformat(s)
 
 
-@contextlib.contextmanager
-def safe_writer(destpath, mode="wb", extra_paranoia=False):
+class Journal:
     """
-    Safely overwrite a file.
+    Append-only log of state operations.
+
+    :param path: Path of the journal file.
+    :param durability: The :class:`Durability` mode.
+
+    Each record is a single line of JSON, holding a sequence number and a list
+    of operations. With :attr:`Durability.STRICT`, records are flushed and
+    synced to disk on append, which is a lot cheaper than rewriting a whole
+    poll file. Otherwise, they are only flushed and :meth:`sync` has to be
+    called to make them durable.
+
+    Sequence numbers increase monotonically, also across :meth:`reset`. Poll
+    snapshots record the sequence number up to which they include the
+    journal, so that records are never applied twice, even if the journal
+    could not be reset after writing the snapshots.
 
-    This guards against the following situations:
+    A torn record at the end of the file (unclean shutdown while appending) is
+    discarded on :meth:`replay`.
 
-    * error/exception while writing the file (the original file stays intact
-      without modification)
-    * most cases of unclean shutdown (*either* the original *or* the new file
-      will be seen on disk)
+    .. autoattribute:: last_seq
 
-    It does that with the following means:
+    .. autoattribute:: nrecords
 
-    * a temporary file next to the target file is used for writing
-    * if an exception is raised in the context manager, the temporary file is
-      discarded and nothing else happens
-    * otherwise, the temporary file is synced to disk and then used to replace
-      the target file.
+    .. automethod:: replay
 
-    If `extra_paranoia` is true, the parent directory of the target file is
-    additionally synced after the replacement. `extra_paranoia` is only needed
-    if it is required that the new file is seen after a crash (and not the
-    original file).
+    .. automethod:: append
+
+    .. autoattribute:: needs_sync
+
+    .. automethod:: sync
+
+    .. automethod:: reset
+
+    .. automethod:: close
     """
 
-    destpath = pathlib.Path(destpath)
-    with tempfile.NamedTemporaryFile(
-            mode=mode,
-            dir=str(destpath.parent),
-            delete=False) as tmpfile:
+    def __init__(self, path: pathlib.Path,
+                 durability: Durability = Durability.STRICT):
+        super().__init__()
+        self._path = path
+        self._durability = durability
+        self._unsynced = False
+        self._f = None
+        self._size = 0
+        self._last_seq = 0
+        self._nrecords = 0
+
+    @property
+    def last_seq(self) -> int:
+        """
+        Sequence number of the most recent record.
+        """
+        return self._last_seq
+
+    @property
+    def nrecords(self) -> int:
+        """
+        Number of records in the journal.
+        """
+        return self._nrecords
+
+    def replay(self) -> typing.Iterator[typing.Tuple[int, typing.List]]:
+        """
+        Read all records from the journal.
+
+        :return: Iterator of ``(seq, ops)`` pairs, in order.
+        """
+        self.close()
+        self._size = 0
+        self._nrecords = 0
+
         try:
-            yield tmpfile
+            f = self._path.open("rb")
+        except FileNotFoundError:
+            return
+
+        with f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("record is not terminated")
+                    record = json.loads(line.decode("utf-8"))
+                    seq, ops = record["seq"], record["ops"]
+                except (ValueError, KeyError):
+                    logger.warning(
+                        "journal: discarding torn record at offset %d",
+                        self._size,
+                        exc_info=True,
+                    )
+                    break
+
+                self._size += len(line)
+                self._last_seq = seq
+                if ops:
+                    self._nrecords += 1
+                yield seq, ops
+
+        if self._path.stat().st_size != self._size:
+            os.truncate(str(self._path), self._size)
+
+    @property
+    def needs_sync(self) -> bool:
+        """
+        Whether records have been appended which have not been synced yet.
+        """
+        return self._unsynced
+
+    def append(self, ops: typing.List) -> int:
+        """
+        Append a record to the journal.
+
+        The record is durable when this returns only with
+        :attr:`Durability.STRICT`; see :meth:`sync`.
+
+        :param ops: The operations to record.
+        :return: The sequence number of the new record.
+        """
+        if self._f is None:
+            created = not self._path.exists()
+            self._f = self._path.open("ab")
+            if created:
+                fsync_dir(self._path.parent)
+
+        seq = self._last_seq + 1
+        line = json.dumps(
+            {"seq": seq, "ops": ops},
+            separators=(",", ":"),
+        ).encode("utf-8") + b"\n"
+
+        try:
+            self._f.write(line)
+            self._f.flush()
+            if self._durability == Durability.STRICT:
+                os.fsync(self._f.fileno())
+            else:
+                self._unsynced = True
         except:  # NOQA
-            os.unlink(tmpfile.name)
+            # do not leave a partial record behind
+            self._close()
+            os.truncate(str(self._path), self._size)
             raise
+
+        self._size += len(line)
+        self._last_seq = seq
+        self._nrecords += 1
+        return seq
+
+    def sync(self):
+        """
+        Sync all records appended so far to disk.
+        """
+        if not self._unsynced:
+            return
+
+        if self._f is not None:
+            os.fsync(self._f.fileno())
         else:
-            tmpfile.flush()
-            os.fsync(tmpfile.fileno())
-            os.replace(tmpfile.name, str(destpath))
-            if extra_paranoia:
-                fsync_dir(destpath.parent)
+            # closed after a failed append
+            with self._path.open("rb") as f:
+                os.fsync(f.fileno())
+        self._unsynced = False
+
+    def reset(self):
+        """
+        Discard all records from the journal.
+
+        This must only be called after all state covered by the journal has
+        been written elsewhere. The sequence number is preserved.
+        """
+        self._close()
+        line = json.dumps(
+            {"seq": self._last_seq, "ops": []},
+            separators=(",", ":"),
+        ).encode("utf-8") + b"\n"
+        with safe_writer(
+                self._path, "wb",
+                extra_paranoia=self._durability == Durability.STRICT) as f:
+            f.write(line)
+        self._size = len(line)
+        self._nrecords = 0
+        self._unsynced = False
+
+    def _close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def close(self):
+        """
+        Sync and close the journal file.
+        """
+        self.sync()
+        self._close()
+
+
+class MemoryJournal:
+    """
+    Journal which keeps its records in memory.
+
+    This has the interface of :class:`Journal` and is used with the
+    ``memory`` storage backend. Records are still encoded as JSON, so that
+    operations which could not be journalled fail the same way.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._records = []
+        self._last_seq = 0
+        self._nrecords = 0
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    @property
+    def nrecords(self) -> int:
+        return self._nrecords
+
+    @property
+    def needs_sync(self) -> bool:
+        return False
+
+    def replay(self) -> typing.Iterator[typing.Tuple[int, typing.List]]:
+        for seq, record in self._records:
+            yield seq, json.loads(record)
+
+    def append(self, ops: typing.List) -> int:
+        seq = self._last_seq + 1
+        self._records.append((seq, json.dumps(ops, separators=(",", ":"))))
+        self._last_seq = seq
+        self._nrecords += 1
+        return seq
+
+    def sync(self):
+        pass
+
+    def reset(self):
+        self._records.clear()
+        self._nrecords = 0
+
+    def close(self):
+        pass
+
+
+def _parse_jid(s: str, jids: typing.Optional[typing.Mapping[
+        str, aioxmpp.JID]] = None) -> aioxmpp.JID:
+    """
+    Parse `s` as JID, returning the object from `jids` if it is in there.
+
+    This allows to share the JID objects of the council members among all
+    polls instead of having one copy per poll and vote.
+    """
+    if jids is not None:
+        try:
+            return jids[s]
+        except KeyError:
+            pass
+    return aioxmpp.JID.fromstr(s)
 
 
 class VoteRecord(collections.namedtuple("VoteRecord",
@@ -187,6 +416,136 @@ class VoteRecord(collections.namedtuple("VoteRecord",
         )
 
 
+_VOTE_VALUES = list(VoteValue)
+_VOTE_VALUE_CODES = {
+    value: code
+    for code, value in enumerate(_VOTE_VALUES)
+}
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class VoteHistory(collections.abc.Sequence):
+    """
+    Vote history of a member on a poll, as a sequence of
+    :class:`VoteRecord` objects.
+
+    The records are not kept as objects: the timestamp (in microseconds
+    since the epoch) and the value (as small int) of each record are packed
+    into a single byte string, and a tuple of remarks only exists if any
+    record has one. Records are created when they are accessed.
+
+    Both are immutable and replaced on :meth:`append` and :meth:`pop`, which
+    copies the history. Histories are short and change rarely, but are held
+    for every member of every poll, so the space matters more.
+
+    Timestamps with time zone are converted to naive UTC timestamps.
+
+    .. automethod:: append
+
+    .. automethod:: pop
+    """
+
+    __slots__ = ("_data", "_remarks")
+
+    _RECORD = struct.Struct("<qB")
+
+    def __init__(self, records=()):
+        super().__init__()
+        data = []
+        remarks = []
+        for record in records:
+            data.append(self._pack(record))
+            remarks.append(record.remark)
+        self._data = b"".join(data)
+        self._remarks = None
+        if any(remark is not None for remark in remarks):
+            self._remarks = tuple(remarks)
+
+    def __len__(self):
+        return len(self._data) // self._RECORD.size
+
+    def _record(self, i):
+        microseconds, code = self._RECORD.unpack_from(
+            self._data,
+            i * self._RECORD.size,
+        )
+        return VoteRecord(
+            _EPOCH + microseconds * _MICROSECOND,
+            _VOTE_VALUES[code],
+            self._remarks[i] if self._remarks is not None else None,
+        )
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("vote history index out of range")
+        return self._record(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._record(i)
+
+    def __eq__(self, other):
+        if isinstance(other, (VoteHistory, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "<VoteHistory {!r}>".format(list(self))
+
+    def __copy__(self):
+        # the contents are immutable and can be shared
+        result = object.__new__(type(self))
+        result._data = self._data
+        result._remarks = self._remarks
+        return result
+
+    copy = __copy__
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    @classmethod
+    def _pack(cls, record):
+        timestamp = record.timestamp
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(
+                tzinfo=None,
+            )
+        return cls._RECORD.pack(
+            (timestamp - _EPOCH) // _MICROSECOND,
+            _VOTE_VALUE_CODES[record.value],
+        )
+
+    def append(self, record: VoteRecord):
+        """
+        Append `record` to the history.
+        """
+        # pack first, this fails for invalid values
+        packed = self._pack(record)
+
+        if record.remark is not None and self._remarks is None:
+            self._remarks = (None,) * len(self)
+        if self._remarks is not None:
+            self._remarks += (record.remark,)
+
+        self._data += packed
+
+    def pop(self) -> VoteRecord:
+        """
+        Remove and return the most recent record.
+        """
+        result = self[-1]
+        self._data = self._data[:-self._RECORD.size]
+        if self._remarks is not None:
+            self._remarks = self._remarks[:-1]
+        return result
+
+
 class Poll:
     """
     Represent a poll.
@@ -213,6 +572,11 @@ class Poll:
 
     .. attribute:: description
 
+    .. attribute:: journal_seq
+
+       Sequence number of the last :class:`Journal` record which is included
+       in this poll.
+
     .. automethod:: push_vote
 
     .. automethod:: pop_vote
@@ -220,8 +584,46 @@ class Poll:
     .. automethod:: get_vote_history
 
     .. automethod:: get_current_votes
+
+    .. automethod:: apply_journal_op
+
+    .. automethod:: replay_journal
+
+    .. autoattribute:: has_history
+
+    .. automethod:: unload_history
+
+    .. automethod:: dump
+
+    .. automethod:: load
+
+    .. automethod:: to_dict
+
+    .. automethod:: from_dict
+
+    The methods which parse member addresses accept a `jids` mapping from
+    address strings to :class:`aioxmpp.JID` objects, which are used instead
+    of parsing the address again (see :func:`_parse_jid`).
     """
 
+    __slots__ = (
+        "_id",
+        "_start_time",
+        "_end_time",
+        "_flags",
+        "_member_data",
+        "_current_votes",
+        "_value_counts",
+        "_nvoted",
+        "_history_loader",
+        "subject",
+        "tag",
+        "urls",
+        "description",
+        "made_current_at",
+        "journal_seq",
+    )
+
     def __init__(self, id_, start_time, duration, subject, members):
         super().__init__()
         self._id = id_
@@ -229,28 +631,43 @@ class Poll:
         self._end_time = self._start_time + duration
         self._flags = set()
         self._member_data = {
-            member: []
+            member: VoteHistory()
             for member in members
         }
+        # running tally of the most recent votes, maintained by push_vote and
+        # pop_vote so that result and get_state are O(1)
+        self._current_votes = dict.fromkeys(self._member_data)
+        self._value_counts = collections.Counter()
+        self._nvoted = 0
+        self._history_loader = None
         self.subject = subject
         self.tag = None
         self.urls = []
         self.description = None
         self.made_current_at = None
+        self.journal_seq = 0
 
     def __copy__(self):
-        result = type(self)(self._id,
-                            self._start_time,
-                            self._end_time - self._start_time,
-                            self.subject,
-                            [])
-        result._flags.update(self._flags)
-        for member, votes in self._member_data.items():
-            result._member_data[member] = copy.copy(votes)
+        # bypass __init__, which would build containers only to replace them
+        result = object.__new__(type(self))
+        result._id = self._id
+        result._start_time = self._start_time
+        result._end_time = self._end_time
+        result._flags = set(self._flags)
+        result._member_data = {
+            member: votes.copy()
+            for member, votes in self._history().items()
+        }
+        result._current_votes = dict(self._current_votes)
+        result._value_counts = collections.Counter(self._value_counts)
+        result._nvoted = self._nvoted
+        result._history_loader = None
+        result.subject = self.subject
         result.tag = self.tag
-        result.urls[:] = self.urls
+        result.urls = list(self.urls)
         result.description = self.description
         result.made_current_at = self.made_current_at
+        result.journal_seq = self.journal_seq
         return result
 
     @property
@@ -277,29 +694,21 @@ class Poll:
         # > any one member of the Council shall function as a veto. A quorum of
         # > the XMPP Council shall be a majority of the members of the Council.
 
-        number_of_acks = 0
-        number_of_votes = 0
-
-        for vote in self.get_current_votes().values():
-            if vote is None:
-                continue
-
-            if vote.value == VoteValue.VETO:
-                # Bylaws:
-                # > […] although the negative vote of any one member of the
-                # > Council shall function as a veto.
-                return PollResult.VETO
+        if self._value_counts[VoteValue.VETO]:
+            # Bylaws:
+            # > […] although the negative vote of any one member of the
+            # > Council shall function as a veto.
+            return PollResult.VETO
 
-            number_of_votes += 1
-            if vote.value == VoteValue.ACK:
-                number_of_acks += 1
+        number_of_acks = self._value_counts[VoteValue.ACK]
+        number_of_votes = self._nvoted
 
         # Bylaws:
         # > A quorum of the XMPP Council shall be a majority of the members of
         # > the Council.
 
-        # number of council members = len(self._member_data)
-        quorum = len(self._member_data) / 2
+        # number of council members = len(self._current_votes)
+        quorum = len(self._current_votes) / 2
 
         if number_of_votes <= quorum:
             # no quorum -> fail
@@ -323,7 +732,7 @@ class Poll:
         return self._flags
 
     def get_state(self, at_time: datetime) -> PollState:
-        is_complete = all(bool(votes) for votes in self._member_data.values())
+        is_complete = self._nvoted == len(self._current_votes)
 
         if at_time >= self._end_time:
             if is_complete:
@@ -347,8 +756,9 @@ class Poll:
             timestamp = datetime.utcnow()
 
         record = VoteRecord(timestamp, value, remark)
-        records = self._member_data[member]
+        records = self._history()[member]
         records.append(record)
+        self._set_current_vote(member, record)
 
     def pop_vote(self, member: aioxmpp.JID):
         """
@@ -356,36 +766,99 @@ class Poll:
 
         (Used primarily to process last message corrections.)
         """
-        records = self._member_data[member]
+        records = self._history()[member]
         if not records:
             return
 
         records.pop()
+        if records:
+            self._set_current_vote(member, records[-1])
+        else:
+            self._set_current_vote(member, None)
+
+    def _set_current_vote(self, member, record):
+        old_record = self._current_votes[member]
+        if old_record is not None:
+            self._value_counts[old_record.value] -= 1
+            self._nvoted -= 1
+
+        self._current_votes[member] = record
+        if record is not None:
+            self._value_counts[record.value] += 1
+            self._nvoted += 1
+
+    def _recount(self):
+        self._value_counts.clear()
+        self._nvoted = 0
+        for member, records in self._member_data.items():
+            self._current_votes[member] = None
+            if records:
+                self._set_current_vote(member, records[-1])
+
+    def _history(self) -> typing.Mapping[
+            aioxmpp.JID, VoteHistory]:
+        if self._member_data is None:
+            logger.debug("loading vote history of poll %s", self._id)
+            self._member_data = self._history_loader()
+            self._history_loader = None
+        return self._member_data
+
+    @property
+    def has_history(self) -> bool:
+        """
+        Whether the full vote history is currently held in memory.
+        """
+        return self._member_data is not None
+
+    def unload_history(self, loader: typing.Callable[[], typing.Mapping]):
+        """
+        Drop the vote history from memory.
+
+        :param loader: Callable which returns the vote history mapping.
+
+        The most recent votes and thus :attr:`result` and :meth:`get_state`
+        stay available. The full history is obtained from `loader` when it is
+        needed next.
+        """
+        self._member_data = None
+        self._history_loader = loader
 
     def get_vote_history(self) -> typing.Mapping[
-            aioxmpp.JID, typing.List[VoteRecord]]:
+            aioxmpp.JID, VoteHistory]:
         """
         Get mapping of vote history by member.
         """
-        return self._member_data
+        return self._history()
 
     def get_votes(self,
-                  member: aioxmpp.JID) -> typing.List[VoteRecord]:
+                  member: aioxmpp.JID) -> VoteHistory:
         """
         Get vote history of member.
         """
-        return self._member_data[member]
+        return self._history()[member]
 
     def get_current_votes(self) -> typing.Mapping[aioxmpp.JID, VoteRecord]:
         """
         Get mapping with most recent votes by member.
         """
-        return {
-            member: votes[-1] if len(votes) > 0 else None
-            for member, votes in self._member_data.items()
-        }
+        return dict(self._current_votes)
+
+    def to_dict(self, full_history=True) -> typing.Mapping:
+        """
+        Return the snapshot data of this poll as written by :meth:`dump`.
+
+        :param full_history: If false, only the most recent vote of each
+            member is included. This does not require the history to be
+            loaded.
+        """
+        if full_history:
+            votes = self._history()
+        else:
+            votes = {
+                member: [vote] if vote is not None else []
+                for member, vote in self._current_votes.items()
+            }
 
-    def dump(self, fout):
         data = {
             "id": self._id,
             "start_time": self._start_time,
@@ -393,13 +866,13 @@ class Poll:
             "subject": self.subject,
             "flags": list(flag.value for flag in self._flags),
             "tag": self.tag,
-            "urls": self.urls,
+            "urls": list(self.urls),
             "votes": {
                 str(member): [
                     vote.to_dict()
                     for vote in votes
                 ]
-                for member, votes in self._member_data.items()
+                for member, votes in votes.items()
             },
         }
         if self.description is not None:
@@ -408,61 +881,349 @@ class Poll:
         if self.made_current_at is not None:
             data["made_current_at"] = self.made_current_at
 
-        toml.dump(data, fout)
+        if self.journal_seq:
+            data["journal_seq"] = self.journal_seq
+
+        return data
+
+    def dump(self, fout):
+        toml.dump(self.to_dict(), fout)
+
+    def apply_journal_op(self, op: typing.Mapping, jids=None):
+        """
+        Apply an operation recorded in the :class:`Journal` to this poll.
+        """
+        kind = op["op"]
+        if kind == "push_vote":
+            self.push_vote(
+                _parse_jid(op["member"], jids),
+                VoteValue(op["value"]),
+                op["remark"],
+                timestamp=parse_timestamp(op["timestamp"]),
+            )
+        elif kind == "pop_vote":
+            self.pop_vote(_parse_jid(op["member"], jids))
+        elif kind == "append_url":
+            self.urls.append(op["url"])
+        elif kind == "set_metadata":
+            self.subject = op["subject"]
+            self.tag = op["tag"]
+            self.urls[:] = op["urls"]
+            self.description = op["description"]
+        elif kind == "remove_url":
+            try:
+                self.urls.remove(op["url"])
+            except ValueError as exc:
+                # not in urls, maybe edited already, ignore
+                logger.debug(
+                    "remove_url: failed to remove %s from poll %s: %s",
+                    op["url"],
+                    self._id,
+                    exc,
+                )
+        else:
+            raise ValueError("unknown journal operation: {!r}".format(op))
 
     @classmethod
-    def load(cls, fin):
-        data = toml.load(fin)
+    def from_journal(cls, journal_ops, jids=None):
+        """
+        Construct a poll which exists only in the :class:`Journal` so far.
+
+        :param journal_ops: Sequence of ``(seq, op)`` pairs, the first of which
+            must be the ``create_poll`` operation.
+        """
+        (seq, op), *tail = journal_ops
+        if op["op"] != "create_poll":
+            raise ValueError(
+                "poll {} has no snapshot and starts with {!r}".format(
+                    op["poll"],
+                    op,
+                )
+            )
+
+        start_time = parse_timestamp(op["start_time"])
+        result = cls(
+            op["poll"],
+            start_time,
+            parse_timestamp(op["end_time"]) - start_time,
+            op["subject"],
+            (_parse_jid(member, jids) for member in op["members"]),
+        )
+        result.tag = op["tag"]
+        result.urls[:] = op["urls"]
+        result.description = op["description"]
+        if op["made_current_at"] is not None:
+            result.made_current_at = parse_timestamp(op["made_current_at"])
+        result.journal_seq = seq
+        result.replay_journal(tail, jids)
+
+        return result
+
+    @classmethod
+    def load(cls, fin, journal_ops=(), jids=None):
+        """
+        Load a poll from a snapshot and replay the tail of the journal.
+
+        :param fin: File to read the snapshot from.
+        :param journal_ops: Iterable of ``(seq, op)`` pairs from the
+            :class:`Journal` which refer to this poll.
+
+        Journal operations which are already included in the snapshot are
+        skipped.
+        """
+        return cls.from_dict(toml.load(fin), journal_ops, jids=jids)
+
+    @staticmethod
+    def history_from_dict(data: typing.Mapping, jids=None) -> typing.Mapping[
+            aioxmpp.JID, VoteHistory]:
+        """
+        Extract the vote history from snapshot data.
+        """
+        return {
+            _parse_jid(member, jids): VoteHistory(
+                map(VoteRecord.from_dict, votes)
+            )
+            for member, votes in data["votes"].items()
+        }
+
+    @classmethod
+    def from_dict(cls, data: typing.Mapping, journal_ops=(),
+                  history_loader=None, jids=None):
+        """
+        Construct a poll from snapshot data as returned by :meth:`to_dict`.
+
+        :param history_loader: If given, `data` only needs to contain the most
+            recent votes (see `full_history` of :meth:`to_dict`) and the
+            poll is constructed without history, as if
+            :meth:`unload_history` had been called with `history_loader`.
+
+        See :meth:`load` for the semantics of `journal_ops`.
+        """
+        history = cls.history_from_dict(data, jids)
         result = cls(
             data["id"],
             data["start_time"],
             data["end_time"] - data["start_time"],
             data["subject"],
-            map(aioxmpp.JID.fromstr, data["votes"].keys()),
+            (),
         )
+        result._member_data = history
+        result._current_votes = dict.fromkeys(history)
 
         result._flags.update(
             PollFlag(flag)
             for flag in data["flags"]
         )
 
-        for member, votes in data["votes"].items():
-            member = aioxmpp.JID.fromstr(member)
-            records = result._member_data[member]
-            records[:] = map(VoteRecord.from_dict, votes)
+        result._recount()
+        if history_loader is not None:
+            result.unload_history(history_loader)
 
         result.tag = data.get("tag")
         result.urls[:] = data.get("urls", [])
         result.description = data.get("description")
         result.made_current_at = data.get("made_current_at")
+        result.journal_seq = data.get("journal_seq", 0)
+
+        result.replay_journal(journal_ops, jids)
 
         return result
 
+    def replay_journal(self, journal_ops, jids=None):
+        """
+        Apply the operations from `journal_ops` which are not included in
+        this poll yet.
+
+        :param journal_ops: Iterable of ``(seq, op)`` pairs from the
+            :class:`Journal` which refer to this poll.
+        """
+        for seq, op in journal_ops:
+            if seq <= self.journal_seq:
+                continue
+            self.apply_journal_op(op, jids)
+            self.journal_seq = seq
+
+
+class PollEdit:
+    """
+    Collect changes to a :class:`Poll` without copying it.
+
+    :param poll: The poll to edit.
+
+    The attributes mirror those of :class:`Poll` and start out with the
+    values of `poll`. They do not affect `poll` until :meth:`apply` is
+    called, so that the snapshot of the edited poll (see :meth:`to_dict`)
+    can be written first. Votes are not part of an edit; they go through the
+    :class:`Journal`.
+
+    .. autoattribute:: poll
+
+    .. automethod:: to_dict
+
+    .. automethod:: apply
+    """
+
+    __slots__ = (
+        "_poll",
+        "flags",
+        "subject",
+        "tag",
+        "urls",
+        "description",
+        "made_current_at",
+    )
+
+    def __init__(self, poll: Poll):
+        super().__init__()
+        self._poll = poll
+        self.flags = set(poll.flags)
+        self.subject = poll.subject
+        self.tag = poll.tag
+        self.urls = list(poll.urls)
+        self.description = poll.description
+        self.made_current_at = poll.made_current_at
+
+    @property
+    def poll(self) -> Poll:
+        """
+        The poll being edited.
+        """
+        return self._poll
+
+    @property
+    def id_(self) -> str:
+        return self._poll.id_
+
+    def to_dict(self, journal_seq: int) -> typing.Mapping:
+        """
+        Return the snapshot data of the poll as it will be after
+        :meth:`apply`, including the journal up to `journal_seq`.
+
+        The poll itself is not modified.
+        """
+        data = self._poll.to_dict()
+        data["flags"] = list(flag.value for flag in self.flags)
+        data["subject"] = self.subject
+        data["tag"] = self.tag
+        data["urls"] = list(self.urls)
+        for key, value in [("description", self.description),
+                           ("made_current_at", self.made_current_at)]:
+            if value is not None:
+                data[key] = value
+            else:
+                data.pop(key, None)
+        if journal_seq:
+            data["journal_seq"] = journal_seq
+        else:
+            data.pop("journal_seq", None)
+        return data
+
+    def apply(self) -> Poll:
+        """
+        Apply the changes to the poll and return it.
+        """
+        poll = self._poll
+        poll.flags.clear()
+        poll.flags.update(self.flags)
+        poll.subject = self.subject
+        poll.tag = self.tag
+        poll.urls[:] = self.urls
+        poll.description = self.description
+        poll.made_current_at = self.made_current_at
+        return poll
+
+
+class Transaction:
+    """
+    Collect changes to the state which are to be committed as a unit.
+
+    .. attribute:: ops
+
+       List of :class:`Journal` operations. They are written as a single
+       record, i.e. with a single sync, and applied to the in-memory state
+       only after the record has been written.
+
+    .. attribute:: on_commit
+
+       List of callables which are invoked after the operations have been
+       applied.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ops = []
+        self.on_commit = []
+
 
 class State:
+    """
+    .. signal:: on_poll_concluded(poll_id, reason)
+
+    .. signal:: on_next_expiry_changed()
+
+       Emitted when a poll with a deadline earlier than all other deadlines
+       becomes active. See :attr:`next_expiry`.
+    """
+
     on_poll_concluded = aioxmpp.callbacks.Signal()
+    on_next_expiry_changed = aioxmpp.callbacks.Signal()
 
-    def __init__(self, config):
+    def __init__(self, config, *, rebuild_cache=False):
         super().__init__()
         self._member_map = {
             member["address"]: member
             for member in config["council"]["members"]
         }
+        # shared JID objects, passed to Poll methods as `jids`
+        self._jids = {
+            str(address): address
+            for address in self._member_map
+        }
         self._member_state_cache = {}
-        self._statedir = pathlib.Path(config["state"]["directory"]).resolve()
-        self._activedir = self._statedir / "polls" / "active"
-        self._activedir.mkdir(parents=True, exist_ok=True)
-        self._archivedir = self._statedir / "polls" / "archive"
-        self._archivedir.mkdir(parents=True, exist_ok=True)
-        self._trashdir = self._statedir / "polls" / "trash"
-        self._trashdir.mkdir(parents=True, exist_ok=True)
-        self._membersdir = self._statedir / "members"
-        self._membersdir.mkdir(parents=True, exist_ok=True)
-        self._agendadir = self._statedir / "agenda"
-        self._agendadir.mkdir(parents=True, exist_ok=True)
+        self._durability = Durability(
+            config["state"].get("durability", Durability.STRICT.value)
+        )
+        backend = config["state"].get("backend", DEFAULT_BACKEND)
+        if backend == MEMORY_BACKEND:
+            # nothing touches the disk, a directory is not required
+            self._statedir = None
+            self._journal = MemoryJournal()
+        else:
+            self._statedir = pathlib.Path(
+                config["state"]["directory"]
+            ).resolve()
+            self._statedir.mkdir(parents=True, exist_ok=True)
+            self._journal = Journal(self._statedir / JOURNAL_FILE,
+                                    self._durability)
+        self._storage = make_storage(backend, self._statedir,
+                                     self._durability)
+        self._journal_compact_threshold = config["state"].get(
+            "journal_compact_threshold",
+            DEFAULT_JOURNAL_COMPACT_THRESHOLD,
+        )
+        # polls and members which have journal records not covered by their
+        # files
+        self._journal_dirty_polls = set()
+        self._journal_dirty_members = set()
+        # members whose last message record has only been changed in memory
+        self._pending_members = set()
+
+        # LRU of ids of active polls whose vote history is held in memory
+        self._resident_histories = collections.OrderedDict()
+        self._max_resident_histories = config["state"].get(
+            "max_resident_histories",
+            DEFAULT_MAX_RESIDENT_HISTORIES,
+        )
 
         self._polls = {}
-        self.reload_polls()
+        # active poll with the most recent made_current_at, if any
+        self._newest_current = None
+        # min-heap of (end_time, poll_id); entries of polls which are not
+        # active anymore are dropped lazily
+        self._deadlines = []
+        self._tag_index = FuzzyIndex()
+        self._subject_index = FuzzyIndex()
+        self.reload_polls(rebuild_cache=rebuild_cache)
 
     def _get_current_poll(self) -> Poll:
         """
@@ -472,37 +1233,123 @@ class State:
         :attr:`Poll.made_current_at` timestamp, but only if that timestamp is
         not more than 30 minutes in the past.
 
-        This is an O(n) operation where n is the number of active polls.
+        This is an O(1) operation; the poll with the most recent timestamp is
+        tracked as polls are added and removed.
 
         There may be no current poll.
         """
-        newest = None
-        newest_timestamp = None
+        newest = self._newest_current
+        if newest is None:
+            return None
 
         cutoff = datetime.utcnow() - timedelta(minutes=30)
+        if newest.made_current_at < cutoff:
+            return None
 
-        for poll in self._polls.values():
-            if poll.made_current_at is None:
-                continue
+        return newest
 
-            if poll.made_current_at < cutoff:
-                continue
+    def _update_newest_current(self, poll: Poll):
+        if poll.made_current_at is None:
+            return
 
-            if (newest is None or poll.made_current_at > newest_timestamp):
-                newest = poll
-                newest_timestamp = poll.made_current_at
+        newest = self._newest_current
+        if (newest is None or
+                poll.made_current_at > newest.made_current_at or
+                newest.id_ == poll.id_):
+            self._newest_current = poll
 
-        return newest
+    def _find_newest_current(self):
+        # O(n), but only needed when the newest current poll goes away
+        self._newest_current = None
+        for poll in self._polls.values():
+            self._update_newest_current(poll)
 
     def _get_rounded_time(self):
         return datetime.utcnow().replace(minute=0, second=0, microsecond=0)
 
+    def _index_poll(self, poll: Poll):
+        if poll.tag is not None:
+            self._tag_index.add(poll.id_, poll.tag)
+        else:
+            self._tag_index.remove(poll.id_)
+        self._subject_index.add(poll.id_, poll.subject)
+
+    def _add_active_poll(self, poll: Poll):
+        self._polls[poll.id_] = poll
+        self._index_poll(poll)
+        self._update_newest_current(poll)
+        if poll.has_history:
+            self._touch_history(poll.id_)
+        if PollFlag.CONCLUDED in poll.flags:
+            # already announced, nothing left to expire
+            return
+
+        entry = (poll.end_time, poll.id_)
+        is_earliest = not self._deadlines or entry < self._deadlines[0]
+        heapq.heappush(self._deadlines, entry)
+        if is_earliest:
+            self.on_next_expiry_changed()
+
+    def _remove_active_poll(self, id_):
+        self._polls.pop(id_, None)
+        self._resident_histories.pop(id_, None)
+        self._tag_index.remove(id_)
+        self._subject_index.remove(id_)
+        if (self._newest_current is not None and
+                self._newest_current.id_ == id_):
+            self._find_newest_current()
+        # the deadline is dropped lazily
+
+    def _drop_stale_deadlines(self):
+        while self._deadlines:
+            end_time, poll_id = self._deadlines[0]
+            poll = self._polls.get(poll_id)
+            # a poll restored from trash or archive has a second entry, which
+            # must not conclude it again
+            if (poll is not None and poll.end_time == end_time and
+                    PollFlag.CONCLUDED not in poll.flags):
+                return
+            heapq.heappop(self._deadlines)
+
+    @property
+    def next_expiry(self) -> typing.Optional[datetime]:
+        """
+        The earliest point in time at which :meth:`expire_polls` will
+        conclude a poll, or :data:`None` if no poll is pending expiration.
+        """
+        self._drop_stale_deadlines()
+        if not self._deadlines:
+            return None
+
+        end_time, _ = self._deadlines[0]
+        # expiration is evaluated against the time rounded down to full
+        # hours, so we have to round up here
+        rounded = end_time.replace(minute=0, second=0, microsecond=0)
+        if rounded < end_time:
+            rounded += timedelta(hours=1)
+        return rounded
+
     def expire_polls(self):
+        """
+        Conclude all polls whose end time has passed.
+
+        This only looks at the earliest deadline(s) and is thus cheap if
+        nothing is due.
+        """
         cutoff = self._get_rounded_time()
-        for poll_id, poll in list(self._polls.items()):
-            state = poll.get_state(cutoff)
-            if state.is_concluded:
+        while True:
+            self._drop_stale_deadlines()
+            if not self._deadlines or self._deadlines[0][0] > cutoff:
+                return
+
+            entry = heapq.heappop(self._deadlines)
+            poll = self._polls[entry[1]]
+            try:
                 self._conclude_poll(poll)
+            except:  # NOQA
+                # try again next time
+                heapq.heappush(self._deadlines, entry)
+                raise
 
     def autoconclude_polls(self, cutoff=timedelta(hours=-1)):
         raise NotImplementedError
@@ -541,49 +1388,123 @@ class State:
 
         return any_concluded
 
-    def _poll_filename(self, id_):
-        return "{}.toml".format(id_)
-
     def _archive_poll(self, id_):
         logger.debug("archiving poll: %s", id_)
-        filename = self._poll_filename(id_)
-        (self._activedir / filename).rename(self._archivedir / filename)
-        self._polls.pop(id_, None)
+        self._compact_journal_before_move()
+        self._storage.move_poll(id_, PollLocation.ACTIVE,
+                                PollLocation.ARCHIVE)
+        self._remove_active_poll(id_)
 
     def _trash_poll(self, id_):
         logger.debug("trashing poll: %s", id_)
-        filename = self._poll_filename(id_)
-        (self._activedir / filename).rename(self._trashdir / filename)
-        self._polls.pop(id_, None)
+        self._compact_journal_before_move()
+        self._storage.move_poll(id_, PollLocation.ACTIVE,
+                                PollLocation.TRASH)
+        self._remove_active_poll(id_)
 
     def _unarchive_poll(self, id_):
         logger.debug("recovering poll from archive: %s", id_)
-        filename = self._poll_filename(id_)
-        active_path = self._activedir / filename
-        (self._archivedir / filename).rename(active_path)
-        with active_path.open("r") as f:
-            self._polls[id_] = Poll.load(f)
+        self._storage.move_poll(id_, PollLocation.ARCHIVE,
+                                PollLocation.ACTIVE)
+        self._add_active_poll(self._make_poll(self._storage.load_poll(id_)))
 
     def _untrash_poll(self, id_):
         logger.debug("restoring poll from trash: %s", id_)
-        filename = self._poll_filename(id_)
-        active_path = self._activedir / filename
-        (self._trashdir / filename).rename(active_path)
-        with active_path.open("r") as f:
-            self._polls[id_] = Poll.load(f)
+        self._storage.move_poll(id_, PollLocation.TRASH,
+                                PollLocation.ACTIVE)
+        self._add_active_poll(self._make_poll(self._storage.load_poll(id_)))
 
     def _delete_poll(self, id_):
         logger.debug("deleting poll: %s", id_)
-        filename = self._poll_filename(id_)
-        (self._trashdir / filename).unlink()
+        self._storage.delete_poll(id_)
+
+    def _make_poll(self, data, complete=True, journal_ops=()) -> Poll:
+        """
+        Create a poll from data obtained from the storage backend.
+
+        If `data` is not `complete`, the vote history of the poll is loaded
+        from the backend on demand.
+        """
+        if complete:
+            poll = Poll.from_dict(data, jids=self._jids)
+        else:
+            poll = Poll.from_dict(
+                data,
+                history_loader=functools.partial(self._load_poll_history,
+                                                 data["id"]),
+                jids=self._jids,
+            )
+
+        poll.replay_journal(journal_ops, self._jids)
+        return poll
+
+    def _load_poll_history(self, id_):
+        logger.debug("loading vote history of poll %s", id_)
+        history = Poll.history_from_dict(self._storage.load_poll(id_),
+                                         self._jids)
+
+        self._touch_history(id_)
+        return history
+
+    def _touch_history(self, id_):
+        self._resident_histories[id_] = True
+        self._resident_histories.move_to_end(id_)
+        self._evict_histories()
+
+    def _evict_histories(self):
+        excess = len(self._resident_histories) - self._max_resident_histories
+        if excess <= 0:
+            return
 
-    def reload_polls(self):
+        for id_ in list(self._resident_histories):
+            if excess <= 0:
+                break
+            # the file only has the full history if there are no journal
+            # records for the poll
+            if id_ in self._journal_dirty_polls:
+                continue
+            poll = self._polls.get(id_)
+            del self._resident_histories[id_]
+            excess -= 1
+            if poll is None or not poll.has_history:
+                continue
+            logger.debug("unloading vote history of poll %s", id_)
+            poll.unload_history(
+                functools.partial(self._load_poll_history, id_)
+            )
+
+    def reload_polls(self, rebuild_cache=False):
+        """
+        Reload all active polls from disk.
+
+        :param rebuild_cache: If true, caches of the storage backend (such as
+            the :class:`~.storage.SnapshotCache`) are not used and rebuilt.
+        """
         logger.debug("reload_polls: reloading all polls")
         self._polls.clear()
+        self._newest_current = None
+        self._deadlines.clear()
+        self._tag_index.clear()
+        self._subject_index.clear()
+        self._member_state_cache.clear()
+        self._journal_dirty_polls.clear()
+        self._journal_dirty_members.clear()
+        self._pending_members.clear()
+        self._resident_histories.clear()
+
+        journal_ops = collections.defaultdict(list)
+        member_ops = []
+        for seq, ops in self._journal.replay():
+            for op in ops:
+                if op["op"] == "last_message":
+                    member_ops.append((seq, op))
+                else:
+                    journal_ops[op["poll"]].append((seq, op))
+
         to_archive = []
-        for item in self._activedir.iterdir():
-            with item.open("r") as f:
-                data = Poll.load(f)
+        for raw, complete in self._storage.load_active_polls(rebuild_cache):
+            ops = journal_ops.pop(raw["id"], ())
+            data = self._make_poll(raw, complete, ops)
 
             if PollState.CONCLUDED in data.flags:
                 logger.debug(
@@ -595,13 +1516,50 @@ class State:
                 to_archive.append(data.id_)
                 continue
 
-            self._polls[data.id_] = data
+            if data.journal_seq > raw.get("journal_seq", 0):
+                # the history in memory is ahead of the file now
+                self._journal_dirty_polls.add(data.id_)
+            self._add_active_poll(data)
             logger.debug("reload_polls: loaded poll %s", data.id_)
 
+        for id_, ops in journal_ops.items():
+            if ops[0][1]["op"] != "create_poll":
+                logger.warning(
+                    "reload_polls: journal refers to poll %s which is not "
+                    "active",
+                    id_,
+                )
+                continue
+
+            self._journal_dirty_polls.add(id_)
+            self._add_active_poll(Poll.from_journal(ops, self._jids))
+            logger.debug("reload_polls: recovered poll %s from journal", id_)
+
+        for seq, op in member_ops:
+            actor = _parse_jid(op["member"], self._jids)
+            if actor not in self._member_map:
+                logger.warning(
+                    "reload_polls: journal refers to %s who is not a member",
+                    actor,
+                )
+                continue
+
+            if seq <= self._read_member_state(actor).get("journal_seq", 0):
+                continue
+
+            self._apply_journal_op(seq, op)
+
+        if self._journal.nrecords:
+            # fold the replayed records into the snapshots right away; only
+            # the polls and members they changed are written
+            self.compact_journal()
+
         for id_ in to_archive:
             logger.debug("reload_polls: archiving concluded poll: %s", id_)
             self._archive_poll(id_)
 
+        self._storage.flush()
+
     def make_transaction_id(self):
         return "t{}".format(
             base64.urlsafe_b64encode(
@@ -609,12 +1567,8 @@ class State:
             ).decode("ascii").rstrip("=")
         )
 
-    def _member_file(self, actor):
-        return (
-            self._membersdir / "{}.toml".format(
-                self._member_map[actor]["nick"]
-            )
-        )
+    def _member_name(self, actor):
+        return self._member_map[actor]["nick"]
 
     def _read_member_state(self, actor):
         try:
@@ -622,69 +1576,176 @@ class State:
         except KeyError:
             pass
 
-        try:
-            with self._member_file(actor).open("r") as f:
-                return toml.load(f)
-        except FileNotFoundError:
-            return {
+        state = self._storage.read_member_state(self._member_name(actor))
+        if state is None:
+            state = {
                 "last_message": {
-                    "id": None,
+                    "message_id": None,
                     "transaction": None,
                 }
             }
 
-    def _write_member_state(self, actor, new_state):
-        member_file = self._member_file(actor)
+        self._member_state_cache[actor] = state
+        return state
 
-        with safe_writer(member_file, "w") as fout:
-            toml.dump(new_state, fout)
+    def _write_member_state(self, actor, new_state):
+        new_state["journal_seq"] = self._journal.last_seq
+        self._storage.write_member_state(self._member_name(actor), new_state)
 
         self._member_state_cache[actor] = new_state
+        self._journal_dirty_members.discard(actor)
 
-    def _commit_poll_changes(self, new_obj: Poll):
-        with safe_writer(
-                self._activedir / self._poll_filename(new_obj.id_),
-                "w") as f:
-            new_obj.dump(f)
+    def _write_poll_snapshot(self, poll: Poll):
+        poll.journal_seq = self._journal.last_seq
+        self._storage.write_poll(poll.to_dict())
+        self._journal_dirty_polls.discard(poll.id_)
 
-        self._polls[new_obj.id_] = new_obj
+    def compact_journal(self):
+        """
+        Fold all journal records into the poll and member files and reset the
+        journal.
+        """
+        logger.debug("compacting journal (%d records)",
+                     self._journal.nrecords)
+        for id_ in list(self._journal_dirty_polls):
+            self._write_poll_snapshot(self._polls[id_])
+
+        self._journal_dirty_members.update(self._pending_members)
+        self._pending_members.clear()
+        for actor in list(self._journal_dirty_members):
+            self._write_member_state(actor, self._member_state_cache[actor])
+
+        # the journal may only go once the snapshots cannot be lost anymore
+        self._storage.sync()
+        self._journal.reset()
+        self._evict_histories()
+
+    def _compact_journal_before_move(self):
+        # the journal must not refer to polls which are not active, otherwise
+        # a poll created via the journal would be resurrected on reload
+        if self._journal.nrecords:
+            self.compact_journal()
+
+    def _apply_journal_op(self, seq: int, op: typing.Mapping):
+        kind = op["op"]
+        if kind == "last_message":
+            actor = _parse_jid(op["member"], self._jids)
+            state = self._read_member_state(actor)
+            state["last_message"] = op["last_message"]
+            state["journal_seq"] = seq
+            self._journal_dirty_members.add(actor)
+            self._pending_members.discard(actor)
+            return
+
+        # mark the poll dirty first so that its history is not evicted
+        self._journal_dirty_polls.add(op["poll"])
+        if kind == "create_poll":
+            self._add_active_poll(Poll.from_journal([(seq, op)], self._jids))
+        else:
+            poll = self._polls[op["poll"]]
+            poll.apply_journal_op(op, self._jids)
+            poll.journal_seq = seq
+            if kind == "set_metadata":
+                self._index_poll(poll)
 
     @contextlib.contextmanager
-    def _edit_poll(self, poll: typing.Union[Poll, str]) -> Poll:
-        if isinstance(poll, Poll):
-            poll = copy.copy(poll)
+    def _transaction(self, txn: typing.Optional[Transaction] = None):
+        """
+        Open a :class:`Transaction`, or join `txn` if it is not :data:`None`.
+
+        When the outermost context exits without exception, the operations
+        are written to the journal as a single record and applied. On
+        exception, the operations are discarded.
+        """
+        if txn is not None:
+            yield txn
+            return
+
+        txn = Transaction()
+        yield txn
+
+        if txn.ops:
+            seq = self._journal.append(txn.ops)
+            for op in txn.ops:
+                self._apply_journal_op(seq, op)
+
+        for cb in txn.on_commit:
+            cb()
+
+        if self._journal.nrecords >= self._journal_compact_threshold:
+            self.compact_journal()
+
+    def _commit_poll_changes(self, edit: PollEdit):
+        # the live poll is only changed once the snapshot has been written
+        seq = self._journal.last_seq
+        self._storage.write_poll(edit.to_dict(journal_seq=seq))
+        new_obj = edit.apply()
+        new_obj.journal_seq = seq
+        self._journal_dirty_polls.discard(new_obj.id_)
+
+        self._polls[new_obj.id_] = new_obj
+        self._index_poll(new_obj)
+        if (self._newest_current is not None and
+                self._newest_current.id_ == new_obj.id_):
+            # made_current_at may have moved backwards
+            self._find_newest_current()
         else:
-            poll = self._open_poll_for_writing(poll)
+            self._update_newest_current(new_obj)
+        if new_obj.has_history:
+            self._touch_history(new_obj.id_)
 
-        yield poll
-        # on exception, changes are discarded
-        self._commit_poll_changes(poll)
+    @contextlib.contextmanager
+    def _edit_poll(self, poll: typing.Union[Poll, str]) -> PollEdit:
+        if not isinstance(poll, Poll):
+            poll = self._polls[poll]
+
+        edit = PollEdit(poll)
+        yield edit
+        # on exception, including failure to write the snapshot, changes are
+        # discarded
+        self._commit_poll_changes(edit)
 
     def _rewrite_member_last_message(self, actor,
                                      message_id,
                                      transaction,
-                                     reply_id=None):
+                                     reply_id=None,
+                                     txn=None):
         state = self._read_member_state(actor)
         prev_transaction = state["last_message"].get("transaction")
-        if prev_transaction is not None:
-            self._confirm_transaction(prev_transaction)
-        state["last_message"]["transaction"] = transaction
-        state["last_message"]["message_id"] = message_id
-        state["last_message"]["reply_id"] = \
-            transaction["tid"] if transaction is not None else reply_id
+        last_message = {
+            "transaction": transaction,
+            "message_id": message_id,
+            "reply_id":
+                transaction["tid"] if transaction is not None else reply_id,
+        }
 
-        # commented out because untested
-        # if prev_transaction is None and transaction is None:
-        #     # no need to actually re-write the state
-        #     return
+        if prev_transaction is None and transaction is None and txn is None:
+            # nothing which could be reverted changes hands, so there is no
+            # need to make this durable right away; it is flushed lazily by
+            # flush_member_state
+            state["last_message"] = last_message
+            self._pending_members.add(actor)
+            return
 
-        self._write_member_state(actor, state)
+        with self._transaction(txn) as txn:
+            txn.ops.append({
+                "op": "last_message",
+                "member": str(actor),
+                "last_message": last_message,
+            })
+            if prev_transaction is not None:
+                txn.on_commit.append(
+                    functools.partial(self._confirm_transaction,
+                                      prev_transaction)
+                )
 
-    def write_last_message_id(self, actor, message_id, reply_id=None):
-        self._rewrite_member_last_message(actor, message_id, None, reply_id)
+    def write_last_message_id(self, actor, message_id, reply_id=None,
+                              txn=None):
+        self._rewrite_member_last_message(actor, message_id, None, reply_id,
+                                          txn=txn)
 
     def write_last_transaction(self, actor, message_id,
-                               tid, action, revert_data):
+                               tid, action, revert_data, txn=None):
         transaction = {
             "actor": str(actor),
             "tid": tid,
@@ -693,25 +1754,74 @@ class State:
         }
 
         if message_id is None:
-            self._confirm_transaction(transaction)
-            self.write_last_message_id(actor, message_id)
+            with self._transaction(txn) as txn:
+                self.write_last_message_id(actor, message_id, txn=txn)
+                txn.on_commit.append(
+                    functools.partial(self._confirm_transaction, transaction)
+                )
+            return
+
+        self._rewrite_member_last_message(actor, message_id, transaction,
+                                          txn=txn)
+
+    def flush_member_state(self):
+        """
+        Durably write the last message records which have only been updated
+        in memory so far.
+
+        All pending records are written with a single journal record.
+        """
+        if not self._pending_members:
             return
 
-        self._rewrite_member_last_message(actor, message_id, transaction)
+        logger.debug("flushing last message records of %d members",
+                     len(self._pending_members))
+        with self._transaction() as txn:
+            for actor in self._pending_members:
+                txn.ops.append({
+                    "op": "last_message",
+                    "member": str(actor),
+                    "last_message":
+                        self._member_state_cache[actor]["last_message"],
+                })
+
+    @property
+    def durability(self) -> Durability:
+        return self._durability
+
+    def sync(self):
+        """
+        Sync all changes to disk.
+
+        This only has an effect if :attr:`durability` is not
+        :attr:`Durability.STRICT`.
+        """
+        self._journal.sync()
+
+    def close(self):
+        """
+        Flush pending state and close the journal and the storage backend.
+        """
+        self.flush_member_state()
+        self._journal.close()
+        self._storage.close()
 
     def _confirm_transaction(self, transaction):
         logger.debug("confirming transaction %r", transaction)
         if transaction["action"] == "delete":
             self._delete_poll(transaction["revert_data"]["id"])
 
-    def _open_poll_for_writing(self, poll_id: str) -> Poll:
-        return copy.copy(self._polls[poll_id])
-
-    def _revert_last_cast_vote(self, poll_id, actor):
-        with self._edit_poll(poll_id) as poll:
-            poll.pop_vote(actor)
-
-    def _revert_transaction(self, actor, transaction):
+    def _revert_last_cast_vote(self, poll_id, actor, txn=None):
+        # fail for unknown polls before anything is written
+        self._polls[poll_id]
+        with self._transaction(txn) as txn:
+            txn.ops.append({
+                "op": "pop_vote",
+                "poll": poll_id,
+                "member": str(actor),
+            })
+
+    def _revert_transaction(self, actor, transaction, txn=None):
         logger.debug("reverting transaction %r", transaction)
 
         action = transaction["action"]
@@ -728,22 +1838,18 @@ class State:
             self._untrash_poll(poll_id)
         elif action == "cast_vote":
             poll_id = transaction["revert_data"]["id"]
-            self._revert_last_cast_vote(poll_id, actor)
+            self._revert_last_cast_vote(poll_id, actor, txn=txn)
         elif action == "attach_url":
             poll_id = transaction["revert_data"]["id"]
             url = transaction["revert_data"]["url"]
-            with self._edit_poll(poll_id) as poll:
-                try:
-                    poll.urls.remove(url)
-                except ValueError as exc:
-                    # not in urls, maybe edited already, ignore
-                    logger.debug(
-                        "revert attach_url: failed to remove %s from poll "
-                        "%s: %s",
-                        url,
-                        poll_id,
-                        exc,
-                    )
+            # fail for unknown polls before anything is written
+            self._polls[poll_id]
+            with self._transaction(txn) as txn:
+                txn.ops.append({
+                    "op": "remove_url",
+                    "poll": poll_id,
+                    "url": url,
+                })
         else:
             raise RuntimeError("unknown transaction: {!r}".format(transaction))
 
@@ -751,19 +1857,30 @@ class State:
         logger.debug("revert of transaction triggered by %s from %s requested",
                      message_id, actor)
         member_state = self._read_member_state(actor)
-        last_id = member_state["last_message"]["message_id"]
+        # TOML cannot represent None, so the keys may be missing
+        last_id = member_state["last_message"].get("message_id")
         if last_id != message_id:
             logger.debug("%s is not the last message_id (%s) seen from %s",
                          message_id, last_id, actor)
             return
-        transaction = member_state["last_message"]["transaction"]
+        transaction = member_state["last_message"].get("transaction")
         if transaction is None:
             logger.debug("no transaction associated with %s", message_id)
             return
 
-        member_state["last_message"]["transaction"] = None
+        with self._transaction() as txn:
+            self._revert_transaction(actor, transaction, txn=txn)
+            # the transaction must not be reverted twice, so this has to
+            # become durable together with the reversal
+            txn.ops.append({
+                "op": "last_message",
+                "member": str(actor),
+                "last_message": dict(
+                    member_state["last_message"],
+                    transaction=None,
+                ),
+            })
 
-        self._revert_transaction(actor, transaction)
         return transaction["tid"]
 
     def _conclude_poll(self, poll: Poll):
@@ -774,11 +1891,11 @@ class State:
                 "cannot conclude poll with open votes before expiration"
             )
 
-        with self._edit_poll(poll) as poll:
-            poll.flags.add(PollFlag.CONCLUDED)
+        with self._edit_poll(poll) as edit:
+            edit.flags.add(PollFlag.CONCLUDED)
 
             self.on_poll_concluded(
-                poll.id_,
+                edit.id_,
                 state.conclusion_reason,
             )
 
@@ -801,22 +1918,24 @@ class State:
             slugify(topic)[:50]
         )
 
-        poll = Poll(
-            id_,
-            start_time,
-            lifetime,
-            topic,
-            self._member_map.keys(),
-        )
-        poll.urls[:] = urls
-        poll.tag = tag
-        poll.description = description
-        poll.made_current_at = datetime.utcnow()
-        path = self._activedir / self._poll_filename(id_)
-
-        try:
-            with path.open("x") as f:
-                poll.dump(f)
+        if (id_ in self._polls or
+                self._storage.has_poll(id_)):
+            raise FileExistsError(id_)
+
+        with self._transaction() as txn:
+            # the poll file is only written when the journal is compacted
+            txn.ops.append({
+                "op": "create_poll",
+                "poll": id_,
+                "start_time": format_timestamp(start_time),
+                "end_time": format_timestamp(start_time + lifetime),
+                "subject": topic,
+                "members": [str(member) for member in self._member_map],
+                "tag": tag,
+                "urls": list(urls),
+                "description": description,
+                "made_current_at": format_timestamp(datetime.utcnow()),
+            })
 
             self.write_last_transaction(
                 actor,
@@ -824,16 +1943,8 @@ class State:
                 tid,
                 action="create",
                 revert_data={"id": id_},
+                txn=txn,
             )
-        except:  # NOQA
-            try:
-                path.unlink()
-            except FileNotFoundError:
-                pass
-
-            raise
-
-        self._polls[id_] = poll
 
         return tid, id_
 
@@ -848,12 +1959,18 @@ class State:
         # data for reversal: dirname
         tid = self.make_transaction_id()
 
-        with self._edit_poll(poll_id) as poll:
-            poll.push_vote(
-                actor,
-                value,
-                remark,
-            )
+        # fail for unknown polls and non-members before anything is written
+        self._polls[poll_id].get_votes(actor)
+
+        with self._transaction() as txn:
+            txn.ops.append({
+                "op": "push_vote",
+                "poll": poll_id,
+                "member": str(actor),
+                "timestamp": format_timestamp(datetime.utcnow()),
+                "value": value.value,
+                "remark": remark,
+            })
 
             self.write_last_transaction(
                 actor,
@@ -861,6 +1978,7 @@ class State:
                 tid,
                 "cast_vote",
                 revert_data={"id": poll_id},
+                txn=txn,
             )
 
         return tid
@@ -872,19 +1990,55 @@ class State:
                    url: str) -> TransactionID:
         tid = self.make_transaction_id()
 
-        with self._edit_poll(poll_id) as poll:
-            poll.urls.append(url)
+        # fail for unknown polls before anything is written
+        self._polls[poll_id]
+
+        with self._transaction() as txn:
+            txn.ops.append({
+                "op": "append_url",
+                "poll": poll_id,
+                "url": url,
+            })
 
             self.write_last_transaction(
                 actor,
                 message_id,
                 tid,
                 "attach_url",
-                revert_data={"id": poll_id, "url": url}
+                revert_data={"id": poll_id, "url": url},
+                txn=txn,
             )
 
         return tid
 
+    def update_poll_metadata(self,
+                             poll_id: str,
+                             subject: str,
+                             tag: typing.Optional[str],
+                             urls: typing.List[str],
+                             description: typing.Optional[str]):
+        """
+        Replace the subject, tag, URLs and description of a poll.
+
+        This is not a transaction of a member and thus cannot be reverted;
+        it is meant for metadata which the bot looks up after the poll has
+        been created. The poll ID does not change.
+
+        :raises KeyError: if the poll is not active (anymore).
+        """
+        # fail for unknown polls before anything is written
+        self._polls[poll_id]
+
+        with self._transaction() as txn:
+            txn.ops.append({
+                "op": "set_metadata",
+                "poll": poll_id,
+                "subject": subject,
+                "tag": tag,
+                "urls": list(urls),
+                "description": description,
+            })
+
     def delete_poll(self, actor, message_id, poll_id) -> TransactionID:
         # data for reversal: dirname; the directory is not deleted right away,
         # only when the deletion transaction becomes irreversible
@@ -910,44 +2064,25 @@ class State:
         # data for reversal: dirname, old_topic
         tid = self.make_transaction_id()
 
-    def _find_poll_in_listmap(self, text, pollmap, confidence) -> str:
-        options = [item[0].casefold() for item in pollmap]
-        match = difflib.get_close_matches(text, options, n=1,
-                                          cutoff=confidence)
-        if not match:
-            raise KeyError(text)
-
-        match, = match
+    def find_poll(self, text) -> str:
+        """
+        Find an active poll by ID, tag or subject.
 
-        return pollmap[options.index(match)][1]
+        An exact match of the poll ID or tag wins. Otherwise, the tag is fuzzy
+        matched with high confidence and, failing that, the subject is fuzzy
+        matched with lower confidence.
 
-    def find_poll(self, text) -> str:
-        text = text.casefold()
+        :raises KeyError: if no poll matches.
+        """
+        if text in self._polls:
+            return text
 
-        pollmap = [
-            (poll.tag, poll.id_)
-            for poll in self._polls.values()
-            if poll.tag is not None
-        ]
         try:
-            return self._find_poll_in_listmap(
-                text,
-                pollmap,
-                confidence=0.8
-            )
+            return self._tag_index.find(text, cutoff=0.8)
         except KeyError:
             pass
 
-        pollmap = [
-            (poll.subject, poll.id_)
-            for poll in self._polls.values()
-        ]
-
-        return self._find_poll_in_listmap(
-            text,
-            pollmap,
-            confidence=0.4
-        )
+        return self._subject_index.find(text, cutoff=0.4)
 
     def get_poll(self, poll_id: str) -> Poll:
         self.expire_polls()
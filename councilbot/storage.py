@@ -0,0 +1,789 @@
+import abc
+import contextlib
+import copy
+import enum
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import tempfile
+import time
+import typing
+
+from datetime import datetime
+
+import toml
+
+
+logger = logging.getLogger(__name__)
+
+
+SNAPSHOT_CACHE_FILE = "active-polls.json"
+SQLITE_FILE = "state.sqlite3"
+MEMORY_BACKEND = "memory"
+
+
+class Durability(enum.Enum):
+    """
+    When changes are synced to disk.
+
+    .. attribute:: STRICT
+
+       Every journal record is synced when it is written and directories are
+       synced after files are replaced or moved, so that changes survive a
+       crash as soon as the call making them returns.
+
+    .. attribute:: GROUP
+
+       Journal records are only written to the OS; :meth:`State.sync` syncs
+       all of them at once. Callers are expected to batch syncs and to
+       acknowledge changes only after the sync (see
+       :class:`~.asyncstate.AsyncState`).
+
+    .. attribute:: RELAXED
+
+       Like :attr:`GROUP`, but changes may be acknowledged before they have
+       been synced. A crash of the OS may lose the most recent changes.
+    """
+
+    STRICT = "strict"
+    GROUP = "group"
+    RELAXED = "relaxed"
+
+
+def fsync_dir(path: pathlib.Path):
+    """
+    Call :func:`os.fsync` on a directory.
+
+    :param path: The directory to fsync.
+    """
+    fd = os.open(str(path), os.O_DIRECTORY | os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def safe_writer(destpath, mode="wb", extra_paranoia=False):
+    """
+    Safely overwrite a file.
+
+    This guards against the following situations:
+
+    * error/exception while writing the file (the original file stays intact
+      without modification)
+    * most cases of unclean shutdown (*either* the original *or* the new file
+      will be seen on disk)
+
+    It does that with the following means:
+
+    * a temporary file next to the target file is used for writing
+    * if an exception is raised in the context manager, the temporary file is
+      discarded and nothing else happens
+    * otherwise, the temporary file is synced to disk and then used to replace
+      the target file.
+
+    If `extra_paranoia` is true, the parent directory of the target file is
+    additionally synced after the replacement. `extra_paranoia` is only needed
+    if it is required that the new file is seen after a crash (and not the
+    original file).
+    """
+
+    destpath = pathlib.Path(destpath)
+    with tempfile.NamedTemporaryFile(
+            mode=mode,
+            dir=str(destpath.parent),
+            delete=False) as tmpfile:
+        try:
+            yield tmpfile
+        except:  # NOQA
+            os.unlink(tmpfile.name)
+            raise
+        else:
+            tmpfile.flush()
+            os.fsync(tmpfile.fileno())
+            os.replace(tmpfile.name, str(destpath))
+            if extra_paranoia:
+                fsync_dir(destpath.parent)
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return {"$datetime": obj.isoformat()}
+    raise TypeError("cannot serialise {!r}".format(obj))
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and "$datetime" in obj:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+class SnapshotCache:
+    """
+    Cache of parsed poll snapshot files.
+
+    :param path: Path of the cache file.
+
+    Parsing TOML is slow. This cache holds the parsed contents of each poll
+    file in a single JSON file, together with the size and modification time
+    of the file it was parsed from. Entries are only used if both still
+    match.
+
+    As with the git index, entries of files which were modified shortly
+    before the cache was written are not trusted, because a later
+    modification may not have changed the modification time on file systems
+    with coarse timestamps.
+
+    .. automethod:: load
+
+    .. automethod:: get
+
+    .. automethod:: put
+
+    .. automethod:: remove
+
+    .. automethod:: save
+    """
+
+    VERSION = 2
+    RACY_WINDOW_NS = 2 * 10**9
+
+    def __init__(self, path: pathlib.Path):
+        super().__init__()
+        self._path = path
+        self._entries = {}
+        self._dirty = False
+
+    def load(self):
+        """
+        Load the cache from disk.
+
+        A missing, corrupt or outdated cache file is treated as empty.
+        """
+        self._entries = {}
+        self._dirty = False
+        try:
+            with self._path.open("r") as f:
+                data = json.load(f, object_hook=_json_object_hook)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning("snapshot cache is corrupt, ignoring it",
+                           exc_info=True)
+            return
+
+        if data.get("version") != self.VERSION:
+            logger.info("snapshot cache has unsupported version %r, "
+                        "ignoring it",
+                        data.get("version"))
+            return
+
+        cutoff = data["written_ns"] - self.RACY_WINDOW_NS
+        self._entries = {
+            name: entry
+            for name, entry in data["entries"].items()
+            if entry["mtime_ns"] < cutoff
+        }
+        if len(self._entries) != len(data["entries"]):
+            self._dirty = True
+
+    def get(self, name: str, st: os.stat_result) -> typing.Optional[
+            typing.Mapping]:
+        """
+        Return the cached data for the file `name` with status `st`, or
+        :data:`None` if there is no valid entry.
+        """
+        entry = self._entries.get(name)
+        if (entry is None or
+                entry["size"] != st.st_size or
+                entry["mtime_ns"] != st.st_mtime_ns):
+            return None
+        return entry["data"]
+
+    def put(self, name: str, st: os.stat_result, data: typing.Mapping):
+        """
+        Store `data` as the contents of the file `name` with status `st`.
+        """
+        self._entries[name] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "data": data,
+        }
+        self._dirty = True
+
+    def remove(self, name: str):
+        if self._entries.pop(name, None) is not None:
+            self._dirty = True
+
+    def retain(self, names: typing.Collection[str]):
+        """
+        Drop all entries except those for `names`.
+        """
+        for name in list(self._entries.keys() - names):
+            self.remove(name)
+
+    def save(self):
+        """
+        Write the cache to disk if it has changed.
+        """
+        if not self._dirty:
+            return
+
+        data = {
+            "version": self.VERSION,
+            "written_ns": time.time_ns(),
+            "entries": self._entries,
+        }
+        with safe_writer(self._path, "w") as f:
+            json.dump(data, f, default=_json_default,
+                      separators=(",", ":"))
+        self._dirty = False
+
+
+class PollLocation(enum.Enum):
+    ACTIVE = "active"
+    ARCHIVE = "archive"
+    TRASH = "trash"
+
+
+def summarise_poll_data(data: typing.Mapping) -> typing.Mapping:
+    """
+    Return poll snapshot data with only the most recent vote of each member.
+
+    The result is equal to ``Poll.to_dict(full_history=False)`` of the poll
+    loaded from `data`.
+    """
+    result = dict(data)
+    result["votes"] = {
+        member: votes[-1:]
+        for member, votes in data["votes"].items()
+    }
+    return result
+
+
+class StorageBackend(metaclass=abc.ABCMeta):
+    """
+    Persistent storage of polls and member state.
+
+    Polls are identified by their ID and are in one of the
+    :class:`PollLocation`. Member state is identified by the nickname of the
+    member. Data is exchanged as mappings in the format of
+    :meth:`~.state.Poll.to_dict`.
+
+    .. automethod:: load_active_polls
+
+    .. automethod:: load_poll
+
+    .. automethod:: write_poll
+
+    .. automethod:: move_poll
+
+    .. automethod:: delete_poll
+
+    .. automethod:: has_poll
+
+    .. automethod:: list_polls
+
+    .. automethod:: read_member_state
+
+    .. automethod:: write_member_state
+
+    .. automethod:: list_members
+
+    .. automethod:: flush
+
+    .. automethod:: sync
+
+    .. automethod:: close
+    """
+
+    @abc.abstractmethod
+    def load_active_polls(self, rebuild_cache=False) -> typing.Iterator[
+            typing.Tuple[typing.Mapping, bool]]:
+        """
+        Load all active polls.
+
+        :param rebuild_cache: If true, caches are not used and rebuilt.
+        :return: Iterator of ``(data, complete)`` pairs. If `complete` is
+            false, `data` only holds the most recent votes (see
+            :func:`summarise_poll_data`) and :meth:`load_poll` has to be used
+            to obtain the full history.
+        """
+
+    @abc.abstractmethod
+    def load_poll(self, poll_id: str,
+                  location: PollLocation = PollLocation.ACTIVE
+                  ) -> typing.Mapping:
+        """
+        Load the complete data of a poll.
+
+        :raises KeyError: if there is no such poll at `location`.
+        """
+
+    @abc.abstractmethod
+    def write_poll(self, data: typing.Mapping,
+                   location: PollLocation = PollLocation.ACTIVE):
+        """
+        Create or replace a poll.
+        """
+
+    @abc.abstractmethod
+    def move_poll(self, poll_id: str,
+                  src: PollLocation,
+                  dest: PollLocation):
+        """
+        Move a poll from `src` to `dest`.
+        """
+
+    @abc.abstractmethod
+    def delete_poll(self, poll_id: str):
+        """
+        Delete a poll from the trash.
+        """
+
+    @abc.abstractmethod
+    def has_poll(self, poll_id: str,
+                 location: PollLocation = PollLocation.ACTIVE) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def list_polls(self, location: PollLocation) -> typing.List[str]:
+        """
+        Return the IDs of all polls at `location`.
+        """
+
+    @abc.abstractmethod
+    def read_member_state(self, name: str) -> typing.Optional[
+            typing.Mapping]:
+        """
+        Return the state of a member, or :data:`None` if there is none.
+        """
+
+    @abc.abstractmethod
+    def write_member_state(self, name: str, data: typing.Mapping):
+        pass
+
+    @abc.abstractmethod
+    def list_members(self) -> typing.List[str]:
+        """
+        Return the names of all members which have state.
+        """
+
+    def flush(self):
+        """
+        Write out caches.
+        """
+
+    def sync(self):
+        """
+        Make all polls and member states written so far durable.
+
+        With :attr:`Durability.STRICT`, every write is durable on its own and
+        this does nothing.
+        """
+
+    def close(self):
+        self.flush()
+
+
+class TomlStorage(StorageBackend):
+    """
+    Store each poll and each member in a TOML file.
+
+    :param statedir: Root directory of the state.
+    :param durability: The :class:`Durability` mode.
+
+    Polls are stored in ``polls/<location>/<id>.toml`` and members in
+    ``members/<name>.toml``. The active polls are additionally cached in a
+    :class:`SnapshotCache`.
+    """
+
+    def __init__(self, statedir: pathlib.Path,
+                 durability: Durability = Durability.STRICT):
+        super().__init__()
+        self._durability = durability
+        self._polldirs = {
+            location: statedir / "polls" / location.value
+            for location in PollLocation
+        }
+        self._membersdir = statedir / "members"
+        self._cachedir = statedir / "cache"
+        for path in [*self._polldirs.values(),
+                     self._membersdir,
+                     statedir / "agenda",
+                     self._cachedir]:
+            path.mkdir(parents=True, exist_ok=True)
+        self._snapshot_cache = SnapshotCache(
+            self._cachedir / SNAPSHOT_CACHE_FILE
+        )
+
+    def _poll_filename(self, poll_id):
+        return "{}.toml".format(poll_id)
+
+    def _poll_path(self, poll_id, location):
+        return self._polldirs[location] / self._poll_filename(poll_id)
+
+    def _safe_writer(self, path, mode):
+        return safe_writer(
+            path, mode,
+            extra_paranoia=self._durability == Durability.STRICT,
+        )
+
+    def load_active_polls(self, rebuild_cache=False):
+        if rebuild_cache:
+            self._snapshot_cache = SnapshotCache(
+                self._cachedir / SNAPSHOT_CACHE_FILE
+            )
+        else:
+            self._snapshot_cache.load()
+
+        names = set()
+        for path in self._polldirs[PollLocation.ACTIVE].glob("*.toml"):
+            names.add(path.name)
+            data = self._snapshot_cache.get(path.name, path.stat())
+            if data is not None:
+                yield data, False
+                continue
+
+            logger.debug("parsing poll file %s", path)
+            with path.open("r") as f:
+                data = toml.load(f)
+                st = os.fstat(f.fileno())
+            self._snapshot_cache.put(path.name, st, summarise_poll_data(data))
+            yield data, True
+
+        self._snapshot_cache.retain(names)
+
+    def load_poll(self, poll_id, location=PollLocation.ACTIVE):
+        path = self._poll_path(poll_id, location)
+        logger.debug("loading poll from %s", path)
+        try:
+            f = path.open("r")
+        except FileNotFoundError:
+            raise KeyError(poll_id) from None
+        with f:
+            return toml.load(f)
+
+    def write_poll(self, data, location=PollLocation.ACTIVE):
+        path = self._poll_path(data["id"], location)
+        with self._safe_writer(path, "w") as f:
+            toml.dump(data, f)
+
+        if location == PollLocation.ACTIVE:
+            self._snapshot_cache.put(path.name, path.stat(),
+                                     summarise_poll_data(data))
+
+    def move_poll(self, poll_id, src, dest):
+        srcdir, destdir = self._polldirs[src], self._polldirs[dest]
+        filename = self._poll_filename(poll_id)
+        (srcdir / filename).rename(destdir / filename)
+        if self._durability == Durability.STRICT:
+            fsync_dir(destdir)
+            fsync_dir(srcdir)
+
+        if src == PollLocation.ACTIVE:
+            self._snapshot_cache.remove(filename)
+
+    def delete_poll(self, poll_id):
+        self._poll_path(poll_id, PollLocation.TRASH).unlink()
+
+    def has_poll(self, poll_id, location=PollLocation.ACTIVE):
+        return self._poll_path(poll_id, location).exists()
+
+    def list_polls(self, location):
+        return [
+            path.stem
+            for path in self._polldirs[location].glob("*.toml")
+        ]
+
+    def _member_path(self, name):
+        return self._membersdir / "{}.toml".format(name)
+
+    def read_member_state(self, name):
+        try:
+            with self._member_path(name).open("r") as f:
+                return toml.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_member_state(self, name, data):
+        with self._safe_writer(self._member_path(name), "w") as f:
+            toml.dump(data, f)
+
+    def list_members(self):
+        return [path.stem for path in self._membersdir.glob("*.toml")]
+
+    def flush(self):
+        self._snapshot_cache.save()
+
+    def sync(self):
+        if self._durability == Durability.STRICT:
+            return
+        # the files themselves are synced by safe_writer, but not the renames
+        for path in [*self._polldirs.values(), self._membersdir]:
+            fsync_dir(path)
+
+
+class SqliteStorage(StorageBackend):
+    """
+    Store polls and members in an SQLite database in WAL mode.
+
+    :param path: Path of the database file.
+    :param durability: The :class:`Durability` mode.
+
+    Polls are indexed by location and end time. Next to the complete data,
+    the summary of each poll is stored, so that loading the active polls does
+    not require to decode the vote histories.
+
+    The connection may be used from any thread, but only from one at a time.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS polls (
+            id TEXT PRIMARY KEY,
+            location TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            data TEXT NOT NULL
+        )""",
+        """CREATE INDEX IF NOT EXISTS polls_location_end_time
+            ON polls (location, end_time)""",
+        """CREATE TABLE IF NOT EXISTS members (
+            name TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        )""",
+    ]
+
+    def __init__(self, path: pathlib.Path,
+                 durability: Durability = Durability.STRICT):
+        super().__init__()
+        self._durability = durability
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode, NORMAL only syncs at checkpoints, so commits may be
+        # lost on a crash until the next one; see sync
+        self._conn.execute(
+            "PRAGMA synchronous={}".format(
+                "FULL" if durability == Durability.STRICT else "NORMAL"
+            )
+        )
+        with self._conn:
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+
+    @staticmethod
+    def _dumps(data):
+        return json.dumps(data, default=_json_default, separators=(",", ":"))
+
+    @staticmethod
+    def _loads(s):
+        return json.loads(s, object_hook=_json_object_hook)
+
+    def load_active_polls(self, rebuild_cache=False):
+        cursor = self._conn.execute(
+            "SELECT summary FROM polls WHERE location = ?",
+            (PollLocation.ACTIVE.value,),
+        )
+        for summary, in cursor:
+            yield self._loads(summary), False
+
+    def load_poll(self, poll_id, location=PollLocation.ACTIVE):
+        row = self._conn.execute(
+            "SELECT data FROM polls WHERE id = ? AND location = ?",
+            (poll_id, location.value),
+        ).fetchone()
+        if row is None:
+            raise KeyError(poll_id)
+        return self._loads(row[0])
+
+    def write_poll(self, data, location=PollLocation.ACTIVE):
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO polls "
+                "(id, location, end_time, summary, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    data["id"],
+                    location.value,
+                    data["end_time"].isoformat(),
+                    self._dumps(summarise_poll_data(data)),
+                    self._dumps(data),
+                ),
+            )
+
+    def move_poll(self, poll_id, src, dest):
+        with self._conn:
+            cursor = self._conn.execute(
+                "UPDATE polls SET location = ? WHERE id = ? AND location = ?",
+                (dest.value, poll_id, src.value),
+            )
+        if cursor.rowcount != 1:
+            raise FileNotFoundError(
+                "no poll {} in {}".format(poll_id, src.value)
+            )
+
+    def delete_poll(self, poll_id):
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM polls WHERE id = ? AND location = ?",
+                (poll_id, PollLocation.TRASH.value),
+            )
+
+    def has_poll(self, poll_id, location=PollLocation.ACTIVE):
+        return self._conn.execute(
+            "SELECT 1 FROM polls WHERE id = ? AND location = ?",
+            (poll_id, location.value),
+        ).fetchone() is not None
+
+    def list_polls(self, location):
+        return [
+            poll_id
+            for poll_id, in self._conn.execute(
+                "SELECT id FROM polls WHERE location = ? ORDER BY end_time",
+                (location.value,),
+            )
+        ]
+
+    def read_member_state(self, name):
+        row = self._conn.execute(
+            "SELECT data FROM members WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if row is None:
+            return None
+        return self._loads(row[0])
+
+    def write_member_state(self, name, data):
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO members (name, data) VALUES (?, ?)",
+                (name, self._dumps(data)),
+            )
+
+    def list_members(self):
+        return [
+            name
+            for name, in self._conn.execute("SELECT name FROM members")
+        ]
+
+    def sync(self):
+        if self._durability == Durability.STRICT:
+            return
+        # a checkpoint syncs the WAL and the database file
+        self._conn.execute("PRAGMA wal_checkpoint(FULL)")
+
+    def close(self):
+        self._conn.close()
+
+
+class MemoryStorage(StorageBackend):
+    """
+    Keep polls and member state in memory only.
+
+    Nothing is persisted, so this is only useful for tests and benchmarks of
+    the state machine. Data is copied on the way in and out, as it would be
+    by serialisation.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._polls = {location: {} for location in PollLocation}
+        self._members = {}
+
+    def load_active_polls(self, rebuild_cache=False):
+        for data in list(self._polls[PollLocation.ACTIVE].values()):
+            yield copy.deepcopy(data), True
+
+    def load_poll(self, poll_id, location=PollLocation.ACTIVE):
+        return copy.deepcopy(self._polls[location][poll_id])
+
+    def write_poll(self, data, location=PollLocation.ACTIVE):
+        self._polls[location][data["id"]] = copy.deepcopy(data)
+
+    def move_poll(self, poll_id, src, dest):
+        try:
+            data = self._polls[src].pop(poll_id)
+        except KeyError:
+            raise FileNotFoundError(
+                "no poll {} in {}".format(poll_id, src.value)
+            ) from None
+        self._polls[dest][poll_id] = data
+
+    def delete_poll(self, poll_id):
+        del self._polls[PollLocation.TRASH][poll_id]
+
+    def has_poll(self, poll_id, location=PollLocation.ACTIVE):
+        return poll_id in self._polls[location]
+
+    def list_polls(self, location):
+        return list(self._polls[location])
+
+    def read_member_state(self, name):
+        try:
+            return copy.deepcopy(self._members[name])
+        except KeyError:
+            return None
+
+    def write_member_state(self, name, data):
+        self._members[name] = copy.deepcopy(data)
+
+    def list_members(self):
+        return list(self._members)
+
+
+BACKENDS = {
+    "toml": lambda statedir, durability: TomlStorage(statedir, durability),
+    "sqlite": lambda statedir, durability: SqliteStorage(
+        statedir / SQLITE_FILE,
+        durability,
+    ),
+    MEMORY_BACKEND: lambda statedir, durability: MemoryStorage(),
+}
+
+
+def make_storage(name: str, statedir: typing.Optional[pathlib.Path],
+                 durability: Durability = Durability.STRICT
+                 ) -> StorageBackend:
+    """
+    Create the storage backend `name` (see :data:`BACKENDS`) for the state in
+    `statedir`, which may be :data:`None` for the ``memory`` backend.
+    """
+    try:
+        factory = BACKENDS[name]
+    except KeyError:
+        raise ValueError("unknown storage backend: {!r}".format(name)) \
+            from None
+    return factory(statedir, durability)
+
+
+def migrate(source: StorageBackend, dest: StorageBackend):
+    """
+    Copy all polls and member state from `source` to `dest`.
+
+    Pending journal records are not taken into account; the state must have
+    been closed cleanly before.
+
+    :raises ValueError: if `dest` already contains polls or member state.
+        Copies in `dest` would not be removed when their poll is moved or
+        deleted in `source`, and could thus come back to life.
+    """
+    if (any(dest.list_polls(location) for location in PollLocation) or
+            dest.list_members()):
+        raise ValueError(
+            "the destination storage is not empty; remove its polls and "
+            "member state before migrating"
+        )
+
+    for location in PollLocation:
+        for poll_id in source.list_polls(location):
+            logger.debug("migrating poll %s (%s)", poll_id, location.value)
+            dest.write_poll(source.load_poll(poll_id, location), location)
+
+    for name in source.list_members():
+        logger.debug("migrating member state of %s", name)
+        dest.write_member_state(name, source.read_member_state(name))
+
+    dest.flush()
@@ -0,0 +1,158 @@
+import asyncio
+import gc
+import threading
+import unittest
+import unittest.mock
+
+import aioxmpp.callbacks
+
+import councilbot.asyncstate as asyncstate
+import councilbot.state as state
+
+
+def run_coroutine(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class TestAsyncState(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.state = unittest.mock.Mock()
+        self.state.on_poll_concluded = aioxmpp.callbacks.AdHocSignal()
+        self.state.on_next_expiry_changed = aioxmpp.callbacks.AdHocSignal()
+        self.state.durability = state.Durability.STRICT
+        self.s = asyncstate.AsyncState(self.state, loop=self.loop)
+
+    def tearDown(self):
+        run_coroutine(self.s.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_run_calls_function_on_other_thread(self):
+        def func(a, b=None):
+            return threading.current_thread(), a, b
+
+        thread, a, b = run_coroutine(self.s.run(func, 1, b=2))
+
+        self.assertIsNot(thread, threading.current_thread())
+        self.assertEqual((a, b), (1, 2))
+
+    def test_calls_run_in_order_on_a_single_thread(self):
+        calls = []
+
+        def func(i):
+            calls.append((i, threading.current_thread()))
+
+        async def scenario():
+            await asyncio.gather(*(
+                self.s.submit(func, i)
+                for i in range(10)
+            ))
+
+        run_coroutine(scenario())
+
+        self.assertSequenceEqual([i for i, _ in calls], list(range(10)))
+        self.assertEqual(len({thread for _, thread in calls}), 1)
+
+    def test_forwards_signals_to_event_loop(self):
+        received = []
+
+        def handler(*args):
+            received.append((threading.current_thread(), args))
+
+        self.s.on_poll_concluded.connect(handler)
+
+        run_coroutine(self.s.run(
+            self.state.on_poll_concluded,
+            unittest.mock.sentinel.poll_id,
+            unittest.mock.sentinel.reason,
+        ))
+        run_coroutine(asyncio.sleep(0))
+
+        self.assertSequenceEqual(
+            received,
+            [
+                (threading.current_thread(),
+                 (unittest.mock.sentinel.poll_id,
+                  unittest.mock.sentinel.reason)),
+            ]
+        )
+
+    def test_close_closes_state(self):
+        run_coroutine(self.s.close())
+        self.state.close.assert_called_once_with()
+
+    def test_strict_does_not_sync(self):
+        run_coroutine(self.s.run(lambda: None))
+        run_coroutine(asyncio.sleep(asyncstate.GROUP_COMMIT_DELAY * 2))
+        self.state.sync.assert_not_called()
+
+    def test_group_run_waits_for_a_single_sync(self):
+        self.state.durability = state.Durability.GROUP
+        calls = []
+        self.state.sync.side_effect = lambda: calls.append("sync")
+
+        async def scenario():
+            await asyncio.gather(*(
+                self.s.run(calls.append, i)
+                for i in range(3)
+            ))
+            self.assertSequenceEqual(calls, [0, 1, 2, "sync"])
+
+        run_coroutine(scenario())
+
+    def test_group_run_propagates_sync_failure(self):
+        self.state.durability = state.Durability.GROUP
+        self.state.sync.side_effect = OSError()
+
+        with self.assertRaises(OSError):
+            run_coroutine(self.s.run(lambda: None))
+
+    def test_group_submit_waits_for_sync(self):
+        self.state.durability = state.Durability.GROUP
+        calls = []
+        self.state.sync.side_effect = lambda: calls.append("sync")
+
+        async def scenario():
+            fut = self.s.submit(calls.append, 0)
+            await fut
+            self.assertSequenceEqual(calls, [0, "sync"])
+
+        run_coroutine(scenario())
+
+    def test_unawaited_sync_failure_is_only_logged(self):
+        self.state.durability = state.Durability.RELAXED
+        self.state.sync.side_effect = OSError()
+        errors = []
+        self.loop.set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+
+        with unittest.mock.patch.object(asyncstate, "RELAXED_SYNC_DELAY",
+                                        0.01):
+            with self.assertLogs(asyncstate.logger, "ERROR"):
+                run_coroutine(self.s.run(lambda: None))
+                run_coroutine(asyncio.sleep(0.05))
+
+        gc.collect()
+        self.assertSequenceEqual(errors, [])
+
+    def test_relaxed_run_does_not_wait_for_sync(self):
+        self.state.durability = state.Durability.RELAXED
+
+        with unittest.mock.patch.object(asyncstate, "RELAXED_SYNC_DELAY",
+                                        0.01):
+            run_coroutine(self.s.run(lambda: None))
+            self.state.sync.assert_not_called()
+            run_coroutine(asyncio.sleep(0.05))
+
+        self.state.sync.assert_called_once_with()
+
+    def test_close_resolves_pending_sync(self):
+        self.state.durability = state.Durability.RELAXED
+        fut = self.s.submit(lambda: None)
+        run_coroutine(fut)
+        run_coroutine(self.s.close())
+        self.state.sync.assert_not_called()
+        self.state.close.assert_called_once_with()
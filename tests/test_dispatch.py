@@ -0,0 +1,206 @@
+import asyncio
+import unittest
+
+import councilbot.dispatch as dispatch
+
+
+def run_coroutine(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class TestKeyedWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.log = []
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def _job(self, name, event=None):
+        self.log.append(("start", name))
+        if event is not None:
+            await event.wait()
+        self.log.append(("end", name))
+
+    async def _run(self, pool, nworkers, until):
+        workers = [
+            asyncio.ensure_future(pool.run_worker())
+            for _ in range(nworkers)
+        ]
+        try:
+            await until()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _settle(self):
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    def test_unrelated_jobs_run_concurrently(self):
+        async def scenario():
+            pool = dispatch.KeyedWorkerPool()
+            slow = asyncio.Event()
+            pool.submit(["a"], self._job, "slow", slow)
+            pool.submit(["b"], self._job, "fast")
+
+            async def until():
+                await self._settle()
+                self.assertIn(("end", "fast"), self.log)
+                self.assertNotIn(("end", "slow"), self.log)
+                slow.set()
+                await self._settle()
+
+            await self._run(pool, 2, until)
+            self.assertEqual(pool.pending, 0)
+
+        run_coroutine(scenario())
+
+    def test_jobs_with_common_key_run_in_order(self):
+        async def scenario():
+            pool = dispatch.KeyedWorkerPool()
+            slow = asyncio.Event()
+            pool.submit(["a"], self._job, "first", slow)
+            pool.submit(["b", "a"], self._job, "second")
+            pool.submit(["b"], self._job, "third")
+
+            async def until():
+                await self._settle()
+                self.assertSequenceEqual(self.log, [("start", "first")])
+                self.assertEqual(pool.pending, 3)
+                slow.set()
+                await self._settle()
+
+            await self._run(pool, 4, until)
+            self.assertSequenceEqual(
+                self.log,
+                [
+                    ("start", "first"),
+                    ("end", "first"),
+                    ("start", "second"),
+                    ("end", "second"),
+                    ("start", "third"),
+                    ("end", "third"),
+                ]
+            )
+
+        run_coroutine(scenario())
+
+    def test_jobs_without_keys_do_not_wait(self):
+        async def scenario():
+            pool = dispatch.KeyedWorkerPool()
+            slow = asyncio.Event()
+            pool.submit(["a"], self._job, "slow", slow)
+            pool.submit(["a"], self._job, "blocked")
+            pool.submit((), self._job, "free")
+
+            async def until():
+                await self._settle()
+                self.assertIn(("end", "free"), self.log)
+                self.assertNotIn(("start", "blocked"), self.log)
+                slow.set()
+                await self._settle()
+
+            await self._run(pool, 2, until)
+
+        run_coroutine(scenario())
+
+    def test_lower_lanes_are_served_first(self):
+        async def scenario():
+            pool = dispatch.KeyedWorkerPool(nlanes=2)
+            pool.submit(["a"], self._job, "write1", lane=1)
+            pool.submit(["b"], self._job, "write2", lane=1)
+            pool.submit((), self._job, "read", lane=0)
+            self.assertEqual(pool.depth(0), 1)
+            self.assertEqual(pool.depth(1), 2)
+
+            await self._run(pool, 1, self._settle)
+
+            self.assertSequenceEqual(
+                [name for what, name in self.log if what == "start"],
+                ["read", "write1", "write2"],
+            )
+            self.assertEqual(pool.depth(0), 0)
+            self.assertEqual(pool.depth(1), 0)
+
+        run_coroutine(scenario())
+
+    def test_submit_rejects_unknown_lane(self):
+        pool = dispatch.KeyedWorkerPool(nlanes=2)
+        with self.assertRaises(ValueError):
+            pool.submit((), self._job, "foo", lane=2)
+        self.assertEqual(pool.pending, 0)
+
+    def test_submit_fails_if_full(self):
+        pool = dispatch.KeyedWorkerPool(maxsize=1)
+        pool.submit((), self._job, "foo")
+        with self.assertRaises(asyncio.QueueFull):
+            pool.submit((), self._job, "bar")
+        self.assertEqual(pool.pending, 1)
+
+    def test_failing_job_releases_its_keys(self):
+        async def fail():
+            raise RuntimeError()
+
+        async def scenario():
+            pool = dispatch.KeyedWorkerPool()
+            pool.submit(["a"], fail)
+            pool.submit(["a"], self._job, "next")
+
+            worker = asyncio.ensure_future(pool.run_worker())
+            with self.assertRaises(RuntimeError):
+                await worker
+
+            await self._run(pool, 1, self._settle)
+            self.assertIn(("end", "next"), self.log)
+
+        run_coroutine(scenario())
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.bucket = dispatch.TokenBucket(0.5, 2, clock=lambda: self.now)
+
+    def test_allows_burst(self):
+        self.assertTrue(self.bucket.try_consume())
+        self.assertTrue(self.bucket.try_consume())
+        self.assertFalse(self.bucket.try_consume())
+
+    def test_refills_at_rate(self):
+        self.bucket.try_consume()
+        self.bucket.try_consume()
+        self.now = 1
+        self.assertFalse(self.bucket.try_consume())
+        self.now = 2
+        self.assertTrue(self.bucket.try_consume())
+        self.assertFalse(self.bucket.try_consume())
+
+    def test_does_not_exceed_burst(self):
+        self.now = 100
+        self.assertTrue(self.bucket.is_full)
+        self.assertTrue(self.bucket.try_consume())
+        self.assertTrue(self.bucket.try_consume())
+        self.assertFalse(self.bucket.try_consume())
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.limiter = dispatch.RateLimiter(1, 1, clock=lambda: self.now)
+
+    def test_limits_keys_independently(self):
+        self.assertTrue(self.limiter.allow("a"))
+        self.assertFalse(self.limiter.allow("a"))
+        self.assertTrue(self.limiter.allow("b"))
+
+    def test_prunes_full_buckets(self):
+        self.limiter.PRUNE_THRESHOLD = 2
+        self.limiter.allow("a")
+        self.limiter.allow("b")
+        self.now = 10
+        self.limiter.allow("c")
+        self.assertEqual(len(self.limiter), 1)
@@ -0,0 +1,438 @@
+import asyncio
+import pathlib
+import re
+import tempfile
+import unittest
+import unittest.mock
+
+import aiohttp.test_utils
+import aiohttp.web
+
+import councilbot.extractor as extractor
+
+
+def run_coroutine(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+PROTOXEP_HEAD = b"""<?xml version='1.0' encoding='UTF-8'?>
+<xep>
+<header>
+  <title>Foo Bar</title>
+  <abstract>This specification defines foo.</abstract>
+  <shortname>NOT_YET_ASSIGNED</shortname>
+</header>
+"""
+PROTOXEP_TAIL = b"""<section1 topic='Introduction' anchor='intro'>
+  <header>not this one</header>
+</section1>
+</xep>
+"""
+ARCHIVE_PAGE = """<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2//EN">
+<HTML>
+ <HEAD>
+   <TITLE> [Standards] Proposed XMPP Extension: Foo </TITLE>
+ </HEAD>
+ <BODY BGCOLOR="#ffffff">
+   <H1>[Standards] Proposed XMPP Extension: <I>Fü</I>
+   </H1>
+<PRE>
+""".encode("latin-1")
+
+
+class ChunkSource:
+    def __init__(self, data):
+        self.data = data
+        self.nread = 0
+
+    async def read(self, n):
+        blob = self.data[self.nread:self.nread+n]
+        self.nread += len(blob)
+        return blob
+
+
+class Test_read_xep_header(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_stops_after_header(self):
+        source = ChunkSource(
+            PROTOXEP_HEAD +
+            b"<!-- padding -->" * (extractor.READ_CHUNK_SIZE // 8) +
+            PROTOXEP_TAIL
+        )
+        header = run_coroutine(extractor._read_xep_header(source.read))
+
+        self.assertEqual(header.findtext("title"), "Foo Bar")
+        self.assertEqual(source.nread, extractor.READ_CHUNK_SIZE)
+
+    def test_ignores_nested_header(self):
+        source = ChunkSource(
+            b"<xep><section1><header>x</header></section1>" +
+            b"<header><title>Foo</title></header></xep>"
+        )
+        header = run_coroutine(extractor._read_xep_header(source.read))
+        self.assertEqual(header.findtext("title"), "Foo")
+
+    def test_raises_without_header(self):
+        source = ChunkSource(b"<xep><section1/></xep>")
+        with self.assertRaises(ValueError):
+            run_coroutine(extractor._read_xep_header(source.read))
+
+
+class Test_read_html_heading(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_stops_after_first_heading(self):
+        source = ChunkSource(
+            ARCHIVE_PAGE +
+            b"<p>padding</p>" * extractor.READ_CHUNK_SIZE +
+            b"<h1>not this one</h1></PRE></BODY></HTML>"
+        )
+        heading = run_coroutine(extractor._read_html_heading(
+            source.read,
+            encoding="latin-1",
+        ))
+
+        self.assertEqual(heading,
+                         "[Standards] Proposed XMPP Extension: Fü\n   ")
+        self.assertEqual(source.nread, extractor.READ_CHUNK_SIZE)
+
+    def test_ignores_unknown_encoding(self):
+        heading = run_coroutine(extractor._read_html_heading(
+            ChunkSource(ARCHIVE_PAGE).read,
+            encoding="x-no-such-charset",
+        ))
+
+        self.assertEqual(heading,
+                         "[Standards] Proposed XMPP Extension: Fü\n   ")
+
+    def test_returns_none_without_heading(self):
+        source = ChunkSource(
+            b"<html><body>" +
+            b"<p>padding</p>" * extractor.READ_CHUNK_SIZE +
+            b"</body></html>"
+        )
+        self.assertIsNone(run_coroutine(
+            extractor._read_html_heading(source.read),
+        ))
+
+
+class TestExtractor(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.peers = []
+
+        self.requests = []
+
+        async def pull_request(request):
+            self.peers.append(request.transport.get_extra_info("peername"))
+            self.requests.append(request.headers.copy())
+            if request.headers.get("If-None-Match") == '"v1"':
+                return aiohttp.web.Response(status=304)
+            return aiohttp.web.json_response(
+                {
+                    "title": "XEP-0001: Fix typo",
+                    "body": "Fixes\n  a   typo.",
+                },
+                headers={"ETag": '"v1"'},
+            )
+
+        async def protoxep(request):
+            return aiohttp.web.Response(
+                body=PROTOXEP_HEAD + PROTOXEP_TAIL,
+                content_type="application/xml",
+            )
+
+        async def archive(request):
+            return aiohttp.web.Response(
+                # served, but not to be cached
+                status=410 if request.match_info["page"] == "gone.html"
+                else 200,
+                body=ARCHIVE_PAGE,
+                content_type="text/html",
+                charset="latin-1",
+            )
+
+        app = aiohttp.web.Application()
+        app.router.add_get("/pulls/{num}", pull_request)
+        app.router.add_get("/inbox/{basename}.xml", protoxep)
+        app.router.add_get("/pipermail/standards/{page}", archive)
+        self.server = aiohttp.test_utils.TestServer(app)
+        run_coroutine(self.server.start_server())
+        self.template_patch = unittest.mock.patch.object(
+            extractor, "XEPS_PR_URL_TEMPLATE",
+            str(self.server.make_url("/pulls/")) + "{num}",
+        )
+        self.template_patch.start()
+        self.protoxep_template_patch = unittest.mock.patch.object(
+            extractor, "PROTOXEP_URL_TEMPLATE",
+            str(self.server.make_url("/inbox/")) + "{basename}.xml",
+        )
+        self.protoxep_template_patch.start()
+        self.standards_re_patch = unittest.mock.patch.object(
+            extractor, "STANDARDS_URL_RE",
+            re.compile(
+                re.escape(str(self.server.make_url("/pipermail/standards/"))) +
+                r".+\.html",
+                re.I,
+            ),
+        )
+        self.standards_re_patch.start()
+
+        self.e = extractor.Extractor()
+
+    def tearDown(self):
+        run_coroutine(self.e.close())
+        self.standards_re_patch.stop()
+        self.protoxep_template_patch.stop()
+        self.template_patch.stop()
+        run_coroutine(self.server.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_extracts_xeps_pr_metadata(self):
+        metadata = run_coroutine(self.e.extract_url_metadata(
+            "https://github.com/xsf/xeps/pull/1234",
+        ))
+        self.assertEqual(metadata.title, "[PR#1234] XEP-0001: Fix typo")
+        self.assertEqual(metadata.description, "Fixes a typo.")
+        self.assertEqual(metadata.tag, "PR#1234")
+        self.assertSequenceEqual(
+            metadata.urls,
+            ["https://github.com/xsf/xeps/pull/1234"],
+        )
+
+    def test_extracts_protoxep_metadata(self):
+        metadata = run_coroutine(self.e.extract_url_metadata(
+            "https://xmpp.org/extensions/inbox/foo-bar.html",
+        ))
+        self.assertEqual(metadata.title, "Accept 'Foo Bar' as Experimental")
+        self.assertEqual(metadata.description,
+                         "This specification defines foo.")
+        self.assertEqual(metadata.tag, "foo-bar")
+        self.assertSequenceEqual(
+            metadata.urls,
+            ["https://xmpp.org/extensions/inbox/foo-bar.html"],
+        )
+
+    def test_extracts_standards_metadata(self):
+        url = str(self.server.make_url("/pipermail/standards/000001.html"))
+        metadata = run_coroutine(self.e.extract_url_metadata(url))
+        self.assertEqual(metadata.title, "Proposed XMPP Extension: Fü")
+        self.assertIsNone(metadata.tag)
+        self.assertSequenceEqual(metadata.urls, [url])
+
+    def test_reuses_connection(self):
+        for num in range(3):
+            run_coroutine(self.e.extract_url_metadata(
+                "https://github.com/xsf/xeps/pull/{}".format(num),
+            ))
+
+        self.assertEqual(len(self.peers), 3)
+        self.assertEqual(len(set(self.peers)), 1)
+
+    def test_does_not_open_session_for_unsupported_url(self):
+        self.assertIsNone(run_coroutine(
+            self.e.extract_url_metadata("https://example.com/"),
+        ))
+        self.assertIsNone(self.e._session)
+
+    def test_close_closes_session(self):
+        run_coroutine(self.e.extract_url_metadata(
+            "https://github.com/xsf/xeps/pull/1",
+        ))
+        session = self.e._session
+        run_coroutine(self.e.close())
+        self.assertTrue(session.closed)
+        self.assertIsNone(self.e._session)
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmpdir.name) / "cache" / "cache.json"
+        self.now = 1000.0
+        self.metadata = extractor.URLMetadata(
+            matched_url="https://github.com/xsf/xeps/pull/1",
+            title="[PR#1] Foo",
+            description="Bar",
+            urls=["https://github.com/xsf/xeps/pull/1"],
+            tag="PR#1",
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _make_cache(self, **kwargs):
+        return extractor.MetadataCache(clock=lambda: self.now, **kwargs)
+
+    def test_get_returns_none_for_unknown_url(self):
+        self.assertIsNone(self._make_cache().get("https://example.com/"))
+
+    def test_entry_expires_after_ttl(self):
+        c = self._make_cache(ttl=10)
+        c.put("u", self.metadata, etag='"x"')
+        entry = c.get("u")
+        self.assertEqual(entry.metadata, self.metadata)
+        self.assertEqual(entry.etag, '"x"')
+        self.assertTrue(c.is_fresh(entry))
+
+        self.now += 10
+        self.assertFalse(c.is_fresh(entry))
+
+        c.refresh("u")
+        self.assertTrue(c.is_fresh(c.get("u")))
+
+    def test_evicts_least_recently_used(self):
+        c = self._make_cache(max_entries=2)
+        c.put("a", self.metadata)
+        c.put("b", self.metadata)
+        c.get("a")
+        c.put("c", self.metadata)
+
+        self.assertEqual(len(c), 2)
+        self.assertIsNone(c.get("b"))
+        self.assertIsNotNone(c.get("a"))
+        self.assertIsNotNone(c.get("c"))
+
+    def test_persists(self):
+        c = self._make_cache(path=self.path)
+        c.put("u", self.metadata, etag='"x"', last_modified="yesterday")
+        c.write(c.dumps())
+
+        c = self._make_cache(path=self.path)
+        self.assertEqual(
+            c.get("u"),
+            (self.metadata, self.now, '"x"', "yesterday"),
+        )
+
+    def test_load_ignores_corrupt_file(self):
+        self.path.parent.mkdir()
+        self.path.write_text("{")
+        with self.assertLogs(extractor.logger, "WARNING"):
+            c = self._make_cache(path=self.path)
+        self.assertEqual(len(c), 0)
+
+    def test_load_ignores_other_version(self):
+        self.path.parent.mkdir()
+        self.path.write_text('{"version": 0, "entries": [["u", {}]]}')
+        c = self._make_cache(path=self.path)
+        self.assertEqual(len(c), 0)
+
+
+class TestExtractorWithCache(TestExtractor):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmpdir.name) / "url-metadata.json"
+        self.now = 1000.0
+        self.cache = extractor.MetadataCache(
+            self.path,
+            ttl=10,
+            clock=lambda: self.now,
+        )
+        self.e = extractor.Extractor(cache=self.cache)
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def test_reuses_connection(self):
+        for num in range(3):
+            run_coroutine(self.e.extract_url_metadata(
+                "https://github.com/xsf/xeps/pull/{}".format(num),
+            ))
+            self.now += 10
+
+        for num in range(3):
+            run_coroutine(self.e.extract_url_metadata(
+                "https://github.com/xsf/xeps/pull/{}".format(num),
+            ))
+
+        self.assertEqual(len(self.peers), 6)
+        self.assertEqual(len(set(self.peers)), 1)
+
+    def test_fresh_entry_is_used_without_request(self):
+        first = run_coroutine(self.e.extract_url_metadata(
+            "https://github.com/xsf/xeps/pull/1",
+        ))
+        second = run_coroutine(self.e.extract_url_metadata(
+            "see http://www.github.com/xsf/xeps/pull/1/files",
+        ))
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(second.matched_url,
+                         "http://www.github.com/xsf/xeps/pull/1/files")
+        self.assertEqual(second._replace(matched_url=first.matched_url),
+                         first)
+
+    def test_stale_entry_is_revalidated(self):
+        first = run_coroutine(self.e.extract_url_metadata(
+            "https://github.com/xsf/xeps/pull/1",
+        ))
+        self.now += 10
+        second = run_coroutine(self.e.extract_url_metadata(
+            "https://github.com/xsf/xeps/pull/1",
+        ))
+
+        self.assertEqual(len(self.requests), 2)
+        self.assertNotIn("If-None-Match", self.requests[0])
+        self.assertEqual(self.requests[1]["If-None-Match"], '"v1"')
+        self.assertEqual(first, second)
+        self.assertTrue(self.cache.is_fresh(
+            self.cache.get(extractor.XEPS_PR_URL_TEMPLATE.format(num=1))
+        ))
+
+    def test_saves_cache(self):
+        run_coroutine(self.e.extract_url_metadata(
+            "https://github.com/xsf/xeps/pull/1",
+        ))
+
+        cache = extractor.MetadataCache(self.path, ttl=10,
+                                        clock=lambda: self.now)
+        entry = cache.get(extractor.XEPS_PR_URL_TEMPLATE.format(num=1))
+        self.assertEqual(entry.metadata.title, "[PR#1] XEP-0001: Fix typo")
+        self.assertEqual(entry.etag, '"v1"')
+
+    def test_saves_cache_only_when_changed(self):
+        gone_url = str(self.server.make_url("/pipermail/standards/gone.html"))
+        run_coroutine(self.e.extract_url_metadata(
+            "https://github.com/xsf/xeps/pull/1",
+        ))
+
+        with unittest.mock.patch.object(self.cache, "write") as write:
+            run_coroutine(self.e.extract_url_metadata(gone_url))
+            run_coroutine(self.e.extract_url_metadata(
+                "https://github.com/xsf/xeps/pull/1",
+            ))
+            write.assert_not_called()
+
+            self.now += 10
+            run_coroutine(self.e.extract_url_metadata(
+                "https://github.com/xsf/xeps/pull/1",
+            ))
+            write.assert_called_once_with(unittest.mock.ANY)
+
+    def test_standards_urls_differing_in_case_share_entry(self):
+        url = str(self.server.make_url("/pipermail/standards/000001.html"))
+        run_coroutine(self.e.extract_url_metadata(url))
+        metadata = run_coroutine(self.e.extract_url_metadata(
+            url.replace("http://", "HTTP://", 1),
+        ))
+
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(metadata.matched_url,
+                         url.replace("http://", "HTTP://", 1))
@@ -0,0 +1,120 @@
+import re
+import unittest
+
+import councilbot.parser as parser
+
+
+def parse(text):
+    return parser.PARSE_TREE.parse(text.split())
+
+
+class TestParseTree(unittest.TestCase):
+    def assertParses(self, text, action, remaining, params={}):
+        result = parse(text)
+        self.assertIsNotNone(result, text)
+        node, remaining_words, result_params = result
+        self.assertEqual(node.action, action, text)
+        self.assertSequenceEqual(remaining_words, remaining.split(), text)
+        self.assertDictEqual(result_params, params, text)
+
+    def test_short_commands(self):
+        self.assertParses("!create Deprecate XEP-0001",
+                          parser.Action.CREATE_POLL, "Deprecate XEP-0001")
+        self.assertParses("!list", parser.Action.LIST_GENERIC, "")
+        self.assertParses("!show the foo", parser.Action.LIST_VOTES, "foo")
+        self.assertParses("!help", parser.Action.HELP, "")
+
+    def test_short_vote(self):
+        self.assertParses("!+1 foo bar", parser.Action.CAST_VOTE,
+                          "foo bar", {"vote": "+1"})
+        self.assertParses("!-0 on the foo", parser.Action.CAST_VOTE,
+                          "foo", {"vote": "-0"})
+
+    def test_short_vote_pushes_remark(self):
+        self.assertParses("!+1:the remark", parser.Action.CAST_VOTE,
+                          ":the remark", {"vote": "+1"})
+
+    def test_natural_language(self):
+        self.assertParses("please create a new poll on Deprecate XEP-0001",
+                          parser.Action.CREATE_POLL, "Deprecate XEP-0001")
+        self.assertParses("I want to vote +1 on foo: lgtm",
+                          parser.Action.CAST_VOTE, "foo: lgtm",
+                          {"vote": "+1"})
+        self.assertParses("please delete the poll on foo",
+                          parser.Action.DELETE_POLL, "foo")
+        self.assertParses("show the votes on foo",
+                          parser.Action.LIST_VOTES, "foo")
+        self.assertParses("conclude all pending votes",
+                          parser.Action.AUTO_CONCLUDE_OPEN_POLLS, "")
+        self.assertParses("who are you", parser.Action.INTRODUCE, "")
+
+    def test_list_with_selector(self):
+        self.assertParses(
+            "please list all open polls",
+            parser.Action.LIST_POLLS, "",
+            {"selector": parser.PollSelector.OPEN},
+        )
+        self.assertParses(
+            "show me the Concluded Ballots",
+            parser.Action.LIST_POLLS, "",
+            {"selector": parser.PollSelector.CONCLUDED},
+        )
+
+    def test_keywords_ignore_case(self):
+        self.assertParses("PLEASE Create A Poll foo",
+                          parser.Action.CREATE_POLL, "foo")
+
+    def test_keywords_match_as_prefix(self):
+        self.assertParses("thanks!", parser.Action.THANK, "")
+        self.assertParses("delete polls foo", parser.Action.DELETE_POLL,
+                          "foo")
+
+    def test_non_ascii_words_use_patterns(self):
+        # U+017F LATIN SMALL LETTER LONG S matches "s" when ignoring case,
+        # but does not casefold to it
+        self.assertParses("ſtart poll foo",
+                          parser.Action.CREATE_POLL, "foo")
+        self.assertIsNone(parse("ßtart poll foo"))
+
+    def test_returns_none_for_unknown_command(self):
+        self.assertIsNone(parse("make me a sandwich"))
+        self.assertIsNone(parse("create sandwich"))
+
+    def test_empty(self):
+        node, remaining_words, params = parse("")
+        self.assertIs(node, parser.PARSE_TREE)
+        self.assertSequenceEqual(remaining_words, [])
+
+
+class TestTextNode(unittest.TestCase):
+    def test_keyword_map_excludes_capturing_children(self):
+        tree = parser.TextNode(None, children=[
+            parser.TextNode(re.compile(r"(?P<save>foo)", re.I),
+                            save="x", action=parser.Action.HELP),
+            parser.TextNode(re.compile(r"bar", re.I),
+                            action=parser.Action.THANK),
+        ])
+        tree.compile()
+        self.assertDictEqual(tree._dispatch.keywords,
+                             {"bar": tree.children[1]})
+
+        node, _, params = tree.parse(["FOO"])
+        self.assertEqual(node.action, parser.Action.HELP)
+        self.assertDictEqual(params, {"x": "FOO"})
+
+    def test_case_sensitive_child_stops_keyword_map(self):
+        tree = parser.TextNode(None, children=[
+            parser.TextNode("Bar", action=parser.Action.HELP),
+            parser.TextNode(re.compile(r"bar", re.I),
+                            action=parser.Action.THANK),
+        ])
+        tree.compile()
+        self.assertDictEqual(tree._dispatch.keywords, {})
+        self.assertEqual(tree.parse(["Bar"])[0].action, parser.Action.HELP)
+        self.assertEqual(tree.parse(["bar"])[0].action, parser.Action.THANK)
+
+    def test_compiles_on_first_parse(self):
+        tree = parser.TextNode(None, children=[
+            parser.TextNode("foo", action=parser.Action.HELP),
+        ])
+        self.assertEqual(tree.parse(["foo", "bar"])[1], ["bar"])
@@ -0,0 +1,142 @@
+import difflib
+import random
+import unittest
+import unittest.mock
+
+import councilbot.search as search
+
+
+SUBJECTS = [
+    "Accept 'Stanza Content Encryption' as Experimental",
+    "Accept 'Message Moderation' as Experimental",
+    "Deprecate XEP-0001",
+    "[PR#1234] XEP-0045: Clarify nickname handling",
+    "[PR#1240] XEP-0198: Fix typo",
+    "Advance XEP-0363 to Stable",
+]
+
+
+class TestTrigrams(unittest.TestCase):
+    def test_pads_short_keys(self):
+        self.assertSetEqual(
+            search.trigrams("ab"),
+            {"  a", " ab", "ab "},
+        )
+
+
+class TestFuzzyIndex(unittest.TestCase):
+    def setUp(self):
+        self.idx = search.FuzzyIndex()
+        for i, subject in enumerate(SUBJECTS):
+            self.idx.add(i, subject)
+
+    def test_lookup_exact_ignores_case(self):
+        self.assertEqual(self.idx.lookup_exact("deprecate xep-0001"), 2)
+
+    def test_lookup_exact_raises_key_error(self):
+        with self.assertRaises(KeyError):
+            self.idx.lookup_exact("deprecate")
+
+    def test_find_agrees_with_get_close_matches(self):
+        options = [subject.casefold() for subject in SUBJECTS]
+        for query in ["stanza content encryption", "moderation",
+                      "xep-0001", "pr#1240", "advance http upload",
+                      "fix typo in 198", "completely unrelated"]:
+            expected = difflib.get_close_matches(query, options, n=1,
+                                                 cutoff=0.4)
+            if expected:
+                self.assertEqual(self.idx.find(query, cutoff=0.4),
+                                 options.index(expected[0]),
+                                 query)
+            else:
+                with self.assertRaises(KeyError):
+                    self.idx.find(query, cutoff=0.4)
+
+    def test_remove(self):
+        self.idx.remove(2)
+
+        self.assertNotIn(2, self.idx)
+        self.assertEqual(len(self.idx), len(SUBJECTS) - 1)
+        with self.assertRaises(KeyError):
+            self.idx.lookup_exact("deprecate xep-0001")
+        with self.assertRaises(KeyError):
+            self.idx.find("deprecate xep-0001", cutoff=0.8)
+
+    def test_remove_unknown_item_is_noop(self):
+        self.idx.remove("foo")
+        self.assertEqual(len(self.idx), len(SUBJECTS))
+
+    def test_add_replaces_text(self):
+        self.idx.add(2, "Obsolete XEP-0002")
+
+        with self.assertRaises(KeyError):
+            self.idx.lookup_exact("deprecate xep-0001")
+        self.assertEqual(self.idx.lookup_exact("obsolete xep-0002"), 2)
+
+    def test_duplicate_texts(self):
+        self.idx.add("dup", SUBJECTS[0])
+        self.idx.remove(0)
+
+        self.assertEqual(self.idx.lookup_exact(SUBJECTS[0]), "dup")
+
+    def test_ties_are_broken_by_insertion_order(self):
+        idx = search.FuzzyIndex()
+        for item in ["b", "a", "c"]:
+            idx.add(item, "Deprecate XEP-0001")
+
+        self.assertEqual(idx.lookup_exact("deprecate xep-0001"), "b")
+        self.assertEqual(idx.find("deprecate xep-0002", cutoff=0.4), "b")
+
+        idx.add("b", "Deprecate XEP-0001")
+        self.assertEqual(idx.lookup_exact("deprecate xep-0001"), "b")
+
+        idx.remove("b")
+        self.assertEqual(idx.find("deprecate xep-0002", cutoff=0.4), "a")
+
+    def test_find_without_shared_trigrams(self):
+        idx = search.FuzzyIndex()
+        idx.add(1, "xbxcxd")
+
+        self.assertGreaterEqual(
+            difflib.SequenceMatcher(None, "xbxcxd", "bcd").ratio(),
+            0.4,
+        )
+        self.assertEqual(idx.find("bcd", cutoff=0.4), 1)
+
+    def test_find_prefers_better_match_outside_candidates(self):
+        idx = search.FuzzyIndex()
+        idx.add(1, "reply for")
+        idx.add(2, "pr reply")
+
+        self.assertEqual(
+            difflib.get_close_matches("reply", ["reply for", "pr reply"],
+                                      n=1, cutoff=0.4),
+            ["pr reply"],
+        )
+        with unittest.mock.patch.object(search, "MAX_CANDIDATES", 1):
+            self.assertEqual(idx.find("reply", cutoff=0.4), 2)
+
+    def test_find_agrees_with_get_close_matches_on_many_items(self):
+        rng = random.Random(1)
+        words = ["xep", "accept", "reply", "pr", "fix", "typo", "muc",
+                 "deprecate", "stanza", "for", "upload", "0045", "mam"]
+        options = list(dict.fromkeys(
+            " ".join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+            for _ in range(300)
+        ))
+        idx = search.FuzzyIndex()
+        for i, option in enumerate(options):
+            idx.add(i, option)
+
+        for _ in range(100):
+            query = " ".join(rng.choice(words)
+                             for _ in range(rng.randint(1, 3)))
+            expected = difflib.get_close_matches(query, options, n=1,
+                                                 cutoff=0.4)
+            if expected:
+                self.assertEqual(idx.find(query, cutoff=0.4),
+                                 options.index(expected[0]),
+                                 query)
+            else:
+                with self.assertRaises(KeyError):
+                    idx.find(query, cutoff=0.4)
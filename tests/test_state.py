@@ -1,11 +1,13 @@
 import contextlib
 import copy
 import io
-import itertools
+import os
+import pathlib
+import tempfile
 import unittest
 import unittest.mock
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import toml
 
@@ -34,6 +36,13 @@ class TestPoll(unittest.TestCase):
             self.members,
         )
 
+    def _push(self, member, i):
+        timestamp = self.start + timedelta(minutes=i)
+        remark = "remark {}".format(i)
+        self.p.push_vote(member, state.VoteValue.ACK, remark,
+                         timestamp=timestamp)
+        return state.VoteRecord(timestamp, state.VoteValue.ACK, remark)
+
     def _make_dummy_votes(self, p):
         p.push_vote(
             self.members[0],
@@ -134,8 +143,8 @@ class TestPoll(unittest.TestCase):
     def test_push_vote_fails_for_non_member(self):
         with self.assertRaises(KeyError):
             self.p.push_vote(unittest.mock.sentinel.non_member,
-                             unittest.mock.sentinel.value,
-                             unittest.mock.sentinel.remark)
+                             state.VoteValue.ACK,
+                             None)
 
         self.assertDictEqual(
             self.p.get_vote_history(),
@@ -154,27 +163,12 @@ class TestPoll(unittest.TestCase):
         )
 
     def test_push_vote_makes_vote_appear_in_getters(self):
-        with contextlib.ExitStack() as stack:
-            VoteRecord = stack.enter_context(unittest.mock.patch(
-                "councilbot.state.VoteRecord",
-            ))
-            VoteRecord.return_value = unittest.mock.sentinel.vote_record
-
-            self.p.push_vote(self.members[0],
-                             unittest.mock.sentinel.value,
-                             unittest.mock.sentinel.remark,
-                             timestamp=unittest.mock.sentinel.timestamp)
-
-        VoteRecord.assert_called_once_with(
-            unittest.mock.sentinel.timestamp,
-            unittest.mock.sentinel.value,
-            unittest.mock.sentinel.remark,
-        )
+        record = self._push(self.members[0], 0)
 
         self.assertEqual(
             self.p.get_votes(self.members[0]),
             [
-                unittest.mock.sentinel.vote_record,
+                record,
             ]
         )
 
@@ -182,7 +176,7 @@ class TestPoll(unittest.TestCase):
             self.p.get_vote_history(),
             {
                 self.members[0]: [
-                    unittest.mock.sentinel.vote_record,
+                    record,
                 ],
                 self.members[1]: [],
                 self.members[2]: [],
@@ -194,8 +188,7 @@ class TestPoll(unittest.TestCase):
         self.assertDictEqual(
             self.p.get_current_votes(),
             {
-                self.members[0]:
-                    unittest.mock.sentinel.vote_record,
+                self.members[0]: record,
                 self.members[1]: None,
                 self.members[2]: None,
                 self.members[3]: None,
@@ -204,31 +197,14 @@ class TestPoll(unittest.TestCase):
         )
 
     def test_push_vote_stacks_in_history(self):
-        def record_gen():
-            for i in itertools.count():
-                yield getattr(unittest.mock.sentinel, "record{}".format(i))
-
-        with contextlib.ExitStack() as stack:
-            VoteRecord = stack.enter_context(unittest.mock.patch(
-                "councilbot.state.VoteRecord",
-            ))
-            VoteRecord.side_effect = record_gen()
-
-            self.p.push_vote(self.members[0],
-                             unittest.mock.sentinel.value,
-                             unittest.mock.sentinel.remark,
-                             timestamp=unittest.mock.sentinel.timestamp)
-
-            self.p.push_vote(self.members[0],
-                             unittest.mock.sentinel.value,
-                             unittest.mock.sentinel.remark,
-                             timestamp=unittest.mock.sentinel.timestamp)
+        record0 = self._push(self.members[0], 0)
+        record1 = self._push(self.members[0], 1)
 
         self.assertEqual(
             self.p.get_votes(self.members[0]),
             [
-                unittest.mock.sentinel.record0,
-                unittest.mock.sentinel.record1,
+                record0,
+                record1,
             ]
         )
 
@@ -236,8 +212,8 @@ class TestPoll(unittest.TestCase):
             self.p.get_vote_history(),
             {
                 self.members[0]: [
-                    unittest.mock.sentinel.record0,
-                    unittest.mock.sentinel.record1,
+                    record0,
+                    record1,
                 ],
                 self.members[1]: [],
                 self.members[2]: [],
@@ -247,31 +223,13 @@ class TestPoll(unittest.TestCase):
         )
 
     def test_push_vote_updates_current(self):
-        def record_gen():
-            for i in itertools.count():
-                yield getattr(unittest.mock.sentinel, "record{}".format(i))
-
-        with contextlib.ExitStack() as stack:
-            VoteRecord = stack.enter_context(unittest.mock.patch(
-                "councilbot.state.VoteRecord",
-            ))
-            VoteRecord.side_effect = record_gen()
-
-            self.p.push_vote(self.members[0],
-                             unittest.mock.sentinel.value,
-                             unittest.mock.sentinel.remark,
-                             timestamp=unittest.mock.sentinel.timestamp)
-
-            self.p.push_vote(self.members[0],
-                             unittest.mock.sentinel.value,
-                             unittest.mock.sentinel.remark,
-                             timestamp=unittest.mock.sentinel.timestamp)
+        self._push(self.members[0], 0)
+        record1 = self._push(self.members[0], 1)
 
         self.assertDictEqual(
             self.p.get_current_votes(),
             {
-                self.members[0]:
-                    unittest.mock.sentinel.record1,
+                self.members[0]: record1,
                 self.members[1]: None,
                 self.members[2]: None,
                 self.members[3]: None,
@@ -280,43 +238,22 @@ class TestPoll(unittest.TestCase):
         )
 
     def test_push_vote_for_different_members(self):
-        def record_gen():
-            for i in itertools.count():
-                yield getattr(unittest.mock.sentinel, "record{}".format(i))
-
-        with contextlib.ExitStack() as stack:
-            VoteRecord = stack.enter_context(unittest.mock.patch(
-                "councilbot.state.VoteRecord",
-            ))
-            VoteRecord.side_effect = record_gen()
-
-            self.p.push_vote(self.members[0],
-                             unittest.mock.sentinel.value,
-                             unittest.mock.sentinel.remark,
-                             timestamp=unittest.mock.sentinel.timestamp)
-
-            self.p.push_vote(self.members[1],
-                             unittest.mock.sentinel.value,
-                             unittest.mock.sentinel.remark,
-                             timestamp=unittest.mock.sentinel.timestamp)
-
-            self.p.push_vote(self.members[0],
-                             unittest.mock.sentinel.value,
-                             unittest.mock.sentinel.remark,
-                             timestamp=unittest.mock.sentinel.timestamp)
+        record0 = self._push(self.members[0], 0)
+        record1 = self._push(self.members[1], 1)
+        record2 = self._push(self.members[0], 2)
 
         self.assertEqual(
             self.p.get_votes(self.members[0]),
             [
-                unittest.mock.sentinel.record0,
-                unittest.mock.sentinel.record2,
+                record0,
+                record2,
             ]
         )
 
         self.assertEqual(
             self.p.get_votes(self.members[1]),
             [
-                unittest.mock.sentinel.record1,
+                record1,
             ]
         )
 
@@ -324,11 +261,11 @@ class TestPoll(unittest.TestCase):
             self.p.get_vote_history(),
             {
                 self.members[0]: [
-                    unittest.mock.sentinel.record0,
-                    unittest.mock.sentinel.record2,
+                    record0,
+                    record2,
                 ],
                 self.members[1]: [
-                    unittest.mock.sentinel.record1,
+                    record1,
                 ],
                 self.members[2]: [],
                 self.members[3]: [],
@@ -339,10 +276,8 @@ class TestPoll(unittest.TestCase):
         self.assertDictEqual(
             self.p.get_current_votes(),
             {
-                self.members[0]:
-                    unittest.mock.sentinel.record2,
-                self.members[1]:
-                    unittest.mock.sentinel.record1,
+                self.members[0]: record2,
+                self.members[1]: record1,
                 self.members[2]: None,
                 self.members[3]: None,
                 self.members[4]: None,
@@ -351,8 +286,8 @@ class TestPoll(unittest.TestCase):
 
     def test_pop_vote_reverts_push_vote(self):
         self.p.push_vote(self.members[0],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.p.pop_vote(self.members[0])
 
@@ -382,24 +317,24 @@ class TestPoll(unittest.TestCase):
 
     def test_get_state_returns_complete_if_all_members_have_voted_and_not_expired_yet(self):  # NOQA
         self.p.push_vote(self.members[0],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.p.push_vote(self.members[1],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.p.push_vote(self.members[2],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.p.push_vote(self.members[3],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.p.push_vote(self.members[4],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.assertEqual(
             self.p.get_state(self.start),
@@ -408,24 +343,24 @@ class TestPoll(unittest.TestCase):
 
     def test_get_state_returns_concluded_if_all_members_have_voted_and_poll_expired(self):  # NOQA
         self.p.push_vote(self.members[0],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.p.push_vote(self.members[1],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.p.push_vote(self.members[2],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.p.push_vote(self.members[3],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.p.push_vote(self.members[4],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
 
         self.assertEqual(
             self.p.get_state(self.start + timedelta(days=14)),
@@ -617,26 +552,44 @@ class TestPoll(unittest.TestCase):
             {state.PollFlag.CONCLUDED}
         )
 
+    def test_load_uses_jids(self):
+        buf = io.StringIO()
+        self._make_dummy_votes(self.p)
+        self.p.dump(buf)
+        buf.seek(0, io.SEEK_SET)
+
+        p2 = state.Poll.load(buf, jids={
+            str(member): member
+            for member in self.members
+        })
+
+        for member in p2.get_vote_history():
+            self.assertIs(member, self.members[self.members.index(member)])
+
+    def test_has_no_instance_dict(self):
+        with self.assertRaises(AttributeError):
+            self.p.__dict__
+
     def test_copy_has_independent_member_data_1(self):
         p2 = copy.copy(self.p)
         self.p.push_vote(self.members[0],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
         p2.push_vote(self.members[1],
-                     unittest.mock.sentinel.value,
-                     unittest.mock.sentinel.remark)
+                     state.VoteValue.ACK,
+                     None)
 
         self.assertNotEqual(self.p.get_vote_history(),
                             p2.get_vote_history())
 
     def test_copy_has_independent_member_data_2(self):
         self.p.push_vote(self.members[0],
-                         unittest.mock.sentinel.value,
-                         unittest.mock.sentinel.remark)
+                         state.VoteValue.ACK,
+                         None)
         p2 = copy.copy(self.p)
         p2.push_vote(self.members[0],
-                     unittest.mock.sentinel.value,
-                     unittest.mock.sentinel.remark)
+                     state.VoteValue.ACK,
+                     None)
 
         self.assertNotEqual(self.p.get_vote_history(),
                             p2.get_vote_history())
@@ -720,6 +673,57 @@ class TestPoll(unittest.TestCase):
 
         self.assertEqual(self.p.result, state.PollResult.FAIL)
 
+    def test_pop_vote_restores_previous_result(self):
+        for member in self.members:
+            self.p.push_vote(member, state.VoteValue.ACK, None)
+        self.p.push_vote(self.members[0], state.VoteValue.VETO, "nope")
+        self.assertEqual(self.p.result, state.PollResult.VETO)
+
+        self.p.pop_vote(self.members[0])
+
+        self.assertEqual(self.p.result, state.PollResult.PASS)
+        self.assertEqual(self.p.get_state(self.start),
+                         state.PollState.COMPLETE)
+
+    def test_pop_vote_of_only_vote_reopens_poll(self):
+        for member in self.members:
+            self.p.push_vote(member, state.VoteValue.ACK, None)
+
+        self.p.pop_vote(self.members[0])
+
+        self.assertEqual(self.p.get_state(self.start),
+                         state.PollState.OPEN)
+
+    def test_tally_matches_current_votes(self):
+        values = list(state.VoteValue)
+        for i in range(200):
+            member = self.members[(i * 7) % len(self.members)]
+            if i % 3 == 2:
+                self.p.pop_vote(member)
+            else:
+                self.p.push_vote(member, values[(i * 5) % len(values)], None)
+
+            current = [vote.value
+                       for vote in self.p.get_current_votes().values()
+                       if vote is not None]
+            if state.VoteValue.VETO in current:
+                expected = state.PollResult.VETO
+            elif (len(current) > len(self.members) / 2 and
+                    current.count(state.VoteValue.ACK) > len(current) / 2):
+                expected = state.PollResult.PASS
+            else:
+                expected = state.PollResult.FAIL
+
+            self.assertEqual(self.p.result, expected)
+
+    def test_copy_has_independent_tally(self):
+        p2 = copy.copy(self.p)
+        for member in self.members:
+            p2.push_vote(member, state.VoteValue.ACK, None)
+
+        self.assertEqual(self.p.result, state.PollResult.FAIL)
+        self.assertEqual(p2.result, state.PollResult.PASS)
+
     def test_can_load_first_stable_format(self):
         data = {
             "id": self.id_,
@@ -833,3 +837,883 @@ class TestPoll(unittest.TestCase):
                 ],
             }
         )
+
+
+class TestVoteHistory(unittest.TestCase):
+    def setUp(self):
+        self.records = [
+            state.VoteRecord(datetime(2019, 1, 1, 10, 0, 0, 123456),
+                             state.VoteValue.ACK, None),
+            state.VoteRecord(datetime(1969, 12, 31, 23, 59, 59),
+                             state.VoteValue.VETO, "nope"),
+            state.VoteRecord(datetime(2038, 1, 19, 3, 14, 8),
+                             state.VoteValue.MINUS_ZERO, ""),
+        ]
+        self.h = state.VoteHistory(self.records)
+
+    def test_sequence(self):
+        self.assertEqual(len(self.h), 3)
+        self.assertSequenceEqual(list(self.h), self.records)
+        self.assertEqual(self.h[-1], self.records[-1])
+        self.assertEqual(self.h[1:], self.records[1:])
+        self.assertEqual(self.h, self.records)
+        with self.assertRaises(IndexError):
+            self.h[3]
+
+    def test_append_and_pop(self):
+        record = state.VoteRecord(datetime(2020, 1, 1),
+                                  state.VoteValue.PLUS_ZERO, "meh")
+        self.h.append(record)
+        self.assertEqual(self.h[-1], record)
+
+        self.assertEqual(self.h.pop(), record)
+        self.assertEqual(self.h, self.records)
+
+    def test_append_converts_aware_timestamps_to_utc(self):
+        self.h.append(state.VoteRecord(
+            datetime(2020, 1, 1, 12, tzinfo=timezone(timedelta(hours=2))),
+            state.VoteValue.ACK,
+            None,
+        ))
+        self.assertEqual(self.h[-1].timestamp, datetime(2020, 1, 1, 10))
+
+    def test_append_rejects_invalid_value_without_change(self):
+        with self.assertRaises(KeyError):
+            self.h.append(state.VoteRecord(datetime(2020, 1, 1), "+1", None))
+        self.assertEqual(self.h, self.records)
+
+    def test_copy_is_independent(self):
+        for h2 in [copy.copy(self.h), copy.deepcopy(self.h), self.h.copy()]:
+            h2.pop()
+            self.assertEqual(self.h, self.records)
+            self.assertEqual(h2, self.records[:-1])
+
+
+class TestPollEdit(unittest.TestCase):
+    def setUp(self):
+        self.start = datetime(2019, 1, 1, 10, 0, 0)
+        self.members = [
+            aioxmpp.JID.fromstr("alice@domain.example"),
+            aioxmpp.JID.fromstr("bob@domain.example"),
+        ]
+        self.p = state.Poll(
+            "some_id",
+            self.start,
+            timedelta(days=14),
+            "accept foo",
+            self.members,
+        )
+        self.e = state.PollEdit(self.p)
+
+    def test_changes_are_not_visible_before_apply(self):
+        self.e.flags.add(state.PollFlag.CONCLUDED)
+        self.e.subject = "accept bar"
+        self.e.urls.append("https://domain.example/foo")
+
+        self.assertSetEqual(self.p.flags, set())
+        self.assertEqual(self.p.subject, "accept foo")
+        self.assertSequenceEqual(self.p.urls, [])
+
+    def test_apply_applies_changes(self):
+        self.e.flags.add(state.PollFlag.CONCLUDED)
+        self.e.subject = "accept bar"
+        self.e.urls.append("https://domain.example/foo")
+        self.e.description = "fnord"
+
+        self.assertIs(self.e.apply(), self.p)
+
+        self.assertSetEqual(self.p.flags, {state.PollFlag.CONCLUDED})
+        self.assertEqual(self.p.subject, "accept bar")
+        self.assertSequenceEqual(self.p.urls, ["https://domain.example/foo"])
+        self.assertEqual(self.p.description, "fnord")
+
+    def test_to_dict_matches_poll_after_apply(self):
+        self.p.push_vote(self.members[1], state.VoteValue.VETO, None,
+                         timestamp=self.start)
+        self.p.description = "fnord"
+        self.e.flags.add(state.PollFlag.CONCLUDED)
+        self.e.tag = "bar"
+        self.e.description = None
+        self.e.made_current_at = self.start
+
+        data = self.e.to_dict(journal_seq=3)
+        self.assertSetEqual(self.p.flags, set())
+        self.assertEqual(self.p.description, "fnord")
+
+        self.e.apply()
+        self.p.journal_seq = 3
+        self.assertDictEqual(data, self.p.to_dict())
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmpdir.name) / "journal.jsonl"
+        self.j = state.Journal(self.path)
+
+    def tearDown(self):
+        self.j.close()
+        self.tmpdir.cleanup()
+
+    def test_replay_of_missing_journal_is_empty(self):
+        self.assertSequenceEqual(list(self.j.replay()), [])
+        self.assertEqual(self.j.last_seq, 0)
+
+    def test_append_and_replay(self):
+        self.assertEqual(self.j.append([{"op": "a"}]), 1)
+        self.assertEqual(self.j.append([{"op": "b"}, {"op": "c"}]), 2)
+        self.assertEqual(self.j.nrecords, 2)
+
+        j2 = state.Journal(self.path)
+        self.assertSequenceEqual(
+            list(j2.replay()),
+            [
+                (1, [{"op": "a"}]),
+                (2, [{"op": "b"}, {"op": "c"}]),
+            ]
+        )
+        self.assertEqual(j2.last_seq, 2)
+        self.assertEqual(j2.nrecords, 2)
+
+    def test_append_syncs_in_strict_mode(self):
+        # the first append also syncs the directory
+        self.j.append([{"op": "a"}])
+        with unittest.mock.patch("os.fsync") as fsync:
+            self.j.append([{"op": "b"}])
+
+        fsync.assert_called_once_with(unittest.mock.ANY)
+        self.assertFalse(self.j.needs_sync)
+
+    def test_append_defers_sync_in_group_mode(self):
+        j = state.Journal(self.path, state.Durability.GROUP)
+        j.append([{"op": "a"}])
+        with unittest.mock.patch("os.fsync") as fsync:
+            j.append([{"op": "b"}])
+            fsync.assert_not_called()
+            self.assertTrue(j.needs_sync)
+
+            j.sync()
+            fsync.assert_called_once_with(unittest.mock.ANY)
+            self.assertFalse(j.needs_sync)
+
+            j.sync()
+            fsync.assert_called_once_with(unittest.mock.ANY)
+        j.close()
+
+        self.assertEqual(len(list(state.Journal(self.path).replay())), 2)
+
+    def test_close_syncs(self):
+        j = state.Journal(self.path, state.Durability.RELAXED)
+        j.append([{"op": "a"}])
+        with unittest.mock.patch("os.fsync") as fsync:
+            j.close()
+        fsync.assert_called_once_with(unittest.mock.ANY)
+
+    def test_reset_keeps_sequence_number(self):
+        self.j.append([{"op": "a"}])
+        self.j.append([{"op": "b"}])
+        self.j.reset()
+
+        self.assertEqual(self.j.nrecords, 0)
+        self.assertEqual(self.j.append([{"op": "c"}]), 3)
+
+        j2 = state.Journal(self.path)
+        self.assertSequenceEqual(
+            list(j2.replay()),
+            [
+                (2, []),
+                (3, [{"op": "c"}]),
+            ]
+        )
+        self.assertEqual(j2.nrecords, 1)
+
+    def test_replay_discards_torn_record(self):
+        self.j.append([{"op": "a"}])
+        self.j.close()
+        with self.path.open("ab") as f:
+            f.write(b'{"seq":2,"ops":[{"op"')
+
+        j2 = state.Journal(self.path)
+        self.assertSequenceEqual(list(j2.replay()), [(1, [{"op": "a"}])])
+        self.assertEqual(j2.append([{"op": "b"}]), 2)
+
+        j3 = state.Journal(self.path)
+        self.assertSequenceEqual(
+            list(j3.replay()),
+            [
+                (1, [{"op": "a"}]),
+                (2, [{"op": "b"}]),
+            ]
+        )
+
+
+class TestState(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.statedir = pathlib.Path(self.tmpdir.name)
+        self.members = [
+            aioxmpp.JID.fromstr("alice@domain.example"),
+            aioxmpp.JID.fromstr("bob@domain.example"),
+            aioxmpp.JID.fromstr("carol@domain.example"),
+        ]
+        self.config = {
+            "council": {
+                "members": [
+                    {"address": member, "nick": member.localpart}
+                    for member in self.members
+                ],
+            },
+            "state": {
+                "directory": str(self.statedir),
+            },
+        }
+        self.s = state.State(self.config)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _reload(self):
+        self.s._journal.close()
+        self.s = state.State(self.config)
+
+    def test_cast_vote_does_not_rewrite_poll_file(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.compact_journal()
+        path = self.statedir / "polls" / "active" / "{}.toml".format(poll_id)
+        before = path.read_bytes()
+
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+
+        self.assertEqual(path.read_bytes(), before)
+        self.assertEqual(self.s._journal.nrecords, 1)
+        self.assertEqual(
+            self.s.get_poll(poll_id).get_votes(self.members[1])[-1].value,
+            state.VoteValue.ACK,
+        )
+
+    def test_reload_only_rewrites_changed_polls(self):
+        poll_ids = [
+            self.s.create_poll(self.members[0], "m1", "foo {}".format(i))[1]
+            for i in range(3)
+        ]
+        self.s.compact_journal()
+        paths = [
+            self.statedir / "polls" / "active" / "{}.toml".format(poll_id)
+            for poll_id in poll_ids
+        ]
+        inodes = [path.stat().st_ino for path in paths]
+
+        self.s.cast_vote(self.members[1], "m2", poll_ids[0],
+                         state.VoteValue.ACK, None)
+        self.s.write_last_message_id(self.members[2], "m3")
+        self.s.close()
+        self.s = state.State(self.config)
+
+        self.assertEqual(self.s._journal.nrecords, 0)
+        self.assertNotEqual(paths[0].stat().st_ino, inodes[0])
+        self.assertEqual([path.stat().st_ino for path in paths[1:]],
+                         inodes[1:])
+        self.assertEqual(
+            self.s.get_poll(poll_ids[0]).get_votes(self.members[1])[-1].value,
+            state.VoteValue.ACK,
+        )
+
+    def test_compact_journal_syncs_storage_before_reset(self):
+        self.s.create_poll(self.members[0], "m1", "foo")
+        calls = unittest.mock.Mock()
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                self.s._storage, "sync", calls.sync,
+            ))
+            stack.enter_context(unittest.mock.patch.object(
+                self.s._journal, "reset", calls.reset,
+            ))
+            self.s.compact_journal()
+
+        self.assertSequenceEqual(
+            calls.mock_calls,
+            [unittest.mock.call.sync(), unittest.mock.call.reset()],
+        )
+
+    def test_cast_vote_fails_for_non_member_without_writing(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        seq = self.s._journal.last_seq
+
+        with self.assertRaises(KeyError):
+            self.s.cast_vote(aioxmpp.JID.fromstr("eve@domain.example"),
+                             "m2", poll_id, state.VoteValue.ACK, None)
+
+        self.assertEqual(self.s._journal.last_seq, seq)
+
+    def test_cast_vote_commits_vote_and_transaction_in_one_record(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        seq = self.s._journal.last_seq
+
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+
+        self.assertEqual(self.s._journal.last_seq, seq + 1)
+        self.assertFalse(
+            (self.statedir / "members" / "bob.toml").exists()
+        )
+
+        self._reload()
+
+        self.s.revert_last_transaction(self.members[1], "m2")
+        self.assertSequenceEqual(
+            self.s.get_poll(poll_id).get_votes(self.members[1]),
+            [],
+        )
+
+    def test_create_poll_is_recovered_from_journal(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo",
+                                        tag="bar",
+                                        urls=["https://domain.example"])
+        path = self.statedir / "polls" / "active" / "{}.toml".format(poll_id)
+        self.assertFalse(path.exists())
+
+        self._reload()
+
+        poll = self.s.get_poll(poll_id)
+        self.assertEqual(poll.subject, "foo")
+        self.assertEqual(poll.tag, "bar")
+        self.assertSequenceEqual(poll.urls, ["https://domain.example"])
+        self.assertIsNotNone(poll.made_current_at)
+        self.assertTrue(path.exists())
+
+    def test_reverted_create_is_not_resurrected_on_reload(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.revert_last_transaction(self.members[0], "m1")
+
+        self._reload()
+
+        self.assertNotIn(poll_id, self.s.active_polls)
+
+    def test_attach_url_and_revert(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.attach_url(self.members[1], "m2", poll_id, "https://x.example")
+        self.assertSequenceEqual(self.s.get_poll(poll_id).urls,
+                                 ["https://x.example"])
+
+        self._reload()
+        self.assertSequenceEqual(self.s.get_poll(poll_id).urls,
+                                 ["https://x.example"])
+
+        self.s.revert_last_transaction(self.members[1], "m2")
+        self.assertSequenceEqual(self.s.get_poll(poll_id).urls, [])
+
+    def test_failed_edit_leaves_poll_unchanged(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        for i, member in enumerate(self.members):
+            self.s.cast_vote(member, "v{}".format(i), poll_id,
+                             state.VoteValue.ACK, None)
+        poll = self.s.get_poll(poll_id)
+        before = poll.to_dict()
+
+        with unittest.mock.patch.object(self.s._storage, "write_poll",
+                                        side_effect=OSError()):
+            with self.assertRaises(OSError):
+                self.s._conclude_poll(poll)
+
+        self.assertIs(self.s.get_poll(poll_id), poll)
+        self.assertNotIn(state.PollFlag.CONCLUDED, poll.flags)
+        self.assertDictEqual(poll.to_dict(), before)
+
+        self.s._conclude_poll(poll)
+        self.assertIn(state.PollFlag.CONCLUDED, poll.flags)
+
+    def test_update_poll_metadata(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1",
+                                        "https://x.example", tag="foo")
+        self.s.update_poll_metadata(poll_id, "Deprecate XEP-0001", "bar",
+                                    ["https://x.example"], "Because.")
+
+        def check():
+            poll = self.s.get_poll(poll_id)
+            self.assertEqual(poll.subject, "Deprecate XEP-0001")
+            self.assertEqual(poll.tag, "bar")
+            self.assertSequenceEqual(poll.urls, ["https://x.example"])
+            self.assertEqual(poll.description, "Because.")
+            self.assertEqual(self.s.find_poll("bar"), poll_id)
+            self.assertEqual(self.s.find_poll("deprecate xep-0001"), poll_id)
+
+        check()
+        self._reload()
+        check()
+
+    def test_update_poll_metadata_fails_for_reverted_poll(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.revert_last_transaction(self.members[0], "m1")
+        seq = self.s._journal.last_seq
+
+        with self.assertRaises(KeyError):
+            self.s.update_poll_metadata(poll_id, "bar", None, [], None)
+
+        self.assertEqual(self.s._journal.last_seq, seq)
+
+    def test_reload_replays_journal(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+        self.s.cast_vote(self.members[2], "m3", poll_id,
+                         state.VoteValue.VETO, "nope nope nope")
+        self.s.revert_last_transaction(self.members[2], "m3")
+        history = copy.deepcopy(
+            self.s.get_poll(poll_id).get_vote_history()
+        )
+
+        self._reload()
+
+        self.assertDictEqual(
+            self.s.get_poll(poll_id).get_vote_history(),
+            history,
+        )
+        # replayed records are folded into the snapshot on startup
+        self.assertEqual(self.s._journal.nrecords, 0)
+
+        self._reload()
+
+        self.assertDictEqual(
+            self.s.get_poll(poll_id).get_vote_history(),
+            history,
+        )
+
+    def test_journal_is_compacted_at_threshold(self):
+        self.config["state"]["journal_compact_threshold"] = 3
+        self._reload()
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+        self.assertEqual(self.s._journal.nrecords, 2)
+
+        self.s.cast_vote(self.members[2], "m3", poll_id,
+                         state.VoteValue.ACK, None)
+        self.assertEqual(self.s._journal.nrecords, 0)
+
+        path = self.statedir / "polls" / "active" / "{}.toml".format(poll_id)
+        with path.open("r") as f:
+            p = state.Poll.load(f)
+
+        self.assertEqual(p.journal_seq, 3)
+        self.assertEqual(len(p.get_votes(self.members[2])), 1)
+
+    def test_delete_poll_compacts_journal_first(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+        self.s.delete_poll(self.members[0], "m3", poll_id)
+        self.s.revert_last_transaction(self.members[0], "m3")
+
+        self.assertEqual(
+            len(self.s.get_poll(poll_id).get_votes(self.members[1])),
+            1,
+        )
+
+    def test_write_last_message_id_is_kept_in_memory(self):
+        seq = self.s._journal.last_seq
+
+        self.s.write_last_message_id(self.members[0], "m1")
+        self.s.write_last_message_id(self.members[1], "m2")
+        self.s.write_last_message_id(self.members[0], "m3")
+
+        self.assertEqual(self.s._journal.last_seq, seq)
+        self.assertSequenceEqual(
+            list((self.statedir / "members").iterdir()),
+            [],
+        )
+
+        self.s.flush_member_state()
+
+        self.assertEqual(self.s._journal.last_seq, seq + 1)
+
+        self._reload()
+
+        self.assertEqual(
+            self.s._read_member_state(self.members[0])
+            ["last_message"]["message_id"],
+            "m3",
+        )
+
+    def test_write_last_message_id_after_transaction_is_durable(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+        seq = self.s._journal.last_seq
+
+        self.s.write_last_message_id(self.members[1], "m3")
+
+        self.assertEqual(self.s._journal.last_seq, seq + 1)
+
+        self._reload()
+
+        self.assertIsNone(self.s.revert_last_transaction(self.members[1],
+                                                         "m2"))
+
+    def test_revert_is_durable(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+        self.s.cast_vote(self.members[1], "m3", poll_id,
+                         state.VoteValue.VETO, "for reasons")
+        self.s.revert_last_transaction(self.members[1], "m3")
+
+        self._reload()
+
+        self.assertIsNone(self.s.revert_last_transaction(self.members[1],
+                                                         "m3"))
+        self.assertEqual(
+            len(self.s.get_poll(poll_id).get_votes(self.members[1])),
+            1,
+        )
+
+    def test_next_expiry_is_earliest_end_time(self):
+        self.assertIsNone(self.s.next_expiry)
+
+        _, poll_id1 = self.s.create_poll(self.members[0], "m1", "foo",
+                                         lifetime=timedelta(days=2))
+        _, poll_id2 = self.s.create_poll(self.members[0], "m2", "bar",
+                                         lifetime=timedelta(days=1))
+
+        self.assertEqual(self.s.next_expiry,
+                         self.s.get_poll(poll_id2).end_time)
+
+        self.s.delete_poll(self.members[0], "m3", poll_id2)
+
+        self.assertEqual(self.s.next_expiry,
+                         self.s.get_poll(poll_id1).end_time)
+
+    def test_next_expiry_changed_fires_for_earlier_deadline(self):
+        cb = unittest.mock.Mock()
+        cb.return_value = None
+        self.s.on_next_expiry_changed.connect(cb)
+
+        self.s.create_poll(self.members[0], "m1", "foo",
+                           lifetime=timedelta(days=2))
+        self.assertEqual(len(cb.mock_calls), 1)
+
+        self.s.create_poll(self.members[0], "m2", "bar",
+                           lifetime=timedelta(days=3))
+        self.assertEqual(len(cb.mock_calls), 1)
+
+        self.s.create_poll(self.members[0], "m3", "baz",
+                           lifetime=timedelta(days=1))
+        self.assertEqual(len(cb.mock_calls), 2)
+
+    def test_expire_polls_concludes_due_polls_once(self):
+        _, poll_id1 = self.s.create_poll(self.members[0], "m1", "foo",
+                                         lifetime=timedelta(days=1))
+        _, poll_id2 = self.s.create_poll(self.members[0], "m2", "bar",
+                                         lifetime=timedelta(days=2))
+        concluded = unittest.mock.Mock()
+        concluded.return_value = None
+        self.s.on_poll_concluded.connect(concluded)
+
+        now = self.s._get_rounded_time()
+        with unittest.mock.patch.object(
+                self.s, "_get_rounded_time",
+                return_value=now + timedelta(days=1, hours=1)):
+            self.s.expire_polls()
+            self.s.expire_polls()
+
+        self.assertSequenceEqual(
+            concluded.mock_calls,
+            [
+                unittest.mock.call(poll_id1,
+                                   state.ConclusionReason.EXPIRATION),
+            ]
+        )
+        self.assertIn(state.PollFlag.CONCLUDED,
+                      self.s.get_poll(poll_id1).flags)
+        path = self.statedir / "polls" / "active" / "{}.toml".format(poll_id1)
+        self.assertIn("concluded", toml.loads(path.read_text())["flags"])
+        self.assertEqual(self.s.next_expiry,
+                         self.s.get_poll(poll_id2).end_time)
+
+    def test_expire_polls_concludes_restored_poll_once(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo",
+                                        lifetime=timedelta(days=1))
+        self.s.delete_poll(self.members[0], "m2", poll_id)
+        self.s.revert_last_transaction(self.members[0], "m2")
+        self.assertIn(poll_id, self.s.active_polls)
+        concluded = unittest.mock.Mock()
+        concluded.return_value = None
+        self.s.on_poll_concluded.connect(concluded)
+
+        now = self.s._get_rounded_time()
+        with unittest.mock.patch.object(
+                self.s, "_get_rounded_time",
+                return_value=now + timedelta(days=1, hours=1)):
+            self.s.expire_polls()
+
+        self.assertSequenceEqual(
+            concluded.mock_calls,
+            [
+                unittest.mock.call(poll_id,
+                                   state.ConclusionReason.EXPIRATION),
+            ]
+        )
+        self.assertIsNone(self.s.next_expiry)
+
+    def test_current_poll_is_most_recently_created_poll(self):
+        self.assertIsNone(self.s.current_poll)
+
+        _, poll_id1 = self.s.create_poll(self.members[0], "m1", "foo")
+        self.assertEqual(self.s.current_poll, poll_id1)
+
+        _, poll_id2 = self.s.create_poll(self.members[0], "m2", "bar")
+        self.assertEqual(self.s.current_poll, poll_id2)
+
+        self.s.delete_poll(self.members[0], "m3", poll_id2)
+        self.assertEqual(self.s.current_poll, poll_id1)
+
+        self.s.revert_last_transaction(self.members[0], "m3")
+        self.assertEqual(self.s.current_poll, poll_id2)
+
+    def test_current_poll_survives_reload(self):
+        _, poll_id1 = self.s.create_poll(self.members[0], "m1", "foo")
+        _, poll_id2 = self.s.create_poll(self.members[0], "m2", "bar")
+        self._reload()
+
+        self.assertEqual(self.s.current_poll, poll_id2)
+
+    def test_current_poll_expires_after_30_minutes(self):
+        self.s.create_poll(self.members[0], "m1", "foo")
+
+        now = datetime.utcnow()
+        with unittest.mock.patch("councilbot.state.datetime") as dt:
+            dt.utcnow.return_value = now + timedelta(minutes=31)
+            self.assertIsNone(self.s.current_poll)
+
+    def test_find_poll(self):
+        _, poll_id1 = self.s.create_poll(
+            self.members[0], "m1",
+            "Accept 'Stanza Content Encryption' as Experimental",
+            tag="sce",
+        )
+        _, poll_id2 = self.s.create_poll(
+            self.members[0], "m2",
+            "Deprecate XEP-0001",
+        )
+
+        self.assertEqual(self.s.find_poll(poll_id2), poll_id2)
+        self.assertEqual(self.s.find_poll("SCE"), poll_id1)
+        self.assertEqual(self.s.find_poll("stanza encryption"), poll_id1)
+        self.assertEqual(self.s.find_poll("deprecate 0001"), poll_id2)
+        with self.assertRaises(KeyError):
+            self.s.find_poll("something else entirely")
+
+        self.s.delete_poll(self.members[0], "m3", poll_id1)
+
+        with self.assertRaises(KeyError):
+            self.s.find_poll("sce")
+
+    def test_reload_uses_snapshot_cache(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+        self._reload()
+        history = copy.deepcopy(
+            self.s.get_poll(poll_id).get_vote_history()
+        )
+
+        # make the entries older than the racy window
+        self.s._storage._snapshot_cache._entries[
+            "{}.toml".format(poll_id)
+        ]["mtime_ns"] -= 10**10
+        path = self.statedir / "polls" / "active" / "{}.toml".format(poll_id)
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns - 10**10))
+        self.s._storage._snapshot_cache._dirty = True
+        self.s.close()
+
+        with unittest.mock.patch("toml.load") as load:
+            self._reload()
+
+        load.assert_not_called()
+        self.assertDictEqual(
+            self.s.get_poll(poll_id).get_vote_history(),
+            history,
+        )
+
+    def _age_poll_file(self, poll_id):
+        name = "{}.toml".format(poll_id)
+        cache = self.s._storage._snapshot_cache
+        cache._entries[name]["mtime_ns"] -= 10**10
+        path = self.statedir / "polls" / "active" / name
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns - 10**10))
+        cache._dirty = True
+
+    def test_reload_from_cache_loads_history_on_demand(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+        self._reload()
+        self._age_poll_file(poll_id)
+        self.s.close()
+        self._reload()
+
+        poll = self.s.get_poll(poll_id)
+        self.assertFalse(poll.has_history)
+        self.assertEqual(poll.result, state.PollResult.FAIL)
+
+        self.assertEqual(
+            poll.get_votes(self.members[1])[-1].value,
+            state.VoteValue.ACK,
+        )
+        self.assertTrue(poll.has_history)
+
+    def test_resident_histories_are_bounded(self):
+        self.config["state"]["max_resident_histories"] = 1
+        self._reload()
+        poll_ids = [
+            self.s.create_poll(self.members[0], "m1", "foo {}".format(i))[1]
+            for i in range(3)
+        ]
+        self.s.compact_journal()
+
+        resident = [
+            poll_id for poll_id in poll_ids
+            if self.s._polls[poll_id].has_history
+        ]
+        self.assertEqual(resident, poll_ids[-1:])
+
+        self.s.cast_vote(self.members[1], "m2", poll_ids[0],
+                         state.VoteValue.ACK, None)
+        self.assertTrue(self.s._polls[poll_ids[0]].has_history)
+        self.s.compact_journal()
+        self.assertFalse(self.s._polls[poll_ids[2]].has_history)
+
+        self._reload()
+        self.assertEqual(
+            self.s.get_poll(poll_ids[0]).get_votes(self.members[1])[-1].value,
+            state.VoteValue.ACK,
+        )
+
+    def test_reload_shares_member_jids(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+        self._reload()
+
+        members = {id(member) for member in self.s._member_map}
+        poll = self.s.get_poll(poll_id)
+        self.assertSetEqual(
+            {id(member) for member in poll.get_vote_history()},
+            members,
+        )
+        self.assertSetEqual(
+            {id(member) for member in poll.get_current_votes()},
+            members,
+        )
+
+    def test_reload_parses_changed_files(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.close()
+        self._reload()
+        self.s.close()
+
+        path = self.statedir / "polls" / "active" / "{}.toml".format(poll_id)
+        data = toml.loads(path.read_text())
+        data["subject"] = "bar"
+        path.write_text(toml.dumps(data))
+
+        self._reload()
+
+        self.assertEqual(self.s.get_poll(poll_id).subject, "bar")
+
+    def test_rebuild_cache_ignores_cache(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self._reload()
+
+        path = self.statedir / "polls" / "active" / "{}.toml".format(poll_id)
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns - 10**10))
+        data = toml.loads(path.read_text())
+        data["subject"] = "stale"
+        self.s._storage._snapshot_cache.put(path.name, path.stat(), data)
+        self.s.close()
+
+        self._reload()
+        self.assertEqual(self.s.get_poll(poll_id).subject, "stale")
+
+        self.s.close()
+        self.s = state.State(self.config, rebuild_cache=True)
+        self.assertEqual(self.s.get_poll(poll_id).subject, "foo")
+
+
+class TestStateWithMemoryBackend(unittest.TestCase):
+    def setUp(self):
+        self.members = [
+            aioxmpp.JID.fromstr("alice@domain.example"),
+            aioxmpp.JID.fromstr("bob@domain.example"),
+            aioxmpp.JID.fromstr("carol@domain.example"),
+        ]
+        self.config = {
+            "council": {
+                "members": [
+                    {"address": member, "nick": member.localpart}
+                    for member in self.members
+                ],
+            },
+            "state": {
+                "backend": "memory",
+            },
+        }
+        self.s = state.State(self.config)
+
+    def tearDown(self):
+        self.s.close()
+
+    def test_does_not_touch_disk(self):
+        with contextlib.ExitStack() as stack:
+            open_ = stack.enter_context(unittest.mock.patch("io.open"))
+            fsync = stack.enter_context(unittest.mock.patch("os.fsync"))
+            s = state.State(self.config)
+            _, poll_id = s.create_poll(self.members[0], "m1", "foo")
+            s.cast_vote(self.members[1], "m2", poll_id,
+                        state.VoteValue.ACK, None)
+            s.compact_journal()
+            s.close()
+
+        open_.assert_not_called()
+        fsync.assert_not_called()
+
+    def test_create_vote_revert_and_conclude(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo",
+                                        lifetime=timedelta(days=1))
+        self.s.cast_vote(self.members[1], "m2", poll_id,
+                         state.VoteValue.ACK, None)
+        self.s.cast_vote(self.members[2], "m3", poll_id,
+                         state.VoteValue.VETO, None)
+        self.s.revert_last_transaction(self.members[2], "m3")
+        self.assertFalse(
+            self.s.get_poll(poll_id).get_votes(self.members[2])
+        )
+
+        # folds the journal into the backend
+        self.s.compact_journal()
+        self.s.reload_polls()
+        self.assertEqual(
+            self.s.get_poll(poll_id).get_votes(self.members[1])[-1].value,
+            state.VoteValue.ACK,
+        )
+
+        now = self.s._get_rounded_time()
+        with unittest.mock.patch.object(
+                self.s, "_get_rounded_time",
+                return_value=now + timedelta(days=1, hours=1)):
+            self.s.expire_polls()
+
+        self.assertIn(state.PollFlag.CONCLUDED,
+                      self.s.get_poll(poll_id).flags)
+
+    def test_revert_of_create_moves_poll_to_trash(self):
+        _, poll_id = self.s.create_poll(self.members[0], "m1", "foo")
+        self.s.revert_last_transaction(self.members[0], "m1")
+        self.assertNotIn(poll_id, self.s.active_polls)
+        self.assertTrue(
+            self.s._storage.has_poll(poll_id, state.PollLocation.TRASH)
+        )
@@ -0,0 +1,306 @@
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from datetime import datetime, timedelta, timezone
+
+import aioxmpp
+
+import councilbot.state as state
+import councilbot.storage as storage
+
+
+def make_poll_data(id_="some_id", nvotes=2):
+    start = datetime(2019, 1, 1, 10, 0, 0, tzinfo=timezone.utc)
+    votes = {
+        "alice@domain.example": [
+            {
+                "timestamp": start + timedelta(minutes=i),
+                "value": "ack" if i % 2 else "veto",
+                "remark": "vote {}".format(i),
+            }
+            for i in range(nvotes)
+        ],
+    }
+    return {
+        "id": id_,
+        "start_time": start,
+        "end_time": start + timedelta(days=14),
+        "subject": "accept foo",
+        "voters": ["alice@domain.example", "bob@domain.example"],
+        "votes": votes,
+        "flags": [],
+        "urls": [],
+    }
+
+
+class StorageTestMixin:
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.statedir = pathlib.Path(self.tmpdir.name)
+        self.s = self._make_storage()
+
+    def tearDown(self):
+        self.s.close()
+        self.tmpdir.cleanup()
+
+    def _reopen(self):
+        self.s.close()
+        self.s = self._make_storage()
+
+    def test_write_and_load_poll(self):
+        data = make_poll_data()
+        self.s.write_poll(data)
+        self._reopen()
+        self.assertEqual(self.s.load_poll(data["id"]), data)
+
+    def test_load_poll_raises_key_error_for_unknown_poll(self):
+        with self.assertRaises(KeyError):
+            self.s.load_poll("foo")
+
+    def test_load_active_polls(self):
+        data = make_poll_data()
+        self.s.write_poll(data)
+        self.s.write_poll(make_poll_data("other"), storage.PollLocation.TRASH)
+        self._reopen()
+
+        loaded = list(self.s.load_active_polls())
+        self.assertEqual(len(loaded), 1)
+        (result, complete), = loaded
+        if complete:
+            self.assertEqual(result, data)
+        else:
+            self.assertEqual(result, storage.summarise_poll_data(data))
+
+    def test_move_poll(self):
+        data = make_poll_data()
+        self.s.write_poll(data)
+        self.s.move_poll(data["id"],
+                         storage.PollLocation.ACTIVE,
+                         storage.PollLocation.ARCHIVE)
+
+        self.assertFalse(self.s.has_poll(data["id"]))
+        self.assertTrue(
+            self.s.has_poll(data["id"], storage.PollLocation.ARCHIVE)
+        )
+        self.assertSequenceEqual(list(self.s.load_active_polls()), [])
+        self.assertEqual(
+            self.s.load_poll(data["id"], storage.PollLocation.ARCHIVE),
+            data,
+        )
+
+    def test_delete_poll(self):
+        data = make_poll_data()
+        self.s.write_poll(data, storage.PollLocation.TRASH)
+        self.s.delete_poll(data["id"])
+        self.assertSequenceEqual(
+            self.s.list_polls(storage.PollLocation.TRASH),
+            [],
+        )
+
+    def test_member_state(self):
+        self.assertIsNone(self.s.read_member_state("alice"))
+        data = {"last_message": {"message_id": "m1", "transaction": None},
+                "journal_seq": 3}
+        self.s.write_member_state("alice", data)
+        self._reopen()
+        self.assertEqual(self.s.read_member_state("alice"), {
+            "last_message": {"message_id": "m1"},
+            "journal_seq": 3,
+        } if self._drops_none else data)
+        self.assertSequenceEqual(self.s.list_members(), ["alice"])
+
+
+class TestTomlStorage(StorageTestMixin, unittest.TestCase):
+    # TOML has no null value
+    _drops_none = True
+
+    def _make_storage(self):
+        return storage.TomlStorage(self.statedir)
+
+    def test_load_active_polls_uses_cache(self):
+        data = make_poll_data()
+        self.s.write_poll(data)
+        with unittest.mock.patch.object(storage.SnapshotCache,
+                                        "RACY_WINDOW_NS", 0):
+            self._reopen()
+            (result, complete), = self.s.load_active_polls()
+        self.assertFalse(complete)
+        self.assertEqual(result, storage.summarise_poll_data(data))
+
+        (result, complete), = self.s.load_active_polls(rebuild_cache=True)
+        self.assertTrue(complete)
+        self.assertEqual(result, data)
+
+    def test_sync_fsyncs_directories(self):
+        self.s.close()
+        self.s = storage.TomlStorage(self.statedir, storage.Durability.GROUP)
+        with unittest.mock.patch.object(storage, "fsync_dir") as fsync_dir:
+            self.s.sync()
+
+        self.assertCountEqual(
+            [call[0][0] for call in fsync_dir.call_args_list],
+            [self.statedir / "polls" / "active",
+             self.statedir / "polls" / "archive",
+             self.statedir / "polls" / "trash",
+             self.statedir / "members"],
+        )
+
+
+class TestSqliteStorage(StorageTestMixin, unittest.TestCase):
+    _drops_none = False
+
+    def _make_storage(self):
+        return storage.SqliteStorage(self.statedir / storage.SQLITE_FILE)
+
+    def test_uses_wal(self):
+        mode, = self.s._conn.execute("PRAGMA journal_mode").fetchone()
+        self.assertEqual(mode, "wal")
+
+    def test_sync_checkpoints_wal(self):
+        self.s.close()
+        path = self.statedir / storage.SQLITE_FILE
+        self.s = storage.SqliteStorage(path, storage.Durability.GROUP)
+        self.s.write_poll(make_poll_data("the_poll_id"))
+        self.assertNotIn(b"the_poll_id", path.read_bytes())
+
+        self.s.sync()
+
+        self.assertIn(b"the_poll_id", path.read_bytes())
+
+    def test_move_poll_fails_for_unknown_poll(self):
+        with self.assertRaises(FileNotFoundError):
+            self.s.move_poll("foo",
+                             storage.PollLocation.ACTIVE,
+                             storage.PollLocation.ARCHIVE)
+
+
+class TestMemoryStorage(StorageTestMixin, unittest.TestCase):
+    _drops_none = False
+
+    def _make_storage(self):
+        return storage.MemoryStorage()
+
+    def _reopen(self):
+        # there is nothing to reopen
+        pass
+
+    def test_copies_data(self):
+        data = make_poll_data()
+        self.s.write_poll(data)
+        data["subject"] = "changed"
+        self.assertEqual(self.s.load_poll(data["id"])["subject"],
+                         "accept foo")
+        self.s.load_poll(data["id"])["subject"] = "changed"
+        self.assertEqual(self.s.load_poll(data["id"])["subject"],
+                         "accept foo")
+
+
+class TestMakeStorage(unittest.TestCase):
+    def test_rejects_unknown_backend(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(ValueError):
+                storage.make_storage("foo", pathlib.Path(tmpdir))
+
+
+class TestMigrate(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.statedir = pathlib.Path(self.tmpdir.name)
+        self.members = [
+            aioxmpp.JID.fromstr("alice@domain.example"),
+            aioxmpp.JID.fromstr("bob@domain.example"),
+        ]
+        self.config = {
+            "council": {
+                "members": [
+                    {"address": member, "nick": member.localpart}
+                    for member in self.members
+                ],
+            },
+            "state": {
+                "directory": str(self.statedir),
+            },
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_state_survives_migration_to_sqlite(self):
+        s = state.State(self.config)
+        _, poll_id = s.create_poll(self.members[0], "m1", "foo")
+        s.cast_vote(self.members[1], "m2", poll_id,
+                    state.VoteValue.ACK, "lgtm")
+        _, trashed_id = s.create_poll(self.members[0], "m3", "bar")
+        s.revert_last_transaction(self.members[0], "m3")
+        s.compact_journal()
+        s.close()
+
+        storage.migrate(
+            storage.make_storage("toml", self.statedir),
+            storage.make_storage("sqlite", self.statedir),
+        )
+
+        self.config["state"]["backend"] = "sqlite"
+        s = state.State(self.config)
+        try:
+            self.assertSequenceEqual(list(s.active_polls), [poll_id])
+            self.assertEqual(
+                s.get_poll(poll_id).get_votes(self.members[1])[-1].remark,
+                "lgtm",
+            )
+            self.assertTrue(
+                s._storage.has_poll(trashed_id, storage.PollLocation.TRASH)
+            )
+        finally:
+            s.close()
+
+    def test_refuses_non_empty_destination(self):
+        dest = storage.make_storage("sqlite", self.statedir)
+        try:
+            dest.write_member_state("alice", {"foo": "bar"})
+            with self.assertRaises(ValueError):
+                storage.migrate(storage.MemoryStorage(), dest)
+        finally:
+            dest.close()
+
+    def test_round_trip_does_not_resurrect_polls(self):
+        s = state.State(self.config)
+        _, poll_id = s.create_poll(self.members[0], "m1", "foo")
+        s.compact_journal()
+        s.close()
+        storage.migrate(
+            storage.make_storage("toml", self.statedir),
+            storage.make_storage("sqlite", self.statedir),
+        )
+
+        self.config["state"]["backend"] = "sqlite"
+        s = state.State(self.config)
+        s._archive_poll(poll_id)
+        s.close()
+
+        # the TOML files of the first migration are still there
+        with self.assertRaises(ValueError):
+            storage.migrate(
+                storage.make_storage("sqlite", self.statedir),
+                storage.make_storage("toml", self.statedir),
+            )
+
+        shutil.rmtree(str(self.statedir / "polls"))
+        shutil.rmtree(str(self.statedir / "members"))
+        storage.migrate(
+            storage.make_storage("sqlite", self.statedir),
+            storage.make_storage("toml", self.statedir),
+        )
+
+        del self.config["state"]["backend"]
+        s = state.State(self.config)
+        try:
+            self.assertSequenceEqual(list(s.active_polls), [])
+            self.assertTrue(
+                s._storage.has_poll(poll_id, storage.PollLocation.ARCHIVE)
+            )
+        finally:
+            s.close()